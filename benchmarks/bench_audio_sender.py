@@ -0,0 +1,117 @@
+"""
+    audio send path under different uplinks: frames handed straight to the deepgram sdk (how send_audio used to work)
+    against the AudioSender, which coalesces frames while the socket buffers are backed up.
+
+    * a simulated live connection mimics the sdk: send() queues the message, a task writes one message at a time
+      to a link with a bandwidth and a fixed cost per message (framing, acks), the message being written shows up
+      as the transport write buffer.
+    * every link is fed real time 2-channel audio (one mixer chunk every 128ms).
+    * reports the messages sent, the latency from a frame being mixed to it being on the network, and the
+      audio still waiting when the run ends.
+
+    usage: python benchmarks/bench_audio_sender.py --seconds 10
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from audio_sender import AudioSender, live_buffered_bytes
+
+FRAME_BYTES = 1024 * 4 * 2 # one stereo mixer chunk
+FRAME_SECONDS = 0.128
+BYTES_PER_SECOND = 32000 * 2
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+class SimulatedLive:
+    def __init__(self, bandwidth, per_message, stall=None):
+        self.bandwidth = bandwidth # bytes per second
+        self.per_message = per_message # seconds
+        self.stall = stall # (start, end) seconds without any bandwidth
+        self._queue = asyncio.Queue()
+        self._socket = SimpleNamespace(transport=self)
+        self.writing = 0
+        self.sent_bytes = 0
+        self.messages = 0
+        self.sent_at = [] # (total bytes on the network, time)
+        self.started = time.perf_counter()
+        self.task = asyncio.get_running_loop().create_task(self._write())
+
+    def send(self, data):
+        self._queue.put_nowait((False, data))
+
+    def get_write_buffer_size(self):
+        return self.writing
+
+    async def _write(self):
+        while True:
+            _, body = await self._queue.get()
+            self.writing = len(body)
+            if self.stall is not None:
+                now = time.perf_counter() - self.started
+                if self.stall[0] <= now < self.stall[1]:
+                    await asyncio.sleep(self.stall[1] - now)
+            await asyncio.sleep(self.per_message + len(body) / self.bandwidth)
+            self.writing = 0
+            self.sent_bytes += len(body)
+            self.messages += 1
+            self.sent_at.append((self.sent_bytes, time.perf_counter()))
+
+async def feed(args, name, link, coalesce):
+    live = SimulatedLive(*link)
+    sender = None
+    if coalesce:
+        sender = AudioSender(live.send, lambda: live_buffered_bytes(live), BYTES_PER_SECOND)
+        sender.start()
+    frames = int(args.seconds / FRAME_SECONDS)
+    produced = [] # (total bytes mixed, time)
+    start = time.perf_counter()
+    for i in range(frames):
+        delay = start + i * FRAME_SECONDS - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        frame = bytes(FRAME_BYTES)
+        produced.append(((i + 1) * FRAME_BYTES, time.perf_counter()))
+        if sender is not None:
+            sender.put(frame)
+        else:
+            live.send(frame)
+    await asyncio.sleep(FRAME_SECONDS)
+    latencies = []
+    sent = iter(live.sent_at)
+    sent_bytes, sent_time = next(sent, (0, None))
+    for total, produced_time in produced:
+        while sent_time is not None and sent_bytes < total:
+            sent_bytes, sent_time = next(sent, (0, None))
+        if sent_time is None:
+            break
+        latencies.append(sent_time - produced_time)
+    waiting = frames * FRAME_BYTES - live.sent_bytes
+    mode = 'AudioSender' if coalesce else 'direct'
+    print(f'{name:<8} {mode:<12} {live.messages:5d} messages, latency p50 {percentile(latencies, 50) * 1000:6.0f}ms, '
+          f'p95 {percentile(latencies, 95) * 1000:6.0f}ms, max {max(latencies, default=0) * 1000:6.0f}ms, '
+          f'{waiting / BYTES_PER_SECOND:5.1f}s still waiting')
+    if sender is not None:
+        sender.stop()
+    live.task.cancel()
+
+async def main(args):
+    links = {
+        'fast': (1_000_000, 0.005, None),
+        'slow': (100_000, 0.08, None), # enough bandwidth, but the cost per message adds up
+        'stall': (1_000_000, 0.005, (args.seconds * 0.3, args.seconds * 0.6)),
+    }
+    await asyncio.gather(*(feed(args, name, link, coalesce) for name, link in links.items() for coalesce in (False, True)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='audio send path benchmark')
+    parser.add_argument('--seconds', type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""
+    batch transcription benchmark, runs against the local Deepgram stand-in so no api calls are made.
+
+    * writes synthetic 2-channel .lin16 recordings of tone bursts (each burst a known frequency, channel and time).
+    * transcribes them with 1 worker and with --workers workers against a server accepting --max-concurrent requests
+      at once (the rest get 429s), and reports the speed against real time, retries and rate limited answers.
+    * checks the stitched result: every burst must come back once, on its speaker, within 0.1s of its real start.
+
+    usage: python benchmarks/bench_batch_transcription.py --recordings 4 --minutes 10 --workers 16 --max-concurrent 6
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from batch_transcriber import BatchTranscriber, Recording, SPEAKERS
+from mock_deepgram_server import MockDeepgramServer
+
+RATE = 16000
+PORT = 8091
+
+# tone bursts alternating between channels with gaps, returns the audio and the (start, speaker, text) of each burst
+def synthetic_recording(minutes, seed):
+    generator = np.random.default_rng(seed)
+    frames = int(minutes * 60 * RATE)
+    audio = np.zeros((frames, 2), dtype=np.int16)
+    bursts = []
+    position = 0.5
+    channel = 0
+    while True:
+        length = generator.uniform(0.4, 2.0)
+        if (position + length) * RATE >= frames:
+            break
+        frequency = int(generator.integers(30, 150)) * 10
+        start = int(position * RATE)
+        t = np.arange(int(length * RATE)) / RATE
+        audio[start:start + len(t), channel] = (6000 * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+        bursts.append((position, SPEAKERS[channel], f'tone {frequency}'))
+        position += length + generator.uniform(0.2, 1.5)
+        channel = int(generator.integers(0, 2))
+    return audio, bursts
+
+def check(utterances, bursts):
+    missing = 0
+    remaining = list(utterances)
+    for start, speaker, text in bursts:
+        match = next((u for u in remaining if u[2] == speaker and u[3] == text and abs(u[0] - start) < 0.1), None)
+        if match is None:
+            missing += 1
+        else:
+            remaining.remove(match)
+    return missing, len(remaining)
+
+async def bench(args, recordings, expected, workers):
+    transcriber = BatchTranscriber('mock', f'http://127.0.0.1:{PORT}', workers=workers)
+    start = time.perf_counter()
+    results = await transcriber.transcribe(recordings, args.chunk_seconds)
+    elapsed = time.perf_counter() - start
+    audio_seconds = sum(recording.duration for recording in recordings)
+    missing, extra = 0, 0
+    for utterances, bursts in zip(results, expected):
+        result = check(utterances, bursts)
+        missing += result[0]
+        extra += result[1]
+    print(f'{workers} workers: {audio_seconds:.0f}s of audio in {elapsed:.2f}s ({audio_seconds / elapsed:.0f}x real time), '
+          f'{transcriber.retries} retries, {transcriber.limiter.rate_limited_count} rate limited, {transcriber.failed_chunks} failed chunks, '
+          f'final limit {transcriber.limiter.limit}')
+    print(f'  stitching: {sum(len(b) for b in expected)} bursts, {missing} missing or misplaced, {extra} unexpected')
+
+async def main(args):
+    server = MockDeepgramServer(args.latency, args.seconds_per_audio_second, args.max_concurrent, retry_after=args.retry_after, seed=1)
+    await server.start(port=PORT)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            recordings, expected = [], []
+            for i in range(args.recordings):
+                audio, bursts = synthetic_recording(args.minutes, i)
+                path = os.path.join(directory, f'recording{i}.lin16')
+                audio.tofile(path)
+                recordings.append(Recording(path, 2))
+                expected.append(bursts)
+            for workers in (1, args.workers):
+                server.max_active = 0
+                await bench(args, recordings, expected, workers)
+                print(f'  server: {server.max_active} requests at once, {server.rate_limited} answered 429 so far')
+            del recordings # release the memory maps before the directory is removed
+    finally:
+        await server.stop()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='batch transcription benchmark')
+    parser.add_argument('--recordings', type=int, default=4)
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--chunk-seconds', type=float, default=60)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--max-concurrent', type=int, default=6, help='server concurrency before 429s')
+    parser.add_argument('--retry-after', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--seconds-per-audio-second', type=float, default=0.02)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
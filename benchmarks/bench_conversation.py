@@ -0,0 +1,103 @@
+"""
+    conversation mode benchmark, runs against the local mock server so no api calls are made.
+
+    * a synthetic interview transcript grows by --segments-per-ask segments between asks, for --asks asks.
+    * each ask goes through GPTController.send_prompt with the whole transcript filled in the stage prompt,
+      and through send_conversation_prompt, which only adds the new transcript to the history.
+    * reports the input tokens per ask and in total for both, the new tokens of the conversation asks, and how many
+      conversation requests kept the previous request as their prefix (what a provider prompt cache can reuse).
+    * the difference in input tokens only comes from compaction leaving out the old transcript, every conversation
+      request is still billed in full. the prefix reuse shows up as the tokens a provider cache could skip, it is not
+      measured here.
+
+    usage: python benchmarks/bench_conversation.py --asks 30 --segments-per-ask 40 --max-tokens 6000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from gpt_controller import GPTController, estimate_tokens
+from conversation import Conversation
+from prompts import base_prompts, fill_prompt
+from mock_openai_server import MockOpenAIServer
+
+PORT = 8092
+WORDS = 'so tell me about a project where you had to make a hard tradeoff between quality and the deadline'.split()
+
+def token_counter():
+    try:
+        import tiktoken
+    except ImportError:
+        print('tiktoken not installed, estimating tokens from the length')
+        return estimate_tokens
+    encoder = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoder.encode(text))
+
+def transcript_segments():
+    i = 0
+    while True:
+        speaker = 'user' if (i // 3) % 2 == 0 else 'system'
+        prefix = f'\n{speaker}: ' if i % 3 == 0 else ' '
+        yield prefix + ' '.join(WORDS[(i * 7 + j) % len(WORDS)] for j in range(12))
+        i += 1
+
+async def main(args):
+    server = MockOpenAIServer(ttft=0.01, tokens_per_sec=2000, answer_tokens=args.answer_tokens)
+    await server.start(port=PORT)
+    base_url = f'http://127.0.0.1:{PORT}/v1'
+    count_tokens = token_counter()
+    single = GPTController('mock', base_url)
+    conversational = GPTController('mock', base_url, http_client=single.http_client)
+    conversational.conversation = Conversation(count_tokens, args.max_tokens, args.tail_tokens)
+    prompt = base_prompts['interview_candidate']
+    segments = transcript_segments()
+    transcription = ''
+    single_total, conversation_total, new_total, reused_total, prefix_kept = 0, 0, 0, 0, 0
+    previous = None
+    print(f"{'ask':>4} {'transcript':>11} {'single':>8} {'conversation':>13} {'new':>6}")
+    for ask in range(1, args.asks + 1):
+        transcription += ''.join(next(segments) for _ in range(args.segments_per_ask))
+        final_prompt = fill_prompt(prompt, transcription + '\n')
+        single_tokens = count_tokens(final_prompt)
+        await single.send_prompt(final_prompt, prompt_tokens=single_tokens)
+        await single.active_request.task
+        single.answer_buffer.drain()
+
+        await conversational.send_conversation_prompt(prompt, transcription + '\n')
+        await conversational.active_request.task
+        conversational.answer_buffer.drain()
+        messages = server.last_messages
+        if previous is not None and messages[:len(previous)] == previous:
+            prefix_kept += 1
+        previous = messages + [{'role': 'assistant', 'content': ''.join(conversational.active_request.answer)}]
+        conversation_tokens = conversational.active_request.prompt_tokens
+        new_tokens = conversational.conversation.new_tokens - new_total
+        single_total += single_tokens
+        conversation_total += conversation_tokens
+        new_total += new_tokens
+        reused_total += conversation_tokens - new_tokens
+        print(f'{ask:4d} {count_tokens(transcription):11d} {single_tokens:8d} {conversation_tokens:13d} {new_tokens:6d}')
+    saving = 1 - conversation_total / single_total
+    # fewer tokens only come from compaction leaving out the old transcript, more from the earlier asks and answers
+    # the history carries
+    reason = 'less, compaction left out the old transcript' if saving >= 0 else 'more, the history carries the earlier asks and answers'
+    print(f'total input tokens: single prompt {single_total}, conversation {conversation_total} '
+          f'({abs(saving) * 100:.0f}% {reason}), new {new_total}')
+    print(f'{reused_total} conversation input tokens repeat the previous request (a provider prompt cache could reuse them, '
+          f'they are billed in full here)')
+    print(f'{prefix_kept} of {args.asks - 1} conversation requests started with the previous request and its answer')
+    await single.http_client.aclose()
+    await server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='conversation mode benchmark')
+    parser.add_argument('--asks', type=int, default=30)
+    parser.add_argument('--segments-per-ask', type=int, default=40)
+    parser.add_argument('--answer-tokens', type=int, default=80)
+    parser.add_argument('--max-tokens', type=int, default=6000)
+    parser.add_argument('--tail-tokens', type=int, default=1500)
+    asyncio.run(main(parser.parse_args()))
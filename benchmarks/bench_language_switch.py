@@ -0,0 +1,191 @@
+"""
+    language switch benchmark: what reaches the transcript when the language changes mid-call.
+
+    * a stand-in deepgram client reads word ids encoded in the audio (each 0.25s of audio is one word, the sample
+      value is its id) and answers segments of about --segment-seconds with word timings, like the live api. each
+      channel has its own segment boundaries, words are tagged with the language of the connection.
+    * audio is fed in real time (or --speed times faster) and the language is changed at --switch-at seconds:
+      with DeepgramTranscriber.switch_language (overlapped connections), and by closing the connection and opening
+      a new one (what changing language needed before).
+    * --stall START END stalls the uplink (the socket write buffers read full) from START to END seconds of audio, past
+      30s the AudioSender drops the oldest frames and the deepgram stream times no longer match the audio fed.
+    * checks every word comes back exactly once and in order on each channel, and reports the words lost (and how many
+      of them never reached deepgram: dropped while reconnecting or by the AudioSender), repeated or out of order and
+      when the new language took over.
+
+    usage: python benchmarks/bench_language_switch.py --seconds 20 --switch-at 6 --connect-delay 0.4
+           python benchmarks/bench_language_switch.py --speed 4 --seconds 60 --switch-at 38 --stall 2 40
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from live_transcriber import DeepgramTranscriber
+from stream_buffer import SignalQueue
+
+RATE = 16000
+CHANNELS = 2
+WORD_SECONDS = 0.25
+CHUNK_FRAMES = 2048 # one mixer chunk
+
+class StandInLive:
+    event = SimpleNamespace(TRANSCRIPT_RECEIVED='transcript', CLOSE='close')
+
+    def __init__(self, args, options, client):
+        self.args = args
+        self.client = client
+        self._socket = SimpleNamespace(transport=self)
+        self.language = options['language']
+        self.handlers = {}
+        self.frames = 0 # frames received, the stream time
+        self.words = [[] for _ in range(CHANNELS)] # per channel: [id, start, end] of the words of the open segment
+        self.segment_start = [0.0] * CHANNELS
+        self.closed = False
+
+    # read by live_buffered_bytes, a full buffer while the uplink is stalled
+    def get_write_buffer_size(self):
+        return 1 << 30 if self.client.stalled() else 0
+
+    def register_handler(self, event, handler):
+        self.handlers[event] = handler
+
+    def send(self, data):
+        if self.closed:
+            return
+        audio = np.frombuffer(data, dtype=np.int16).reshape(-1, CHANNELS)
+        start = self.frames / RATE
+        self.frames += len(audio)
+        for channel in range(CHANNELS):
+            samples = audio[:, channel]
+            # runs of the same value are words
+            edges = np.flatnonzero(np.diff(samples)) + 1
+            for run_start, run_end in zip(np.concatenate(([0], edges)), np.concatenate((edges, [len(samples)]))):
+                word_id = int(samples[run_start])
+                self.client.received[channel].add(word_id)
+                words = self.words[channel]
+                if words and words[-1][0] == word_id:
+                    words[-1][2] = start + run_end / RATE
+                    continue
+                # a word ended, close the segment when it is long enough
+                if words and words[-1][2] - self.segment_start[channel] >= self.args.segment_seconds * (1 + 0.3 * channel):
+                    self._answer(channel)
+                self.words[channel].append([word_id, start + run_start / RATE, start + run_end / RATE])
+
+    def _answer(self, channel):
+        words = self.words[channel]
+        segment_start = self.segment_start[channel]
+        segment_end = words[-1][2]
+        self.words[channel] = []
+        self.segment_start[channel] = segment_end
+        result = {
+            'channel_index': [channel, CHANNELS],
+            'start': segment_start,
+            'duration': segment_end - segment_start,
+            'is_final': True,
+            'channel': {'alternatives': [{
+                'transcript': ' '.join(f'{self.language}:{word_id}' for word_id, _, _ in words),
+                'words': [{'word': f'{self.language}:{word_id}', 'start': word_start, 'end': word_end} for word_id, word_start, word_end in words],
+            }]},
+        }
+        loop = asyncio.get_running_loop()
+        loop.call_later(self.args.latency, lambda: None if self.closed else loop.create_task(self.handlers['transcript'](result)))
+
+    # like deepgram, the open segments are answered before the connection closes
+    async def finish(self):
+        for channel in range(CHANNELS):
+            if self.words[channel]:
+                self._answer(channel)
+        await asyncio.sleep(self.args.latency * 1.5)
+        self.closed = True
+
+class StandInClient:
+    def __init__(self, args):
+        self.args = args
+        self.transcription = self
+        self.received = [set() for _ in range(CHANNELS)] # word ids that reached any connection
+        self.started = None
+
+    def stalled(self):
+        if self.args.stall is None or self.started is None:
+            return False
+        audio_time = (time.perf_counter() - self.started) * self.args.speed
+        return self.args.stall[0] <= audio_time < self.args.stall[1]
+
+    async def live(self, options):
+        await asyncio.sleep(self.args.connect_delay)
+        return StandInLive(self.args, options, self)
+
+async def run(args, overlapped):
+    transcriber = DeepgramTranscriber('bench')
+    client = StandInClient(args)
+    transcriber.client = client
+    transcriber.dedup = None
+    results = SignalQueue()
+    await transcriber.initialize(results, 'en', CHANNELS, True)
+    chunks = int(args.seconds * RATE / CHUNK_FRAMES)
+    switch_chunk = int(args.switch_at * RATE / CHUNK_FRAMES)
+    started = time.perf_counter()
+    client.started = started
+    switch_task = None
+    for i in range(chunks):
+        delay = started + i * CHUNK_FRAMES / RATE / args.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if i == switch_chunk:
+            if overlapped:
+                switch_task = asyncio.create_task(transcriber.switch_language('fr'))
+            else:
+                # the old way: close and open a new connection, audio is dropped meanwhile
+                async def restart():
+                    await transcriber.close()
+                    await transcriber.initialize(results, 'fr', CHANNELS, True)
+                switch_task = asyncio.create_task(restart())
+        frame = np.arange(i * CHUNK_FRAMES, (i + 1) * CHUNK_FRAMES) / RATE
+        word_ids = (frame / WORD_SECONDS).astype(np.int16) + 1
+        transcriber.send_audio(np.repeat(word_ids, CHANNELS).tobytes())
+    await switch_task
+    await asyncio.sleep(args.latency * 2 + 0.5)
+    await transcriber.close()
+
+    # words of each channel, in transcript order
+    words = {'user': [], 'system': []}
+    while not results.empty():
+        msg_type, text = results.get_nowait()
+        speaker = 'user' if msg_type == 'user_msg' else 'system'
+        for token in text.replace('user:', ' ').replace('system:', ' ').split():
+            language, word_id = token.split(':')
+            words[speaker].append((int(word_id), language))
+    name = 'overlapped switch' if overlapped else 'close and reopen'
+    print(f'{name}:')
+    for channel, (speaker, spoken) in enumerate(words.items()):
+        ids = [word_id for word_id, _ in spoken]
+        fed = set(range(1, int(chunks * CHUNK_FRAMES / RATE / WORD_SECONDS) + 1))
+        lost = fed - set(ids)
+        never_sent = lost - client.received[channel]
+        repeated = len(ids) - len(set(ids))
+        out_of_order = sum(1 for a, b in zip(ids, ids[1:]) if b <= a)
+        french = [word_id for word_id, language in spoken if language == 'fr']
+        takeover = f'fr from word {french[0]} ({(french[0] - 1) * WORD_SECONDS - args.switch_at:+.2f}s after the change)' if french else 'no fr words'
+        print(f'  {speaker}: {len(ids)} words, {len(lost)} lost ({len(never_sent)} never reached deepgram), {repeated} repeated, {out_of_order} out of order, {takeover}')
+
+async def main(args):
+    await run(args, overlapped=False)
+    await run(args, overlapped=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='language switch benchmark')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--switch-at', type=float, default=6)
+    parser.add_argument('--segment-seconds', type=float, default=1.5)
+    parser.add_argument('--latency', type=float, default=0.3, help='seconds from the end of a segment to its result')
+    parser.add_argument('--connect-delay', type=float, default=0.4, help='seconds to open a connection')
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--stall', type=float, nargs=2, metavar=('START', 'END'), help='seconds of audio the uplink is stalled')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,187 @@
+"""
+    LLM latency benchmark, runs against the local mock server so no api calls are made.
+
+    * single: sequential asks through GPTController.send_prompt, reports time to first token and tokens/s.
+    * concurrent: panel asks of several prompts at once, reports total time against the slowest single answer.
+    * render: asks through the Tk GUI consume loop, reports when the first and the last text is shown.
+
+    usage: python benchmarks/bench_llm_latency.py --asks 10 --concurrency 5 --ttft 0.3 --tokens-per-sec 80
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from gpt_controller import GPTController
+from stream_buffer import SignalQueue
+from mock_openai_server import MockOpenAIServer
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def report(name, values, unit='ms', scale=1000):
+    if not values:
+        print(f'  {name}: no samples')
+        return
+    print(f'  {name}: median {percentile(values, 50) * scale:.1f}{unit}, p95 {percentile(values, 95) * scale:.1f}{unit}, max {max(values) * scale:.1f}{unit} (n={len(values)})')
+
+def expected_answer_chars(answer_tokens):
+    return sum(len(f'tok{i} ') for i in range(answer_tokens))
+
+async def bench_single(args, base_url):
+    gpt_controller = GPTController('mock', base_url)
+    ttfts, rates, errors = [], [], 0
+    for i in range(args.asks):
+        request_id = gpt_controller.new_request_id()
+        await gpt_controller.send_prompt(f'benchmark prompt {i}', request_id)
+        request = gpt_controller.active_request
+        await request.task
+        gpt_controller.answer_buffer.drain()
+        if request.first_chunk is None or request.finished is None:
+            errors += 1
+            continue
+        ttfts.append(request.first_chunk - request.started)
+        rates.append((request.tokens - 1) / (request.finished - request.first_chunk))
+    print(f'single asks ({errors} errors):')
+    report('time to first token', ttfts)
+    report('tokens/s', rates, unit='', scale=1)
+    await gpt_controller.http_client.aclose()
+
+async def bench_concurrent(args, base_url, server: MockOpenAIServer):
+    gpt_controller = GPTController('mock', base_url)
+    gpt_controller.max_panel_streams = args.concurrency
+    server.max_active_streams = 0
+    totals, slowests, ttfts, rates = [], [], [], []
+    for round_index in range(args.rounds):
+        prompts = {f'prompt_{i}': f'benchmark panel prompt {round_index}.{i}' for i in range(args.concurrency)}
+        request_id = gpt_controller.new_panel_request_id()
+        start = time.perf_counter()
+        await gpt_controller.send_panel_prompts(prompts, request_id)
+        total = time.perf_counter() - start
+        requests = [request for request in gpt_controller.panel_requests if request.finished is not None]
+        for name in prompts:
+            gpt_controller.panel_buffer(name).drain()
+        if not requests:
+            continue
+        totals.append(total)
+        slowests.append(max(request.finished - request.started for request in requests))
+        ttfts.extend(request.first_chunk - request.started for request in requests)
+        rates.append(sum(request.tokens for request in requests) / total)
+    print(f'concurrent asks ({args.concurrency} prompts per click, {server.max_active_streams} streams seen at once by the server):')
+    report('total click latency', totals)
+    report('slowest single answer', slowests)
+    report('time to first token', ttfts)
+    report('aggregate tokens/s', rates, unit='', scale=1)
+    await gpt_controller.http_client.aclose()
+
+# minimal transcription controller so the GUI can be built without audio devices
+class NoAudio:
+    def get_device_count(self):
+        return 0
+
+class StandInTranscriptionController:
+    def __init__(self):
+        self.p = NoAudio()
+        self.transcriptions_queue = SignalQueue(10)
+        self.audio_stream_0 = None
+        self.audio_stream_1 = None
+
+def bench_render(args, base_url):
+    import tkinter as tk
+    from app_gui import AppGUI
+
+    loop = asyncio.new_event_loop()
+    loop_thread = Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    gpt_controller = GPTController('mock', base_url)
+    try:
+        app_gui = AppGUI(loop, None, device_cache_path=None)
+        app_gui.attach(StandInTranscriptionController(), gpt_controller)
+    except tk.TclError as e:
+        print(f'render: skipped, no display ({e})')
+        loop.call_soon_threadsafe(loop.stop)
+        return
+    expected = expected_answer_chars(args.answer_tokens)
+    first_render, last_render = [], []
+
+    def ask(i):
+        if i == args.asks:
+            app_gui.root.quit()
+            return
+        textbox = app_gui.textbox_right
+        textbox.configure(state='normal')
+        textbox.delete('1.0', tk.END)
+        textbox.configure(state='disabled')
+        request_id = gpt_controller.new_request_id()
+        asyncio.run_coroutine_threadsafe(gpt_controller.send_prompt(f'benchmark prompt {i}', request_id), loop)
+        poll(i, time.perf_counter(), None)
+
+    # checks the answer textbox every 2ms to see when text shows up
+    def poll(i, start, first):
+        now = time.perf_counter()
+        length = len(app_gui.textbox_right.get('1.0', 'end-1c'))
+        if first is None and length > 0:
+            first = now
+            first_render.append(now - start)
+        if length >= expected:
+            last_render.append(now - start)
+            app_gui.root.after(50, ask, i + 1)
+        elif now - start > 60:
+            print(f'render: ask {i} timed out')
+            app_gui.root.after(50, ask, i + 1)
+        else:
+            app_gui.root.after(2, poll, i, start, first)
+
+    app_gui.root.after(200, ask, 0)
+    app_gui.run_mainloop()
+    app_gui.wakeup.close()
+    app_gui.root.destroy()
+    asyncio.run_coroutine_threadsafe(gpt_controller.http_client.aclose(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join()
+    print('render through the GUI:')
+    report('first text shown', first_render)
+    report('whole answer shown', last_render)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='LLM latency benchmark against a local mock server')
+    parser.add_argument('--asks', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--ttft', type=float, default=0.3)
+    parser.add_argument('--tokens-per-sec', type=float, default=80)
+    parser.add_argument('--answer-tokens', type=int, default=100)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--skip-render', action='store_true', help='skip the Tk render benchmark')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    base_url = f'http://127.0.0.1:{args.port}/v1'
+    server = MockOpenAIServer(args.ttft, args.tokens_per_sec, args.answer_tokens, args.error_rate, seed=0)
+
+    # server runs on its own loop thread, like the app's asyncio thread
+    server_loop = asyncio.new_event_loop()
+    server_thread = Thread(target=server_loop.run_forever, daemon=True)
+    server_thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(port=args.port), server_loop).result()
+
+    try:
+        asyncio.run(bench_single(args, base_url))
+        asyncio.run(bench_concurrent(args, base_url, server))
+        if not args.skip_render:
+            bench_render(args, base_url)
+    finally:
+        asyncio.run_coroutine_threadsafe(server.stop(), server_loop).result()
+        server_loop.call_soon_threadsafe(server_loop.stop)
+        server_thread.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+    multi-session service load test: how many concurrent 2-channel sessions one core sustains.
+
+    * the service runs in its own process pinned to one core (where the os allows it), with a stand-in transcriber
+      that checks the level of each channel and emits a transcript segment every 2s of audio instead of calling Deepgram.
+    * each simulated client streams real time 2-channel 16kHz audio (one mixer chunk every 128ms) and pings the service every second.
+    * the number of sessions grows level by level. a level is sustained when every byte of audio arrived in time
+      and the ping round trip (which goes through the same sender as the transcripts) stays under --max-latency.
+
+    usage: python benchmarks/bench_sessions.py --levels 25,50,100,200,400,800 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+import aiohttp
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+CHANNELS = 2
+RATE = 16000
+CHUNK_BYTES = 1024 * 4 * CHANNELS # AudioMixer chunk_size per channel, interleaved
+CHUNK_SECONDS = CHUNK_BYTES / (2 * CHANNELS * RATE)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+class StandInTranscriber:
+    def __init__(self):
+        self.results_queue = None
+        self.channels = 1
+        self.samples = 0
+        self.segments = 0
+
+    async def initialize(self, results_queue, language, channels, multichannel):
+        self.results_queue = results_queue
+        self.channels = channels
+        return True
+
+    def send_audio(self, chunk):
+        audio = np.frombuffer(chunk, dtype=np.int16).reshape(-1, self.channels)
+        levels = np.abs(audio).mean(axis=0)
+        self.samples += len(audio)
+        if self.samples < 2 * RATE:
+            return
+        self.samples -= 2 * RATE
+        self.segments += 1
+        msg_type = 'user_msg' if self.segments % 2 else 'system_msg'
+        self.results_queue.put_nowait((msg_type, f' segment {self.segments} level {levels.max():.0f}'))
+
+    async def close(self):
+        pass
+
+def run_service(port, cpu):
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+    from session_service import SessionService
+
+    async def serve():
+        service = SessionService('load-test', StandInTranscriber)
+        await service.start(port=port)
+        await asyncio.Event().wait()
+    asyncio.run(serve())
+
+class Client:
+    def __init__(self, http: aiohttp.ClientSession, url):
+        self.http = http
+        self.url = url
+        self.ws = None
+        self.rtts = []
+        self.transcripts = 0
+        self.sent_bytes = 0
+        self.send_lag = 0.0 # worst delay of a frame against its schedule
+        self.connected = asyncio.Event()
+
+    async def run(self, stop: asyncio.Event):
+        self.ws = await self.http.ws_connect(self.url)
+        self.connected.set()
+        receiver = asyncio.create_task(self._receive())
+        # noise with a bit of signal so the level check has something to do
+        frame = (np.random.default_rng(0).normal(0, 1000, CHUNK_BYTES // 2)).astype(np.int16).tobytes()
+        start = time.perf_counter()
+        next_ping = start
+        i = 0
+        while not stop.is_set():
+            now = time.perf_counter()
+            self.send_lag = max(self.send_lag, now - (start + i * CHUNK_SECONDS))
+            await self.ws.send_bytes(frame)
+            self.sent_bytes += len(frame)
+            if now >= next_ping:
+                await self.ws.send_str(json.dumps({'type': 'ping', 'time': now}))
+                next_ping += 1
+            i += 1
+            await asyncio.sleep(max(0, start + i * CHUNK_SECONDS - time.perf_counter()))
+        await self.ws.close()
+        receiver.cancel()
+
+    async def _receive(self):
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            message = json.loads(msg.data)
+            if message['type'] == 'pong':
+                self.rtts.append(time.perf_counter() - message['time'])
+            elif message['type'] == 'transcript':
+                self.transcripts += 1
+
+async def run_level(base_url, sessions, duration):
+    # no connection limit, every session holds its websocket connection
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as http:
+        stop = asyncio.Event()
+        clients = [Client(http, f'{base_url.replace("http", "ws")}/session?channels={CHANNELS}') for _ in range(sessions)]
+        tasks = [asyncio.create_task(client.run(stop)) for client in clients]
+        # measure once every session is connected and streaming
+        await asyncio.gather(*[client.connected.wait() for client in clients])
+        await asyncio.sleep(1)
+        for client in clients:
+            client.rtts = []
+        async with http.get(f'{base_url}/stats') as response:
+            before = await response.json()
+        started = time.perf_counter()
+        await asyncio.sleep(duration)
+        async with http.get(f'{base_url}/stats') as response:
+            after = await response.json()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    received = sum(audio_bytes - before['audio_bytes'].get(session_id, 0) for session_id, audio_bytes in after['audio_bytes'].items())
+    expected = sessions * CHUNK_BYTES * (elapsed / CHUNK_SECONDS)
+    rtts = [rtt for client in clients for rtt in client.rtts]
+    return {
+        'sessions': sessions,
+        'audio_ratio': received / expected,
+        'rtt_p50': percentile(rtts, 50) if rtts else float('inf'),
+        'rtt_p95': percentile(rtts, 95) if rtts else float('inf'),
+        'cpu': (after['cpu_time'] - before['cpu_time']) / elapsed,
+        'client_lag': max(client.send_lag for client in clients),
+        'transcripts': sum(client.transcripts for client in clients),
+    }
+
+async def wait_for_service(base_url, timeout=20):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as http:
+        while True:
+            try:
+                async with http.get(f'{base_url}/stats') as response:
+                    return await response.json()
+            except aiohttp.ClientError:
+                if time.perf_counter() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+async def run(args):
+    base_url = f'http://127.0.0.1:{args.port}'
+    await wait_for_service(base_url)
+    sustained = 0
+    for sessions in [int(level) for level in args.levels.split(',')]:
+        result = await run_level(base_url, sessions, args.duration)
+        ok = result['audio_ratio'] >= 0.98 and result['rtt_p95'] <= args.max_latency
+        print(f"{sessions} sessions: audio {result['audio_ratio'] * 100:.1f}% of real time, ping p50 {result['rtt_p50'] * 1000:.1f}ms p95 {result['rtt_p95'] * 1000:.1f}ms, "
+              f"service cpu {result['cpu'] * 100:.0f}%, client lag {result['client_lag'] * 1000:.0f}ms, {result['transcripts']} transcripts -> {'ok' if ok else 'not sustained'}")
+        if result['client_lag'] > args.max_latency:
+            print('  the load generator itself is falling behind, numbers above this level are not reliable')
+        if not ok:
+            break
+        sustained = sessions
+        await asyncio.sleep(1) # let the closed sessions go away
+    print(f'sustained {sustained} concurrent 2-channel sessions on one core')
+
+def main():
+    parser = argparse.ArgumentParser(description='multi-session service load test')
+    parser.add_argument('--levels', default='25,50,100,200,400,800')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--max-latency', type=float, default=0.1, help='seconds allowed for the p95 ping round trip')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--cpu', type=int, default=0, help='core the service is pinned to')
+    args = parser.parse_args()
+
+    service = multiprocessing.get_context('spawn').Process(target=run_service, args=(args.port, args.cpu), daemon=True)
+    service.start()
+    # keep the load generator off the service core when possible
+    if hasattr(os, 'sched_setaffinity') and len(os.sched_getaffinity(0)) > 1:
+        os.sched_setaffinity(0, os.sched_getaffinity(0) - {args.cpu})
+    try:
+        asyncio.run(run(args))
+    finally:
+        service.terminate()
+        service.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+    startup cost benchmark.
+
+    * imports: each module is imported in a fresh interpreter with -X importtime, reporting its cumulative import time.
+    * init: times the startup steps that are not imports (PortAudio init + device enumeration, tiktoken encoder, GPTController, Tk window).
+    * modules that are not installed or steps that can't run here (no audio, no display) are reported as skipped.
+
+    usage: python benchmarks/bench_startup.py --repeat 3
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+MODULES = ['tkinter', 'numpy', 'pyaudiowpatch', 'tiktoken', 'openai', 'httpx', 'deepgram', 'dotenv', 'app_gui', 'live_transcriber', 'gpt_controller']
+
+# cumulative import time of module in seconds, from a fresh interpreter. None when the import fails.
+def import_time(module):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    # lines look like "import time:   self [us] |  cumulative | imported package"
+    for line in reversed(result.stderr.splitlines()):
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1e6
+    return None
+
+def timed(fn):
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        return None, e
+    return time.perf_counter() - start, None
+
+def init_pyaudio():
+    import pyaudiowpatch as pyaudio
+    p = pyaudio.PyAudio()
+    for i in range(p.get_device_count()):
+        p.get_device_info_by_index(i)
+    p.terminate()
+
+def init_tiktoken():
+    import tiktoken
+    tiktoken.get_encoding("cl100k_base")
+
+def init_gpt_controller():
+    from gpt_controller import GPTController
+    GPTController('benchmark')
+
+def init_window():
+    import asyncio
+    from app_gui import AppGUI
+    app_gui = AppGUI(asyncio.new_event_loop(), None, device_cache_path=None)
+    app_gui.root.update()
+    app_gui.root.destroy()
+
+def main():
+    parser = argparse.ArgumentParser(description='startup cost benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per module, the best is reported')
+    args = parser.parse_args()
+
+    print('imports (best cumulative time in a fresh interpreter):')
+    for module in MODULES:
+        times = [import_time(module) for _ in range(args.repeat)]
+        times = [t for t in times if t is not None]
+        if not times:
+            print(f'  {module}: skipped, import failed')
+            continue
+        print(f'  {module}: {min(times) * 1000:.0f}ms')
+
+    print('init (first run in this process, imports included):')
+    for name, fn in [('pyaudio + devices', init_pyaudio), ('tiktoken encoder', init_tiktoken), ('GPTController', init_gpt_controller), ('Tk window', init_window)]:
+        elapsed, error = timed(fn)
+        if elapsed is None:
+            print(f'  {name}: skipped ({error})')
+            continue
+        print(f'  {name}: {elapsed * 1000:.0f}ms')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+    transcript view insert cost over a long session.
+
+    * inserts synthetic segments (about 8 hours of conversation by default) into the bounded TranscriptView
+      and into a plain ScrolledText like the log used to be, reporting the insert + scroll cost per block of segments.
+    * needs a display for Tk.
+
+    usage: python benchmarks/bench_transcript_view.py --segments 40000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tkinter as tk
+from tkinter import scrolledtext
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from app_gui import TranscriptView
+from transcript_store import TranscriptStore
+
+def segments(count):
+    for i in range(count):
+        speaker = 'user' if (i // 3) % 2 == 0 else 'system'
+        prefix = f'\n{speaker}: ' if i % 3 == 0 else ' '
+        yield speaker, prefix + f'segment {i} with some words like a real sentence would have in a conversation.'
+
+def run(root, count, block, bounded):
+    textbox = scrolledtext.ScrolledText(root, wrap=tk.WORD, height=25, width=50)
+    textbox.pack()
+    view = TranscriptView(textbox, TranscriptStore()) if bounded else None
+    colors = {'user': '#004000', 'system': '#000050'}
+    results = []
+    start = time.perf_counter()
+    for i, (speaker, text) in enumerate(segments(count)):
+        if bounded:
+            view.append(text, speaker, colors[speaker])
+        else:
+            textbox.insert(tk.END, text, f'color_{colors[speaker]}')
+            textbox.see(tk.END)
+        if (i + 1) % block == 0:
+            root.update()
+            now = time.perf_counter()
+            results.append((i + 1, (now - start) / block))
+            start = time.perf_counter()
+    textbox.destroy()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='transcript view insert cost benchmark')
+    parser.add_argument('--segments', type=int, default=40000)
+    parser.add_argument('--block', type=int, default=5000)
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    for bounded in (True, False):
+        name = 'bounded TranscriptView' if bounded else 'unbounded ScrolledText'
+        print(f'{name}:')
+        for inserted, cost in run(root, args.segments, args.block, bounded):
+            print(f'  after {inserted} segments: {cost * 1e6:.0f}us per insert')
+    root.destroy()
+
+if __name__ == "__main__":
+    main()
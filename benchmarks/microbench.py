@@ -0,0 +1,347 @@
+"""
+    microbenchmarks of the pipeline hot paths, with saved baselines and a regression gate.
+
+    * mix_mode0 / mix_mode1 / mix_mode1_echo: AudioMixer._mix_audio of one chunk per device (mono average, two channels,
+      two channels with echo suppression). audio_handler: one chunk of each device through the whole mixer callback.
+    * resample_44100 / resample_48000: AudioStream._resample of one PortAudio block to 16kHz.
+    * transcript_received: DeepgramTranscriber._transcript_received of a 12 word segment, speakers alternating.
+      transcript_received_traced: the same with tracing on, 1 in 10 segments traced (TRACE_SAMPLE_RATE=0.1).
+    * prompt_assembly: filling the stage prompt with a long session transcript and a reference document.
+      token_count: counting the filled prompt with tiktoken, like ask_guru does.
+    * chunk_consumption: GPTController._read_stream of streamed answer chunks into the StreamBuffer, drained like the GUI.
+
+    each case is timed in batches of at least --min-time seconds (gc off), the median of --repeats batches per
+    operation is reported. cases whose dependencies are missing are skipped.
+
+    usage:
+        python benchmarks/microbench.py --save                 # record the baseline of this machine
+        python benchmarks/microbench.py --check                # fails when a case is --tolerance slower than its baseline or could not run
+                                                               # (exit 2 without a baseline, the committed one is from a reference machine)
+        python benchmarks/microbench.py --check --filter mix   # only the cases containing 'mix'
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'microbench_baseline.json')
+CHUNK_SIZE = 1024 * 4 # AudioMixer default, bytes per device
+WORDS = 'so tell me about a project where you had to make a hard tradeoff between quality and the deadline'.split()
+
+cases = {} # name -> setup function returning run(iterations)
+
+def case(name):
+    def register(setup):
+        cases[name] = setup
+        return setup
+    return register
+
+def speech(samples, seed):
+    generator = np.random.default_rng(seed)
+    return np.convolve(generator.normal(0, 3000, samples), np.ones(8) / 8, mode='same').astype(np.int16)
+
+def transcript_segments(count):
+    for i in range(count):
+        speaker = 'user' if (i // 3) % 2 == 0 else 'system'
+        prefix = f'\n{speaker}: ' if i % 3 == 0 else ' '
+        yield prefix + ' '.join(WORDS[(i + j) % len(WORDS)] for j in range(12)), speaker
+
+def mixer_case(mode, echo):
+    from live_transcriber import AudioMixer
+    from echo_suppression import EchoSuppressor
+    device_ids = [0, 1]
+    mixer = AudioMixer(device_ids, mode, None, echo_suppressor=EchoSuppressor() if echo else None)
+    for device_id in device_ids:
+        mixer.audio_buffers[device_id] = speech(CHUNK_SIZE // 2, device_id).tobytes()
+
+    def run(iterations):
+        for _ in range(iterations):
+            mixer._mix_audio()
+    return run
+
+@case('mix_mode0')
+def mix_mode0():
+    return mixer_case(0, False)
+
+@case('mix_mode1')
+def mix_mode1():
+    return mixer_case(1, False)
+
+@case('mix_mode1_echo')
+def mix_mode1_echo():
+    return mixer_case(1, True)
+
+@case('audio_handler')
+def audio_handler():
+    from live_transcriber import AudioMixer
+    mixer = AudioMixer([0, 1], 1, lambda data: None)
+    blocks = [speech(CHUNK_SIZE, device_id).tobytes() for device_id in (0, 1)] # two chunks, like one PortAudio block
+
+    def run(iterations):
+        for _ in range(iterations):
+            mixer.audio_handler(0, blocks[0])
+            mixer.audio_handler(1, blocks[1])
+    return run
+
+def resample_case(rate):
+    from live_transcriber import AudioStream
+    block = speech(int(CHUNK_SIZE * rate / 16000), 0) # frames_per_buffer of AudioStream
+
+    def run(iterations):
+        for _ in range(iterations):
+            AudioStream._resample(block, rate, 16000).astype(np.int16).tobytes()
+    return run
+
+@case('resample_44100')
+def resample_44100():
+    return resample_case(44100)
+
+@case('resample_48000')
+def resample_48000():
+    return resample_case(48000)
+
+def transcript_received_case(tracer):
+    import tracing
+    from live_transcriber import DeepgramTranscriber
+    from echo_suppression import TranscriptDedup
+    from stream_buffer import SignalQueue
+    transcriber = DeepgramTranscriber('bench')
+    transcriber.results_queue = SignalQueue()
+    transcriber.dedup = TranscriptDedup() # timed with the echo dedup on (TRANSCRIPT_DEDUP=1), its slowest path
+    if tracer is not None:
+        transcriber.audio_timeline = tracing.AudioTimeline(64000)
+        transcriber.audio_timeline.sent([(0.0, 0.0, 8192)] * 4000, 0.0)
+    # different words on each channel so the echo dedup keeps them
+    messages = [{
+        'channel_index': [i % 2, 2],
+        'channel': {'alternatives': [{'transcript': ' '.join(f'{WORDS[(i + j) % len(WORDS)]}{i % 2}' for j in range(12))}]},
+        'speech_final': False,
+        'start': i * 2.0,
+        'duration': 1.5,
+    } for i in range(64)]
+    loop = asyncio.new_event_loop()
+
+    async def receive(iterations):
+        for i in range(iterations):
+            await transcriber._transcript_received(messages[i % len(messages)])
+            if i % 4 == 3:
+                # a real dedup window holds a few segments, not every segment of the batch
+                transcriber.dedup.system_segments.clear()
+        transcriber._cancel_turn_end()
+        with transcriber.results_queue.mutex:
+            transcriber.results_queue.queue.clear()
+
+    def run(iterations):
+        previous = tracing.tracer
+        tracing.tracer = tracer
+        try:
+            loop.run_until_complete(receive(iterations))
+        finally:
+            tracing.tracer = previous
+    return run
+
+@case('transcript_received')
+def transcript_received():
+    return transcript_received_case(None)
+
+@case('transcript_received_traced')
+def transcript_received_traced():
+    import tracing
+    return transcript_received_case(tracing.Tracer(0.1, max_spans=1000))
+
+def assembled_prompt_inputs():
+    from prompts import base_prompts
+    from reference_index import ReferenceLibrary
+    from transcript_store import TranscriptStore
+    store = TranscriptStore()
+    for text, speaker in transcript_segments(3000): # a couple of hours of conversation
+        store.append(text, speaker, 0)
+    library = ReferenceLibrary()
+    library.add('resume', ' '.join(f'{WORDS[i % len(WORDS)]}{i % 50}.' if i % 15 == 14 else WORDS[i % len(WORDS)] for i in range(4000)))
+    return base_prompts['interview_candidate'] + '\n[DOC:resume]\n', store, library
+
+@case('prompt_assembly')
+def prompt_assembly():
+    from prompts import fill_prompt
+    prompt, store, library = assembled_prompt_inputs()
+
+    def run(iterations):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(iterations):
+                fill_prompt(prompt, store.text() + '\n', library)
+    return run
+
+@case('token_count')
+def token_count():
+    import tiktoken
+    from prompts import fill_prompt
+    encoder = tiktoken.get_encoding("cl100k_base")
+    prompt, store, library = assembled_prompt_inputs()
+    with contextlib.redirect_stdout(io.StringIO()):
+        final_prompt = fill_prompt(prompt, store.text() + '\n', library)
+
+    def run(iterations):
+        for _ in range(iterations):
+            len(encoder.encode(final_prompt))
+    return run
+
+@case('chunk_consumption')
+def chunk_consumption():
+    from openai.types.chat import ChatCompletionChunk
+    from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+    from gpt_controller import AnswerRequest, GPTController
+    from stream_buffer import StreamBuffer
+    controller = GPTController('bench', 'http://127.0.0.1:1/v1')
+    chunks = [ChatCompletionChunk(id='bench', object='chat.completion.chunk', created=0, model='bench',
+                                  choices=[Choice(index=0, delta=ChoiceDelta(content=f'tok{i % 10} '), finish_reason=None)])
+              for i in range(256)]
+    loop = asyncio.new_event_loop()
+
+    async def stream(iterations, buffer: StreamBuffer):
+        for i in range(iterations):
+            yield chunks[i % len(chunks)]
+            if i % 8 == 7:
+                buffer.drain() # the GUI consumer
+        buffer.drain()
+
+    async def consume(iterations):
+        buffer = StreamBuffer()
+        request = AnswerRequest(1, 'bench', buffer)
+        request.started = time.perf_counter()
+        await controller._read_stream(request, None, stream(iterations, buffer).__aiter__(), None)
+
+    def run(iterations):
+        with contextlib.redirect_stdout(io.StringIO()):
+            loop.run_until_complete(consume(iterations))
+    return run
+
+def time_batch(run, iterations):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        run(iterations)
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+# median and min time per operation, in microseconds
+def measure(run, repeats, min_time):
+    run(1) # warm up
+    iterations = 1
+    while True:
+        elapsed = time_batch(run, iterations)
+        if elapsed >= min_time:
+            break
+        iterations = max(iterations * 2, int(iterations * min_time / max(elapsed, 1e-9) * 1.1))
+    per_op = [time_batch(run, iterations) / iterations * 1e6 for _ in range(repeats)]
+    return {'median_us': statistics.median(per_op), 'min_us': min(per_op), 'iterations': iterations, 'repeats': repeats}
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+def run_cases(args):
+    results = {}
+    for name, setup in cases.items():
+        if args.filter and args.filter not in name:
+            continue
+        try:
+            run = setup()
+        except Exception as e: # missing dependency or no display
+            print(f'{name:<28} skipped ({type(e).__name__}: {e})')
+            continue
+        results[name] = measure(run, args.repeats, args.min_time)
+        print(f"{name:<28} {results[name]['median_us']:10.2f}us  (min {results[name]['min_us']:.2f}us, {results[name]['iterations']} per batch)")
+    return results
+
+# cases slower than their baseline by more than the tolerance (relative) and min_delta (absolute, for the tiny ones)
+def regressions(results, baseline, tolerance, min_delta):
+    found = []
+    for name, result in results.items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            print(f'{name}: no baseline')
+            continue
+        limit = reference.get('tolerance', tolerance)
+        change = result['median_us'] / reference['median_us'] - 1
+        status = 'ok'
+        if change > limit and result['median_us'] - reference['median_us'] > min_delta:
+            status = 'REGRESSION'
+            found.append(name)
+        print(f"{name:<28} {reference['median_us']:10.2f}us -> {result['median_us']:10.2f}us  {change * 100:+6.1f}%  {status}")
+    return found
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='hot path microbenchmarks with a regression gate')
+    parser.add_argument('--filter', help='only the cases containing this text')
+    parser.add_argument('--repeats', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.05, help='seconds per timed batch')
+    parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, help='save the results as the baseline')
+    parser.add_argument('--check', nargs='?', const=DEFAULT_BASELINE, help='compare against the baseline, exit 1 on regressions or skipped baselined cases')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed slowdown, 0.3 = 30%% (a case can set its own in the baseline)')
+    parser.add_argument('--min-delta', type=float, default=0.5, help='microseconds of slowdown always allowed')
+    parser.add_argument('--json', help='also write these results to a file')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.check and not os.path.exists(args.check):
+        print(f'no baseline at {args.check}, run with --save first')
+        sys.exit(2)
+    results = run_cases(args)
+    report = {'time': time.time(), 'machine': machine_info(), 'results': results}
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=1)
+    if args.save:
+        baseline = {'results': {}}
+        if os.path.exists(args.save):
+            # keep the cases not run this time and the tolerances set by hand
+            with open(args.save) as file:
+                baseline = json.load(file)
+        for name, result in results.items():
+            tolerance = baseline['results'].get(name, {}).get('tolerance')
+            baseline['results'][name] = dict(result, **({'tolerance': tolerance} if tolerance is not None else {}))
+        baseline['time'] = report['time']
+        baseline['machine'] = report['machine']
+        with open(args.save, 'w') as file:
+            json.dump(baseline, file, indent=1)
+        print(f'baseline saved to {args.save}')
+    if args.check:
+        with open(args.check) as file:
+            baseline = json.load(file)
+        for key, value in machine_info().items():
+            if baseline.get('machine', {}).get(key) != value:
+                print(f"warning: baseline {key} was {baseline.get('machine', {}).get(key)}, now {value}")
+        found = regressions(results, baseline, args.tolerance, args.min_delta)
+        # a baselined case that could not run is not checked, that fails the gate too
+        skipped = [name for name in baseline['results'] if name not in results and not (args.filter and args.filter not in name)]
+        if found:
+            print(f"{len(found)} regressions: {', '.join(found)}")
+        if skipped:
+            print(f"{len(skipped)} baselined cases skipped: {', '.join(skipped)}")
+        if found or skipped:
+            sys.exit(1)
+        print('no regressions')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+    local stand-in for the Deepgram prerecorded transcription endpoint (POST /v1/listen with a wav body).
+
+    * every burst of sound on a channel becomes an utterance "tone <frequency>" with its start and end in the chunk,
+      so a batch run over synthetic tone recordings can be checked for timestamps and speakers.
+    * answers take latency + audio seconds * seconds_per_audio_second.
+    * requests over max_concurrent (and rate_limit_rate of the others) get a 429 with Retry-After, like the real api.
+
+    run standalone: python benchmarks/mock_deepgram_server.py --max-concurrent 5
+    then point the batch transcriber to it with DEEPGRAM_API_URL=http://127.0.0.1:8090
+"""
+
+import argparse
+import asyncio
+import io
+import random
+import wave
+import numpy as np
+from aiohttp import web
+
+FRAME_SECONDS = 0.02
+LEVEL = 300 # rms above which a frame has sound
+
+# (start, end, frequency) of every burst of sound in one channel
+def find_bursts(samples, rate):
+    step = int(FRAME_SECONDS * rate)
+    count = len(samples) // step
+    if count == 0:
+        return []
+    frames = samples[:count * step].astype(np.float64).reshape(count, step)
+    loud = np.sqrt((frames ** 2).mean(axis=1)) > LEVEL
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], loud.astype(np.int8), [0]])))
+    bursts = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        burst = samples[start * step:end * step].astype(np.float64)
+        spectrum = np.abs(np.fft.rfft(burst))
+        frequency = np.argmax(spectrum) * rate / len(burst)
+        bursts.append((start * FRAME_SECONDS, end * FRAME_SECONDS, int(round(frequency / 10) * 10)))
+    return bursts
+
+class MockDeepgramServer:
+    def __init__(self, latency=0.1, seconds_per_audio_second=0.01, max_concurrent=10, rate_limit_rate=0.0, retry_after=1.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.seconds_per_audio_second = seconds_per_audio_second
+        self.max_concurrent = max_concurrent
+        self.rate_limit_rate = rate_limit_rate # probability of a 429 under the concurrency limit
+        self.retry_after = retry_after
+        self.error_rate = error_rate # probability of answering with http 500
+        self.random = random.Random(seed)
+        self.runner = None
+        self.requests = 0
+        self.rate_limited = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def start(self, host='127.0.0.1', port=8090):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post('/v1/listen', self.listen)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        print(f'mock deepgram server listening on http://{host}:{port}')
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def listen(self, request: web.Request):
+        self.requests += 1
+        body = await request.read()
+        if self.active >= self.max_concurrent or self.random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return web.json_response({'err_code': 'TOO_MANY_REQUESTS', 'err_msg': 'rate limited'}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        if self.random.random() < self.error_rate:
+            return web.json_response({'err_code': 'INTERNAL_SERVER_ERROR', 'err_msg': 'injected error'}, status=500)
+        try:
+            with wave.open(io.BytesIO(body), 'rb') as file:
+                channels, rate = file.getnchannels(), file.getframerate()
+                samples = np.frombuffer(file.readframes(file.getnframes()), dtype=np.int16).reshape(-1, channels)
+        except (wave.Error, EOFError, ValueError) as e:
+            return web.json_response({'err_code': 'BAD_REQUEST', 'err_msg': str(e)}, status=400)
+        multichannel = request.query.get('multichannel') == 'true'
+        if not multichannel:
+            samples = samples.mean(axis=1, keepdims=True).astype(np.int16)
+        duration = len(samples) / rate
+
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency + duration * self.seconds_per_audio_second)
+        finally:
+            self.active -= 1
+
+        channel_results, utterances = [], []
+        for channel in range(samples.shape[1]):
+            words = []
+            for start, end, frequency in find_bursts(samples[:, channel], rate):
+                text = f'tone {frequency}'
+                words.append({'word': text, 'start': start, 'end': end, 'confidence': 1.0})
+                utterances.append({'start': start, 'end': end, 'confidence': 1.0, 'channel': channel, 'transcript': text, 'words': []})
+            channel_results.append({'alternatives': [{'transcript': ' '.join(word['word'] for word in words), 'confidence': 1.0, 'words': words}]})
+        utterances.sort(key=lambda utterance: utterance['start'])
+        return web.json_response({
+            'metadata': {'duration': duration, 'channels': samples.shape[1], 'model_info': {}},
+            'results': {'channels': channel_results, 'utterances': utterances},
+        })
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='local Deepgram prerecorded api stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds added to every answer')
+    parser.add_argument('--seconds-per-audio-second', type=float, default=0.01)
+    parser.add_argument('--max-concurrent', type=int, default=10, help='requests over this get a 429')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='probability of a 429 anyway')
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of an http 500')
+    return parser.parse_args()
+
+async def serve_forever(args):
+    server = MockDeepgramServer(args.latency, args.seconds_per_audio_second, args.max_concurrent, args.rate_limit_rate, args.retry_after, args.error_rate)
+    await server.start(args.host, args.port)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve_forever(parse_args()))
+    except KeyboardInterrupt:
+        pass
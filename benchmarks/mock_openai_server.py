@@ -0,0 +1,122 @@
+"""
+    local stand-in for the OpenAI chat completions streaming endpoint.
+
+    * POST /v1/chat/completions streams server sent events like the real api (only stream=True is supported).
+    * GET /v1/models/{model} answers the connection warm-up requests.
+    * time to first token, token rate, answer length and error injection are configurable.
+
+    run standalone: python benchmarks/mock_openai_server.py --ttft 0.4 --tokens-per-sec 60
+    then point the app to it with OPENAI_BASE_URL=http://127.0.0.1:8089/v1 in the .env file.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from aiohttp import web
+
+class MockOpenAIServer:
+    def __init__(self, ttft=0.3, tokens_per_sec=50, answer_tokens=100, error_rate=0.0, drop_rate=0.0, seed=None):
+        self.ttft = ttft # seconds before the first token
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate # probability of answering with http 500
+        self.drop_rate = drop_rate # probability of cutting the stream halfway
+        self.random = random.Random(seed)
+        self.runner = None
+        self.requests = 0
+        self.last_messages = None # messages of the last chat completion request
+        self.active_streams = 0
+        self.max_active_streams = 0
+
+    async def start(self, host='127.0.0.1', port=8089):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        app.router.add_get('/v1/models/{model}', self.model)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        print(f'mock openai server listening on http://{host}:{port}/v1')
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def model(self, request: web.Request):
+        model = request.match_info['model']
+        return web.json_response({'id': model, 'object': 'model', 'created': 0, 'owned_by': 'mock'})
+
+    async def chat_completions(self, request: web.Request):
+        self.requests += 1
+        body = await request.json()
+        model = body.get('model', 'mock')
+        self.last_messages = body.get('messages')
+        if self.random.random() < self.error_rate:
+            return web.json_response({'error': {'message': 'injected error', 'type': 'server_error'}}, status=500)
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        self.active_streams += 1
+        self.max_active_streams = max(self.max_active_streams, self.active_streams)
+        try:
+            await asyncio.sleep(self.ttft)
+            drop_at = self.answer_tokens // 2 if self.random.random() < self.drop_rate else None
+            start = time.perf_counter()
+            await self._send_chunk(response, model, {'role': 'assistant', 'content': ''})
+            for i in range(self.answer_tokens):
+                if i == drop_at:
+                    # abrupt end without [DONE], the client sees a broken stream
+                    return response
+                await self._send_chunk(response, model, {'content': f'tok{i} '})
+                # pace tokens against the start time so slow writes don't accumulate drift
+                delay = start + (i + 1) / self.tokens_per_sec - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self._send_chunk(response, model, {}, finish_reason='stop')
+            await response.write(b'data: [DONE]\n\n')
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            # client aborted the stream
+            pass
+        finally:
+            self.active_streams -= 1
+        return response
+
+    async def _send_chunk(self, response, model, delta, finish_reason=None):
+        chunk = {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+        await response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='local OpenAI compatible streaming server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--ttft', type=float, default=0.3, help='seconds before the first token')
+    parser.add_argument('--tokens-per-sec', type=float, default=50)
+    parser.add_argument('--answer-tokens', type=int, default=100)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of an http 500')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='probability of cutting a stream halfway')
+    return parser.parse_args()
+
+async def serve_forever(args):
+    server = MockOpenAIServer(args.ttft, args.tokens_per_sec, args.answer_tokens, args.error_rate, args.drop_rate)
+    await server.start(args.host, args.port)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve_forever(parse_args()))
+    except KeyboardInterrupt:
+        pass
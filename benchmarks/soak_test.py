@@ -0,0 +1,305 @@
+"""
+    long run soak test of the capture -> mix -> transcription -> transcript pipeline, faster than real time.
+
+    * two synthetic devices (a 48kHz mic and a 44.1kHz loopback by default) deliver speech-like blocks of the size
+      AudioStream asks PortAudio for, on their own clocks: the loopback runs --skew-ppm fast and, like a WASAPI loopback,
+      delivers nothing while the system is silent.
+    * blocks go through AudioStream._resample and the AudioMixer (with echo suppression) into a DeepgramTranscriber
+      whose live socket is replaced by a stand-in that queues the audio and answers a transcript every couple of
+      seconds of speech. results are consumed like the GUI does, into a TranscriptStore (and the bounded TranscriptView
+      with --tk, which needs a display).
+    * every --sample-every simulated seconds: rss, tracemalloc top growing allocators (--tracemalloc), mixer buffers,
+      queue depths, transcript size and channel drift (how far the two channels are apart and the silence inserted).
+    * fails (exit code 1) when, after --warmup, rss grows more than --max-rss-growth MB, a mixer buffer goes over
+      --max-buffer-kb or the channels drift apart more than --max-drift-ms.
+
+    usage: python benchmarks/soak_test.py --hours 8 --sample-every 600 --tracemalloc --report soak.json
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from live_transcriber import AudioMixer, AudioStream, DeepgramTranscriber
+from audio_sender import AudioSender
+from echo_suppression import EchoSuppressor
+from stream_buffer import SignalQueue
+from transcript_store import TranscriptStore
+
+OUT_RATE = 16000
+CHUNK_SIZE = 1024 * 4 # AudioMixer default, bytes per device
+WORDS = 'so what would you say is the biggest challenge of the role and how would you handle a tight deadline with the team'.split()
+
+def rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource # peak rss only, in kB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# a capture device on its own clock. talk is a (seconds on, seconds off) cycle, the phase shifts who talks when.
+# loopback devices deliver nothing while silent.
+class SyntheticDevice:
+    def __init__(self, device_id, rate, skew_ppm, talk, phase, loopback, seed):
+        self.device_id = device_id
+        self.rate = rate
+        self.frames = int(CHUNK_SIZE // 2 * rate / OUT_RATE) # frames_per_buffer of AudioStream
+        self.period = self.frames / (rate * (1 + skew_ppm * 1e-6)) # seconds between callbacks
+        self.talk = talk
+        self.phase = phase
+        self.loopback = loopback
+        generator = np.random.default_rng(seed)
+        # speech-like blocks: noise shaped by a slow envelope, prepared once so generation costs nothing
+        t = np.arange(self.frames) / rate
+        self.blocks = []
+        for i in range(16):
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * generator.uniform(2, 6) * t + generator.uniform(0, 6))
+            noise = np.convolve(generator.normal(0, 3000, self.frames), np.ones(8) / 8, mode='same')
+            self.blocks.append((noise * envelope).astype(np.int16).tobytes())
+        self.silence = bytes(self.frames * 2)
+        self.callbacks = 0
+
+    def talking(self, now):
+        on, off = self.talk
+        return (now + self.phase) % (on + off) < on
+
+    # the block delivered at simulated time now, None when the device delivers nothing
+    def block(self, now):
+        self.callbacks += 1
+        if self.talking(now):
+            return self.blocks[self.callbacks % len(self.blocks)]
+        return None if self.loopback else self.silence
+
+# stands in for the deepgram live socket: queues what is sent (like the sdk sender queue) and sends it at once
+# to a transcript generator, which answers for the louder channel after every few seconds of speech
+class StandInLive:
+    def __init__(self, transcriber: DeepgramTranscriber, loop, seconds_per_segment=2.0):
+        self.transcriber = transcriber
+        self.loop = loop
+        self.seconds_per_segment = seconds_per_segment
+        self.queue = []
+        self.sent_bytes = 0
+        self.speech_seconds = [0.0, 0.0]
+        self.segments = 0
+
+    def send(self, chunk):
+        self.queue.append(chunk)
+
+    def flush(self):
+        for chunk in self.queue:
+            self.sent_bytes += len(chunk)
+            audio = np.frombuffer(chunk, dtype=np.int16).reshape(-1, 2)
+            levels = np.abs(audio).mean(axis=0)
+            for channel in (0, 1):
+                if levels[channel] > 200:
+                    self.speech_seconds[channel] += len(audio) / OUT_RATE
+                if self.speech_seconds[channel] >= self.seconds_per_segment:
+                    self.speech_seconds[channel] = 0.0
+                    self.segments += 1
+                    words = [WORDS[(self.segments * 7 + i * 3) % len(WORDS)] for i in range(8)]
+                    self.loop.create_task(self.transcriber._transcript_received({
+                        'channel_index': [channel, 2],
+                        'channel': {'alternatives': [{'transcript': ' '.join(words)}]},
+                        'speech_final': self.segments % 3 == 0,
+                    }))
+        self.queue = []
+
+class Soak:
+    def __init__(self, args):
+        self.args = args
+        self.devices = [
+            SyntheticDevice(0, args.mic_rate, 0, (3.0, 5.0), 0.0, False, 1),
+            SyntheticDevice(1, args.loopback_rate, args.skew_ppm, (4.0, 4.0), 4.0, True, 2),
+        ]
+        self.samples = []
+        self.failures = []
+        self.view = None
+
+    async def run(self):
+        args = self.args
+        loop = asyncio.get_running_loop()
+        self.transcriber = DeepgramTranscriber('soak')
+        self.transcriber.results_queue = SignalQueue(10)
+        self.live = StandInLive(self.transcriber, loop)
+        self.transcriber.deepgram_live = self.live
+        self.transcriber.sender = AudioSender(self.live.send, bytes_per_second=OUT_RATE * 2 * 2)
+        self.transcriber.sender.start()
+        self.mixer = AudioMixer([0, 1], 1, self.transcriber.send_audio, echo_suppressor=EchoSuppressor.from_env())
+        self.store = TranscriptStore()
+        if args.tk:
+            import tkinter as tk
+            from tkinter import scrolledtext
+            from app_gui import TranscriptView
+            self.root = tk.Tk()
+            textbox = scrolledtext.ScrolledText(self.root, wrap=tk.WORD, height=25, width=50)
+            textbox.pack()
+            self.view = TranscriptView(textbox, self.store)
+        if args.tracemalloc:
+            tracemalloc.start(args.trace_frames)
+        self.baseline_rss = None
+        self.baseline_snapshot = None
+
+        duration = args.hours * 3600
+        events = [(0.0, device.device_id) for device in self.devices]
+        heapq.heapify(events)
+        next_sample = args.sample_every
+        started = time.perf_counter()
+        steps = 0
+        while events:
+            now, device_id = heapq.heappop(events)
+            if now >= duration:
+                break
+            device = self.devices[device_id]
+            block = device.block(now)
+            if block is not None:
+                resampled = AudioStream._resample(np.frombuffer(block, dtype=np.int16), device.rate, OUT_RATE)
+                self.mixer.audio_handler(device_id, resampled.astype(np.int16).tobytes())
+            heapq.heappush(events, (now + device.period, device_id))
+            steps += 1
+            if steps % 8 == 0:
+                # sender and GUI turns, the transcript tasks run during the sleep
+                self.live.flush()
+                await asyncio.sleep(0)
+                self.consume()
+            if args.speed:
+                ahead = now / args.speed - (time.perf_counter() - started)
+                if ahead > 0.01:
+                    await asyncio.sleep(ahead)
+            if now >= next_sample:
+                self.sample(now, time.perf_counter() - started)
+                next_sample += args.sample_every
+        self.live.flush()
+        await asyncio.sleep(0)
+        self.consume()
+        self.sample(duration, time.perf_counter() - started)
+        self.transcriber._cancel_turn_end()
+        self.transcriber.sender.stop()
+        if args.tracemalloc:
+            tracemalloc.stop()
+        if self.view is not None:
+            self.root.destroy()
+        return not self.failures
+
+    # drains the results like AppGUI.consume_transcription
+    def consume(self):
+        results_queue = self.transcriber.results_queue
+        while not results_queue.empty():
+            msg_type, msg = results_queue.get_nowait()
+            if msg_type not in ('user_msg', 'system_msg'):
+                continue
+            speaker = 'user' if msg_type == 'user_msg' else 'system'
+            if self.view is not None:
+                self.view.append(msg, speaker, '#004000' if speaker == 'user' else '#000050')
+                self.root.update()
+            else:
+                self.store.append(msg, speaker)
+
+    def sample(self, now, elapsed):
+        args = self.args
+        mixer = self.mixer
+        buffered = mixer.buffered_bytes()
+        # bytes each channel has delivered to the mix, silence included. their difference is the channel lag
+        delivered = [mixer.received_bytes[d] + mixer.padded_bytes[d] - buffered[d] for d in (0, 1)]
+        lag_ms = (buffered[0] - buffered[1]) / 2 / OUT_RATE * 1000
+        sample = {
+            'time': now,
+            'elapsed': elapsed,
+            'rss_mb': rss_bytes() / 1e6,
+            'mixer_buffered_kb': [b / 1000 for b in buffered.values()],
+            'channel_lag_ms': lag_ms,
+            'padded_ms': [mixer.padded_bytes[d] / 2 / OUT_RATE * 1000 for d in (0, 1)],
+            'mixed_seconds': delivered[0] / 2 / OUT_RATE,
+            'results_queue': self.transcriber.results_queue.qsize(),
+            'sender_queue': len(self.live.queue),
+            'send_latency_ms_p95': self.transcriber.sender.stats()['queue_latency_ms_p95'],
+            'segments': len(self.store),
+            'transcript_kb': self.store.chars() / 1000,
+            'dedup_window': len(self.transcriber.dedup.system_segments) if self.transcriber.dedup is not None else 0,
+        }
+        if self.view is not None:
+            sample['view_lines'] = int(self.view.textbox.index('end-1c').split('.')[0])
+        warm = now >= args.warmup
+        if warm and self.baseline_rss is None:
+            self.baseline_rss = sample['rss_mb']
+            if args.tracemalloc:
+                self.baseline_snapshot = tracemalloc.take_snapshot()
+        if warm:
+            sample['rss_growth_mb'] = sample['rss_mb'] - self.baseline_rss
+        if args.tracemalloc and self.baseline_snapshot is not None:
+            snapshot = tracemalloc.take_snapshot()
+            stats = snapshot.compare_to(self.baseline_snapshot, 'lineno')
+            sample['top_growth'] = [
+                {'where': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}', 'kb': stat.size_diff / 1000, 'blocks': stat.count_diff}
+                for stat in stats[:args.top] if stat.size_diff > 0
+            ]
+        self.samples.append(sample)
+        self.check(sample, warm)
+        self.print_sample(sample)
+
+    def check(self, sample, warm):
+        args = self.args
+        hours = sample['time'] / 3600
+        if max(sample['mixer_buffered_kb']) > args.max_buffer_kb:
+            self.failures.append(f"{hours:.2f}h: mixer buffer {max(sample['mixer_buffered_kb']):.0f}kB over {args.max_buffer_kb}kB")
+        if abs(sample['channel_lag_ms']) > args.max_drift_ms:
+            self.failures.append(f"{hours:.2f}h: channels {sample['channel_lag_ms']:.0f}ms apart, over {args.max_drift_ms}ms")
+        if warm and sample['rss_growth_mb'] > args.max_rss_growth:
+            self.failures.append(f"{hours:.2f}h: rss grew {sample['rss_growth_mb']:.1f}MB since warm-up, over {args.max_rss_growth}MB")
+
+    @staticmethod
+    def print_sample(sample):
+        print(f"{sample['time'] / 3600:5.2f}h ({sample['elapsed']:.0f}s): rss {sample['rss_mb']:.1f}MB"
+              f"{' (+%.1f)' % sample['rss_growth_mb'] if 'rss_growth_mb' in sample else ''}, "
+              f"mixer buffers {'/'.join(f'{kb:.0f}' for kb in sample['mixer_buffered_kb'])}kB, lag {sample['channel_lag_ms']:.0f}ms, "
+              f"padded {'/'.join(f'{ms / 1000:.0f}' for ms in sample['padded_ms'])}s, queues {sample['results_queue']}/{sample['sender_queue']}, "
+              f"{sample['segments']} segments ({sample['transcript_kb']:.0f}kB)")
+        for growth in sample.get('top_growth', [])[:3]:
+            print(f"    +{growth['kb']:.0f}kB ({growth['blocks']:+d} blocks) {growth['where']}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='pipeline soak test with memory and drift tracking')
+    parser.add_argument('--hours', type=float, default=8, help='simulated capture length')
+    parser.add_argument('--speed', type=float, default=0, help='times real time, 0 runs as fast as possible')
+    parser.add_argument('--sample-every', type=float, default=600, help='simulated seconds between samples')
+    parser.add_argument('--warmup', type=float, default=1200, help='simulated seconds before the rss baseline is taken')
+    parser.add_argument('--mic-rate', type=int, default=48000)
+    parser.add_argument('--loopback-rate', type=int, default=44100)
+    parser.add_argument('--skew-ppm', type=float, default=100, help='loopback clock error')
+    parser.add_argument('--tk', action='store_true', help='show the transcript in the bounded TranscriptView')
+    parser.add_argument('--tracemalloc', action='store_true', help='track the top growing allocations (slower)')
+    parser.add_argument('--trace-frames', type=int, default=1)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--max-rss-growth', type=float, default=50, help='MB')
+    parser.add_argument('--max-buffer-kb', type=float, default=256)
+    parser.add_argument('--max-drift-ms', type=float, default=2000)
+    parser.add_argument('--report', help='save the samples and failures as json')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    soak = Soak(args)
+    passed = asyncio.run(soak.run())
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump({'args': vars(args), 'samples': soak.samples, 'failures': soak.failures}, file, indent=1)
+    for failure in soak.failures:
+        print(f'FAIL {failure}')
+    print('soak test passed' if passed else 'soak test failed')
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
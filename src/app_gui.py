@@ -1,22 +1,39 @@
+import json
+import os
+import threading
 import time
 import tkinter as tk
 from tkinter import scrolledtext
-from live_transcriber import TranscriptionController
-from gpt_controller import GPTController
+from tkinter import filedialog
+from tkinter import messagebox
 import asyncio # used to run transcription_controller coroutines from tkinter thread using asyncio.run_coroutine_threadsafe
 import queue
 from tkinter import ttk
-from prompts import base_prompts
-import tiktoken
+from prompts import base_prompts, prompt_names, prompt_latency_classes, fill_prompt
+from tk_wakeup import TkWakeup
+from transcript_store import TranscriptStore
+import tracing
 
+# audio input devices from the last run, shown while PortAudio enumerates the current ones
+DEVICE_CACHE_PATH = '.device_cache.json'
+
+# only light modules are imported here so the window shows up first.
+# the controllers (numpy, deepgram, openai, pyaudio) are loaded in the background and attached later.
 class AppGUI:
-    def __init__(self, transcription_controller: TranscriptionController, gpt_controller: GPTController, asyncio_loop: asyncio.BaseEventLoop, terminate_event: asyncio.Event):
-        self.transcription_controller = transcription_controller
-        self.gpt_controller = gpt_controller
+    def __init__(self, asyncio_loop: asyncio.BaseEventLoop, terminate_event: asyncio.Event, device_cache_path=DEVICE_CACHE_PATH):
+        self.transcription_controller = None
+        self.gpt_controller = None
+        self.token_encoder = None
+        self.transcript_index = None # search over saved transcripts, when TRANSCRIPTS_DIR is set
+        self.reference_library = None # reference documents filled into [DOC:name] placeholders
         self.asyncio_loop = asyncio_loop
         self.terminate_event = terminate_event
+        self.device_cache_path = device_cache_path
         self.audio_input_dropdowns = []
-        self.device_map = {}
+        self.device_map = {'None': None}
+        self.prompt_id = 'interview_candidate' # last default prompt loaded in the stage tab
+        self.manual_answer_at = None # when the user last asked, triggered answers don't replace it for auto_answer_hold
+        self.auto_answer_hold = float(os.getenv('AUTO_ANSWER_HOLD', '30'))
         
         # create the main window
         self.root = tk.Tk() 
@@ -24,49 +41,114 @@ class AppGUI:
         self.root.protocol("WM_DELETE_WINDOW", self.close_program)
         self.create_widgets()
 
+        # producers on other threads wake the consumers below, nothing runs while there is no data
+        self.wakeup = TkWakeup(self.root)
+        self.wakeup.register('TranscriptionReady', self.consume_transcription)
+        self.wakeup.register('AnswerReady', self.consume_ai_answer)
+        self.wakeup.register('PanelAnswerReady', self.consume_panel_answers)
+
+    # wires the controllers once they are loaded, enabling the buttons that need them
+    def attach(self, transcription_controller, gpt_controller, token_encoder=None, transcript_index=None, reference_library=None):
+        self.transcription_controller = transcription_controller
+        self.gpt_controller = gpt_controller
+        self.token_encoder = token_encoder
+        self.transcript_index = transcript_index
+        self.reference_library = reference_library
+        if reference_library is not None:
+            self.load_document_button.config(state='normal')
+        if transcript_index is not None:
+            self.search_button.config(state='normal')
+            self.search_entry.config(state='normal')
+        self.transcription_controller.transcriptions_queue.listener = lambda: self.wakeup.notify('TranscriptionReady')
+        self.gpt_controller.answer_buffer.listener = lambda: self.wakeup.notify('AnswerReady')
+        self.gpt_controller.conversation.count_tokens = self.count_tokens
+        for prompt_id in self.panel_textboxes:
+            self.gpt_controller.panel_buffer(prompt_id).listener = lambda: self.wakeup.notify('PanelAnswerReady')
+        # capture lifecycle runs on the asyncio loop and reports back here
+        self.transcription_controller.main_thread_call = self.wakeup.call
+        self.transcription_controller.on_state_change = lambda state: self.wakeup.call(lambda: self.capture_state_changed(state))
+        for button in (self.capture_button, self.ask_guru_button, self.ask_panel_button):
+            button.config(state='normal')
+        self.root.after_idle(self.refresh_devices)
+
     def run_mainloop(self):
-        self.consume_transcription()
-        self.consume_ai_answer()
+        self.wakeup.start()
         self.root.mainloop()
     
+    # the controllers could not be loaded, nothing works without them
+    def startup_failed(self, error):
+        print(f"startup failed: {error!r}")
+        messagebox.showerror("My Live Guru", f"Could not start:\n{error}")
+        self.close_program()
+
     def close_program(self):
         print("performing cleanup...")
-        # stop transcription controller
-        self.stop_transcription()
-        
-        # stop asyncio main loop
-        self.asyncio_loop.call_soon_threadsafe(self.terminate_event.set)
+        # stop transcription controller, then the asyncio main loop (main waits for the asyncio thread)
+        if self.transcription_controller is not None:
+            future = asyncio.run_coroutine_threadsafe(self.transcription_controller.terminate(), self.asyncio_loop)
+            future.add_done_callback(lambda _: self.asyncio_loop.call_soon_threadsafe(self.terminate_event.set))
+        else:
+            self.asyncio_loop.call_soon_threadsafe(self.terminate_event.set)
         
         # terminate GUI
+        self.wakeup.close()
+        self.transcript_store.close()
+        if self.transcript_index is not None:
+            self.transcript_index.save()
         self.root.destroy()
 
     def consume_transcription(self):
+        if self.transcription_controller is None:
+            return
         try:
             while True:
                 msg_type, msg = self.transcription_controller.transcriptions_queue.get_nowait()
+                trace = getattr(msg, 'trace', None)
+                if trace is not None:
+                    trace.span_from('queued', 'results queue')
                 if msg_type == "user_msg":
-                    self.update_log(msg, "#004000")
+                    self.update_log(msg, "#004000", 'user')
+                    self.cancel_speculation()
                 elif msg_type == "system_msg":
-                    self.update_log(msg, "#000050")
+                    self.update_log(msg, "#000050", 'system')
+                    self.cancel_speculation()
+                elif msg_type == "system_turn_end":
+                    # run after pending log updates so the prompt includes the whole turn
+                    self.root.after(0, self.start_speculation)
+                elif msg_type == "trigger":
+                    self.root.after(0, self.ask_trigger, msg)
                 else:
                     print(f"unknown message type {msg_type}")
         except queue.Empty:
             pass
-        finally:
-            self.root.after(100, self.consume_transcription)
     
     def consume_ai_answer(self):
-        try:
-            while True:
-                ai_chunk = self.gpt_controller.queue.get_nowait()
-                self.textbox_right.configure(state='normal')
-                self.textbox_right.insert(tk.END, ai_chunk)
-                self.textbox_right.configure(state='disabled')
-                self.textbox_right.see(tk.END)
-        except queue.Empty:
-            pass
-        finally:
-            self.root.after(100, self.consume_ai_answer)
+        if self.gpt_controller is None:
+            return
+        for request_id, ai_text in self.gpt_controller.answer_buffer.drain():
+            # drop output from superseded requests
+            if request_id != self.gpt_controller.active_request_id:
+                continue
+            request = self.gpt_controller.active_request
+            if request is not None and request.trace is not None and request.request_id == request_id and 'rendered' not in request.trace.marks:
+                request.trace.mark('rendered')
+                request.trace.span('first token shown', request.first_chunk)
+            self.textbox_right.configure(state='normal')
+            self.textbox_right.insert(tk.END, ai_text)
+            self.textbox_right.configure(state='disabled')
+            self.textbox_right.see(tk.END)
+
+    def consume_panel_answers(self):
+        if self.gpt_controller is None:
+            return
+        for prompt_id, panel_textbox in self.panel_textboxes.items():
+            for request_id, ai_text in self.gpt_controller.panel_buffer(prompt_id).drain():
+                if request_id != self.gpt_controller.active_panel_request_id:
+                    continue
+                panel_textbox.configure(state='normal')
+                panel_textbox.insert(tk.END, ai_text)
+                panel_textbox.configure(state='disabled')
+                panel_textbox.see(tk.END)
 
     def create_widgets(self):
          # tabs widget
@@ -84,12 +166,11 @@ class AppGUI:
         audio_input_label = tk.Label(self.tab1, text="System Loopback")
         audio_input_label.grid(row=1, column=0, padx=5, pady=5)
 
-        # dropdown for audio input
-        self.find_devices()
-        device_names = [x for x in self.device_map.keys() if x != 'None']
-        device_names.insert(0, 'None') # make 'None' first element
-        self.audio_input_dropdowns.append(DeviceSelectDropdown(self.tab1, 0, 1, device_names, self.stop_transcription))
-        self.audio_input_dropdowns.append(DeviceSelectDropdown(self.tab1, 1, 1, device_names, self.stop_transcription))
+        # dropdown for audio input, from the device cache until PortAudio is up
+        self.load_device_cache()
+        device_names = self.device_names()
+        self.audio_input_dropdowns.append(DeviceSelectDropdown(self.tab1, 0, 1, device_names, self.devices_changed))
+        self.audio_input_dropdowns.append(DeviceSelectDropdown(self.tab1, 1, 1, device_names, self.devices_changed))
 
         # language selection dropdown
         languages = ["en", "en-US", "en-AU", "en-GB", "en-NZ", "en-IN", "fr", "fr-CA", "de", "hi", "hi-Latn", "pt", "pt-BR", "es", "es-419"]
@@ -100,11 +181,11 @@ class AppGUI:
         language_dropdown.grid(row=1, column=2, padx=5, pady=5)
 
         # start/stop capture button
-        self.capture_button = tk.Button(self.tab1, text="Start Capture", command=self.toggle_capture)
+        self.capture_button = tk.Button(self.tab1, text="Start Capture", command=self.toggle_capture, state='disabled')
         self.capture_button.grid(row=0, column=2, padx=5, pady=5)
 
         # ask guru button
-        self.ask_guru_button = tk.Button(self.tab1, text="ASK\nGURU", command=self.ask_guru)
+        self.ask_guru_button = tk.Button(self.tab1, text="ASK\nGURU", command=self.ask_guru, state='disabled')
         self.ask_guru_button.grid(row=0, column=4, padx=20, pady=20, columnspan=3, rowspan=2, ipadx=20, ipady=20)
 
         # transcribed text label
@@ -118,11 +199,30 @@ class AppGUI:
         self.textbox_left = scrolledtext.ScrolledText(self.tab1, wrap=tk.WORD, height=25, width=50)
         self.textbox_left.grid(row=3, column=0, padx=5, pady=5, columnspan=3, sticky='nsew')
         # self.textbox_left.configure(state='disabled') ### testing editable log transcript
+        # only recent segments are displayed, the rest stays in the store
+        self.transcript_store = TranscriptStore.from_env()
+        self.transcript_view = TranscriptView(self.textbox_left, self.transcript_store)
 
         # clear log button
         self.clear_log_button = tk.Button(self.tab1, text="Clear Log", command=self.clear_log)
         self.clear_log_button.grid(row=4, column=0, padx=5, pady=0)
 
+        # speculative answers checkbox (asks the guru in the background when the system speaker stops)
+        self.speculative_mode = tk.BooleanVar(self.tab1, value=False)
+        speculative_checkbox = tk.Checkbutton(self.tab1, text="Speculative Answers", variable=self.speculative_mode, command=self.cancel_speculation)
+        speculative_checkbox.grid(row=4, column=4, padx=5, pady=0)
+
+        # auto answers checkbox (asks the guru when a configured trigger phrase is heard, see TRIGGERS_FILE).
+        # off unless AUTO_ANSWERS=1, a triggered answer replaces the one being read
+        self.auto_answer_mode = tk.BooleanVar(self.tab1, value=os.getenv('AUTO_ANSWERS', '0') == '1')
+        auto_answer_checkbox = tk.Checkbutton(self.tab1, text="Auto Answers", variable=self.auto_answer_mode)
+        auto_answer_checkbox.grid(row=4, column=5, padx=5, pady=0)
+
+        # conversation mode checkbox (asks as the next turn of a conversation, only sending the new transcript)
+        self.conversation_mode = tk.BooleanVar(self.tab1, value=os.getenv('CONVERSATION_MODE', '0') == '1')
+        conversation_checkbox = tk.Checkbutton(self.tab1, text="Conversation", variable=self.conversation_mode, command=self.reset_conversation)
+        conversation_checkbox.grid(row=4, column=6, padx=5, pady=0)
+
         # AI text box
         self.textbox_right = scrolledtext.ScrolledText(self.tab1, wrap=tk.WORD, height=25, width=50)
         self.textbox_right.grid(row=3, column=4, padx=10, pady=10, columnspan=2, sticky='nsew')
@@ -145,21 +245,56 @@ class AppGUI:
         self.edit_save_button = tk.Button(self.tab2, text="Edit", command=self.toggle_prompt_edit_save)
         self.edit_save_button.grid(row=2, column=0, padx=5, pady=5)
 
-        # default prompts buttons
-        prompt2_button = tk.Button(self.tab2, text="The Perfect Candidate", command=lambda: self.toggle_prompt('interview_candidate'))
-        prompt2_button.grid(row=0, column=0, padx=5, pady=5)
-        prompt1_button = tk.Button(self.tab2, text="The Perfect Interviewer", command=lambda: self.toggle_prompt('interview_host'))
-        prompt1_button.grid(row=0, column=1, padx=5, pady=5)
-        prompt3_button = tk.Button(self.tab2, text="The Perfect Salesperson", command=lambda: self.toggle_prompt('salesperson'))
-        prompt3_button.grid(row=0, column=2, padx=5, pady=5)
-        prompt4_button = tk.Button(self.tab2, text="Easy Customer", command=lambda: self.toggle_prompt('customer_easy'))
-        prompt4_button.grid(row=0, column=3, padx=5, pady=5)
-        prompt5_button = tk.Button(self.tab2, text="Hard Customer", command=lambda: self.toggle_prompt('customer_hard'))
-        prompt5_button.grid(row=0, column=4, padx=5, pady=5)
-
+        # load reference document button, only the parts relevant to the conversation are sent for [DOC:name]
+        self.load_document_button = tk.Button(self.tab2, text="Load Document", command=self.load_document, state='disabled')
+        self.load_document_button.grid(row=2, column=1, padx=5, pady=5)
 
+        # default prompts buttons
+        for column, (prompt_id, prompt_name) in enumerate(prompt_names.items()):
+            prompt_button = tk.Button(self.tab2, text=prompt_name, command=lambda prompt_id=prompt_id: self.toggle_prompt(prompt_id))
+            prompt_button.grid(row=0, column=column, padx=5, pady=5)
+
+        # third tab: panel of prompts answered in parallel
+        self.tab3 = ttk.Frame(self.notebook)
+        self.notebook.add(self.tab3, text='Panel')
+
+        # one checkbox and answer pane per prompt
+        self.panel_selected = {}
+        self.panel_textboxes = {}
+        for i, (prompt_id, prompt_name) in enumerate(prompt_names.items()):
+            row, column = 2 * (i // 3), i % 3
+            self.panel_selected[prompt_id] = tk.BooleanVar(self.tab3, value=True)
+            panel_checkbox = tk.Checkbutton(self.tab3, text=prompt_name, variable=self.panel_selected[prompt_id])
+            panel_checkbox.grid(row=row, column=column, padx=5, pady=5)
+            panel_textbox = scrolledtext.ScrolledText(self.tab3, wrap=tk.WORD, height=12, width=40)
+            panel_textbox.grid(row=row + 1, column=column, padx=5, pady=5, sticky='nsew')
+            panel_textbox.configure(state='disabled')
+            self.panel_textboxes[prompt_id] = panel_textbox
+
+        # ask panel button
+        self.ask_panel_button = tk.Button(self.tab3, text="ASK PANEL", command=self.ask_panel, state='disabled')
+        self.ask_panel_button.grid(row=4, column=2, padx=5, pady=5, ipadx=10, ipady=10)
+
+        # fourth tab: search over the saved transcripts
+        self.tab4 = ttk.Frame(self.notebook)
+        self.notebook.add(self.tab4, text='Search')
+        self.search_entry = tk.Entry(self.tab4, width=60, state='disabled')
+        self.search_entry.grid(row=0, column=0, padx=5, pady=5, sticky='ew')
+        self.search_entry.bind('<Return>', lambda event: self.search_transcripts())
+        self.search_speaker = tk.StringVar(self.tab4, value='any')
+        search_speaker_dropdown = tk.OptionMenu(self.tab4, self.search_speaker, 'any', 'user', 'system')
+        search_speaker_dropdown.grid(row=0, column=1, padx=5, pady=5)
+        self.search_button = tk.Button(self.tab4, text="Search", command=self.search_transcripts, state='disabled')
+        self.search_button.grid(row=0, column=2, padx=5, pady=5)
+        self.search_results = scrolledtext.ScrolledText(self.tab4, wrap=tk.WORD, height=25, width=100)
+        self.search_results.grid(row=1, column=0, padx=5, pady=5, columnspan=3, sticky='nsew')
+        self.search_results.insert(tk.END, 'set TRANSCRIPTS_DIR to save and search transcripts. use "quotes" for phrases.')
+        self.search_results.configure(state='disabled')
+
+
+    # queries and maps the audio input devices, does not touch Tk so it can run off the Tk thread
     def find_devices(self):
-        # query and map audio input devices
+        device_map = {'None': None}
         num_devices = self.transcription_controller.p.get_device_count()
         for i in range(num_devices):
             device_info = self.transcription_controller.p.get_device_info_by_index(i)
@@ -168,38 +303,104 @@ class AppGUI:
                 # create device name
                 device_name = f"{str(device_info['index'])}. {device_info['name']}"
                 # set local data
-                self.device_map[device_name] = device_info
-                self.device_map['None'] = None
+                device_map[device_name] = device_info
+        return device_map
 
-    def start_audio_streams(self):
-        # get selected
+    def device_names(self):
+        device_names = [x for x in self.device_map.keys() if x != 'None']
+        device_names.insert(0, 'None') # make 'None' first element
+        return device_names
+
+    def load_device_cache(self):
+        if not self.device_cache_path or not os.path.exists(self.device_cache_path):
+            return
+        try:
+            with open(self.device_cache_path) as file:
+                self.device_map.update(json.load(file))
+        except Exception as e:
+            print(f"could not read device cache {e}")
+
+    # enumerates the current devices in a background thread, PortAudio can take seconds with many devices.
+    # the dropdowns keep the cached devices until the results are posted back to the Tk thread.
+    def refresh_devices(self):
+        def enumerate_devices():
+            start = time.perf_counter()
+            try:
+                device_map = self.find_devices()
+            except Exception as e:
+                print(f"could not enumerate audio devices {e}")
+                return
+            elapsed = time.perf_counter() - start
+            # dropped when the window closed meanwhile
+            self.wakeup.call(lambda: self.devices_found(device_map, elapsed))
+        threading.Thread(target=enumerate_devices, daemon=True).start()
+
+    # updates the dropdowns and the cache with the enumerated devices, on the Tk thread
+    def devices_found(self, device_map, elapsed):
+        self.device_map = device_map
+        device_names = self.device_names()
+        for dropdown in self.audio_input_dropdowns:
+            dropdown.set_options(device_names)
+        print(f"found {len(device_names) - 1} input devices in {elapsed * 1000:.0f}ms")
+        if not self.device_cache_path:
+            return
+        try:
+            with open(self.device_cache_path, 'w') as file:
+                cached = {name: {key: info[key] for key in ('index', 'name', 'maxInputChannels', 'defaultSampleRate')} for name, info in self.device_map.items() if info is not None}
+                json.dump(cached, file)
+        except Exception as e:
+            print(f"could not write device cache {e}")
+
+    # selected device ids and their capture frequencies
+    def selected_devices(self):
         device_infos = [self.device_map[dropdown.selected_option.get()] for dropdown in self.audio_input_dropdowns]
-        device_ids = [device_info['index'] for device_info in device_infos if device_info['index'] is not None]
+        device_infos = [device_info for device_info in device_infos if device_info is not None]
+        device_ids = [device_info['index'] for device_info in device_infos]
+        device_frequencies = [device_info['defaultSampleRate'] for device_info in device_infos]
+        return device_ids, device_frequencies
+
+    def start_audio_streams(self):
+        device_ids, device_frequencies = self.selected_devices()
         if (len(device_ids) == 0):
             print("no audio input devices selected")
             return
-        language = self.selected_language.get()
-        fut = asyncio.run_coroutine_threadsafe(self.transcription_controller.start_deepgram(device_ids, language), self.asyncio_loop)
-        fut.result()
-        # get audio input capture frequencies
-        device_frequencies = [device_info['defaultSampleRate'] for device_info in device_infos if device_info['index'] is not None]
         print('device_frequencies', device_frequencies)
-        self.transcription_controller.start(device_ids, device_frequencies, self.asyncio_loop)
-        self.capture_button.config(text="Stop Capture")
+        language = self.selected_language.get()
+        asyncio.run_coroutine_threadsafe(self.transcription_controller.request_start(device_ids, device_frequencies, language), self.asyncio_loop)
 
     def stop_transcription(self):
-        future = asyncio.run_coroutine_threadsafe(self.transcription_controller.stop(), self.asyncio_loop)
-        future.result() # make UI hang while stopping
-        self.capture_button.config(text="Start Capture")
+        asyncio.run_coroutine_threadsafe(self.transcription_controller.request_stop(), self.asyncio_loop)
 
     def toggle_capture(self):
-        # toggle capture button logic
-        if self.transcription_controller.audio_stream_0 == None and \
-            self.transcription_controller.audio_stream_1 == None:
+        # toggle capture button logic, ignored while starting or stopping
+        state = self.transcription_controller.state
+        if state == self.transcription_controller.IDLE:
             self.start_audio_streams()
-        else:
+        elif state == self.transcription_controller.RUNNING:
             self.stop_transcription()
 
+    # swaps the capture devices without closing the deepgram session when capturing
+    def devices_changed(self):
+        if self.transcription_controller is None:
+            return
+        device_ids, device_frequencies = self.selected_devices()
+        language = self.selected_language.get()
+        asyncio.run_coroutine_threadsafe(self.transcription_controller.request_switch_devices(device_ids, device_frequencies, language), self.asyncio_loop)
+
+    def capture_state_changed(self, state):
+        button_texts = {
+            'idle': "Start Capture",
+            'starting': "Starting...",
+            'running': "Stop Capture",
+            'stopping': "Stopping...",
+        }
+        self.capture_button.config(text=button_texts[state])
+        if state == self.transcription_controller.RUNNING:
+            # warm up the LLM connection so the first ask doesn't pay for the handshake
+            asyncio.run_coroutine_threadsafe(self.gpt_controller.start_session(), self.asyncio_loop)
+        elif state == self.transcription_controller.IDLE:
+            asyncio.run_coroutine_threadsafe(self.gpt_controller.stop_session(), self.asyncio_loop)
+
     def toggle_prompt_edit_save(self):
         if self.textbox_base_prompt.cget('state') == 'disabled':
             # enable textbox
@@ -210,27 +411,59 @@ class AppGUI:
             self.textbox_base_prompt.configure(state='disabled', background='#f0f0f0')
             self.edit_save_button.config(text="Edit")
     
-    def update_log(self, message, color='black'):
+    def load_document(self):
+        path = filedialog.askopenfilename(filetypes=[("Text documents", "*.txt *.md"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            name = self.reference_library.load(path)
+        except Exception as e:
+            print(f"could not load document {path}: {e}")
+            return
+        # insert the placeholder where the cursor is when editing the prompt
+        if self.textbox_base_prompt.cget('state') == 'normal':
+            self.textbox_base_prompt.insert(tk.INSERT, f"[DOC:{name}]")
+        else:
+            print(f"document loaded, use [DOC:{name}] in the prompt")
+
+    def update_log(self, message, color='black', speaker=''):
+        trace = getattr(message, 'trace', None)
+        if trace is not None:
+            trace.mark('scheduled')
+            message = str(message)
         # update the scrolled text widget with a new message
         def task():
-            self.textbox_left.configure(state='normal')
-            
-            # Use color code as the tag name
-            color_tag = f"color_{color}"
-            if color_tag not in self.textbox_left.tag_names():
-                self.textbox_left.tag_configure(color_tag, foreground=color)
-
-            # insert text with the color tag
-            self.textbox_left.insert(tk.END, message, color_tag)
-
-            # self.textbox_left.configure(state='disabled') ### testing editable log transcript
-            self.textbox_left.see(tk.END)
+            self.transcript_view.append(message, speaker, color)
+            if trace is not None:
+                trace.span_from('scheduled', 'display')
+            store = self.transcript_store
+            if self.transcript_index is not None and store.path:
+                # indexed from memory, reading the session file back on the Tk thread for every segment would stall it
+                self.transcript_index.add_line(store.path, store.line_offset, store.file_bytes, message, speaker, store.times[-1])
         self.root.after(0, task)
 
+    def search_transcripts(self):
+        start = time.perf_counter()
+        results = self.transcript_index.search(self.search_entry.get(), self.search_speaker.get(), limit=200)
+        elapsed = time.perf_counter() - start
+        self.search_results.configure(state='normal')
+        self.search_results.delete('1.0', tk.END)
+        self.search_results.insert(tk.END, f"{len(results)} results in {elapsed * 1000:.1f}ms (newest first)\n")
+        for result in results:
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(result['time']))
+            self.search_results.insert(tk.END, f"\n{when} {result['speaker']}: {result['text']}")
+        self.search_results.configure(state='disabled')
+
+    # the next capture starts in the selected language, a running one switches over without stopping
     def language_changed(self, *args):
-        print(f"language changed to {self.selected_language.get()}")
+        language = self.selected_language.get()
+        print(f"language changed to {language}")
+        if self.transcription_controller is None or self.transcription_controller.state != self.transcription_controller.RUNNING:
+            return
+        asyncio.run_coroutine_threadsafe(self.transcription_controller.request_switch_language(language), self.asyncio_loop)
     
     def toggle_prompt(self, prompt_id='interview_candidate'):
+        self.prompt_id = prompt_id
         # erase and insert default text on textbox
         self.textbox_base_prompt.configure(state='normal', background='white')
         self.textbox_base_prompt.delete('1.0', tk.END)
@@ -238,26 +471,248 @@ class AppGUI:
         self.textbox_base_prompt.configure(state='disabled', background='#f0f0f0')
 
     def clear_log(self):
-        self.textbox_left.configure(state='normal')
-        self.textbox_left.delete('1.0', tk.END)
-        # self.textbox_left.configure(state='disabled') ### testing editable log transcript
+        self.transcript_view.clear()
+        self.reset_conversation()
+
+    # base_prompt defaults to the stage prompt
+    def build_prompt(self, base_prompt=None):
+        transcription = self.transcript_view.text()
+        final_prompt = base_prompt if base_prompt is not None else self.textbox_base_prompt.get("1.0", tk.END)
+        return self.fill_prompt(final_prompt, transcription)
+
+    def fill_prompt(self, prompt, transcription):
+        return fill_prompt(prompt, transcription, self.reference_library)
+
+    def start_speculation(self):
+        # speculative answers are single prompts, they would never match a conversation ask
+        if not self.speculative_mode.get() or self.conversation_mode.get():
+            return
+        latency_class = prompt_latency_classes.get(self.prompt_id, 'standard')
+        asyncio.run_coroutine_threadsafe(self.gpt_controller.speculate(self.build_prompt(), latency_class), self.asyncio_loop)
+
+    def cancel_speculation(self):
+        if self.gpt_controller is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.gpt_controller.cancel_speculation(), self.asyncio_loop)
+
+    def reset_conversation(self):
+        if self.gpt_controller is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.gpt_controller.reset_conversation(), self.asyncio_loop)
 
     def ask_guru(self):
-        # clear guru textbox
+        started = time.perf_counter()
+        self.manual_answer_at = started
+        latency_class = prompt_latency_classes.get(self.prompt_id, 'standard')
+        if self.conversation_mode.get():
+            self.ask_conversation(None, latency_class, started)
+            return
+        self.ask(self.build_prompt(), latency_class, started)
+
+    # asks with the prompt of a trigger rule (or the stage prompt when the rule has none)
+    def ask_trigger(self, rule_name):
+        if not self.auto_answer_mode.get():
+            return
+        if self.manual_answer_at is not None and time.perf_counter() - self.manual_answer_at < self.auto_answer_hold:
+            print(f"auto answer for trigger {rule_name} skipped, the answer asked for is still showing")
+            return
+        trigger_rules = self.transcription_controller.trigger_rules
+        base_prompt, latency_class = trigger_rules.prompt_for(rule_name, self.prompt_id)
+        if 'prompt_id' not in trigger_rules.rules[rule_name] and 'prompt' not in trigger_rules.rules[rule_name]:
+            base_prompt = None # the stage prompt, it may have been edited
+        print(f"auto answer for trigger {rule_name}")
+        started = time.perf_counter()
+        if self.conversation_mode.get():
+            self.ask_conversation(base_prompt, latency_class, started)
+            return
+        self.ask(self.build_prompt(base_prompt), latency_class, started)
+
+    def count_tokens(self, text):
+        if self.token_encoder is None:
+            import tiktoken
+            self.token_encoder = tiktoken.get_encoding("cl100k_base")
+        return len(self.token_encoder.encode(text))
+
+    def clear_answer(self):
         self.textbox_right.configure(state='normal')
         self.textbox_right.delete('1.0', tk.END)
         self.textbox_right.configure(state='disabled')
-        # prepare prompt 
-        transcription = self.textbox_left.get("1.0", tk.END)
-        final_prompt = self.textbox_base_prompt.get("1.0", tk.END)
-        final_prompt = final_prompt.replace("[INPUT_TRANSCRIPTION]", transcription)
+
+    # trace of an ask, its first span from started (when the ask began) to now
+    def trace_ask(self, started, **args):
+        if tracing.tracer is None:
+            return None
+        last_segment = tracing.tracer.last_segment
+        if last_segment is not None:
+            args['since_last_segment_ms'] = round((started - last_segment) * 1000)
+        trace = tracing.tracer.start_ask(**args)
+        trace.span('prompt', started)
+        trace.mark('scheduled')
+        return trace
+
+    def ask(self, final_prompt, latency_class, started=None):
+        started = started or time.perf_counter()
+        self.clear_answer()
         # prompt token size
-        enc = tiktoken.get_encoding("cl100k_base")
-        token_count = len(enc.encode(final_prompt))
+        token_count = self.count_tokens(final_prompt)
         print("asking guru...\n", token_count, " tokens")
         print(final_prompt)
-        asyncio.run_coroutine_threadsafe(self.gpt_controller.send_prompt(final_prompt), self.asyncio_loop)
-
+        request_id = self.gpt_controller.new_request_id()
+        trace = self.trace_ask(started, request_id=request_id, prompt_tokens=token_count, latency_class=latency_class)
+        asyncio.run_coroutine_threadsafe(self.gpt_controller.send_prompt(final_prompt, request_id, latency_class, token_count, trace), self.asyncio_loop)
+
+    # base_prompt defaults to the stage prompt, the conversation counts the tokens and reports them
+    def ask_conversation(self, base_prompt, latency_class, started=None):
+        started = started or time.perf_counter()
+        self.clear_answer()
+        if base_prompt is None:
+            base_prompt = self.textbox_base_prompt.get("1.0", tk.END)
+        print("asking guru (conversation)...")
+        request_id = self.gpt_controller.new_request_id()
+        fill_docs = self.reference_library.fill if self.reference_library is not None else None
+        transcription = self.transcript_view.text()
+        trace = self.trace_ask(started, request_id=request_id, latency_class=latency_class, conversation=True)
+        asyncio.run_coroutine_threadsafe(self.gpt_controller.send_conversation_prompt(
+            base_prompt, transcription, request_id, latency_class, fill_docs, trace), self.asyncio_loop)
+
+    def ask_panel(self):
+        # same transcript snapshot for every selected prompt
+        transcription = self.transcript_view.text()
+        prompts = {}
+        for prompt_id, selected in self.panel_selected.items():
+            panel_textbox = self.panel_textboxes[prompt_id]
+            panel_textbox.configure(state='normal')
+            panel_textbox.delete('1.0', tk.END)
+            panel_textbox.configure(state='disabled')
+            if selected.get():
+                prompts[prompt_id] = self.fill_prompt(base_prompts[prompt_id], transcription)
+        if not prompts:
+            print("no panel prompts selected")
+            return
+        print(f"asking panel {list(prompts.keys())}...")
+        request_id = self.gpt_controller.new_panel_request_id()
+        asyncio.run_coroutine_threadsafe(self.gpt_controller.send_panel_prompts(prompts, request_id, prompt_latency_classes), self.asyncio_loop)
+
+
+# transcript textbox that only holds a window of recent segments, so inserts stay cheap in long sessions.
+# older segments stay in the TranscriptStore and are paged back in when scrolling to the top.
+# each displayed segment starts at a mark named seg<store index>, so the text can still be edited.
+class TranscriptView:
+    def __init__(self, textbox: scrolledtext.ScrolledText, store: TranscriptStore, max_segments=300, page_segments=100):
+        self.textbox = textbox
+        self.store = store
+        self.max_segments = max_segments
+        self.page_segments = page_segments
+        self.base = 0 # segments before base were cleared from the log
+        self.first = 0 # displayed segments are store[first:last]
+        self.last = 0
+        self.color_tags = {} # color -> tag name, configured once
+        self.speaker_colors = {} # speaker -> color, to color paged in segments
+        self.paging = False
+        self.scrollbar_set = textbox.vbar.set
+        textbox.configure(yscrollcommand=self._on_scroll)
+
+    def append(self, message, speaker, color):
+        self.speaker_colors[speaker] = color
+        index = self.store.append(message, speaker)
+        if self.last != index:
+            # scrolled back in history, the segment shows up when paging forward
+            return
+        at_bottom = self.textbox.yview()[1] >= 1.0
+        self._insert_end(index)
+        # keep the window bounded, trimming only while following so the text doesn't move under the reader
+        displayed = self.last - self.first
+        if displayed > self.max_segments and (at_bottom or displayed > 2 * self.max_segments):
+            self._trim_top(displayed - self.max_segments)
+        if at_bottom:
+            self.textbox.see(tk.END)
+
+    # whole transcript since the last clear, with any edits made to the displayed window
+    def text(self):
+        displayed = self.textbox.get('1.0', 'end-1c')
+        return self.store.text(self.base, self.first) + displayed + self.store.text(self.last) + '\n'
+
+    def clear(self):
+        self.textbox.delete('1.0', tk.END)
+        for index in range(self.first, self.last):
+            self.textbox.mark_unset(f'seg{index}')
+        self.base = self.first = self.last = len(self.store)
+
+    def _color_tag(self, speaker):
+        color = self.speaker_colors.get(speaker, 'black')
+        if color not in self.color_tags:
+            self.color_tags[color] = f"color_{color}"
+            self.textbox.tag_configure(self.color_tags[color], foreground=color)
+        return self.color_tags[color]
+
+    def _insert_end(self, index):
+        message, speaker = self.store.segment(index)
+        mark = f'seg{index}'
+        self.textbox.mark_set(mark, 'end-1c')
+        self.textbox.mark_gravity(mark, 'left')
+        self.textbox.insert(tk.END, message, self._color_tag(speaker))
+        self.last = index + 1
+
+    def _insert_top(self, index):
+        if self.first == self.last:
+            self._insert_end(index)
+            self.first = index
+            return
+        message, speaker = self.store.segment(index)
+        # the current first mark has to move right of the inserted text
+        first_mark = f'seg{self.first}'
+        self.textbox.mark_gravity(first_mark, 'right')
+        self.textbox.insert('1.0', message, self._color_tag(speaker))
+        self.textbox.mark_gravity(first_mark, 'left')
+        self.textbox.mark_set(f'seg{index}', '1.0')
+        self.textbox.mark_gravity(f'seg{index}', 'left')
+        self.first = index
+
+    def _trim_top(self, count):
+        end = self.first + count
+        self.textbox.delete('1.0', f'seg{end}')
+        for index in range(self.first, end):
+            self.textbox.mark_unset(f'seg{index}')
+        self.first = end
+
+    def _trim_bottom(self, count):
+        start = self.last - count
+        self.textbox.delete(f'seg{start}', 'end-1c')
+        for index in range(start, self.last):
+            self.textbox.mark_unset(f'seg{index}')
+        self.last = start
+
+    def _on_scroll(self, top, bottom):
+        self.scrollbar_set(top, bottom)
+        if self.paging:
+            return
+        if float(top) <= 0.0 and self.first > self.base:
+            self.paging = True
+            self.textbox.after_idle(self._page_older)
+        elif float(bottom) >= 1.0 and self.last < len(self.store):
+            self.paging = True
+            self.textbox.after_idle(self._page_newer)
+
+    def _page_older(self):
+        anchor = f'seg{self.first}'
+        start = max(self.base, self.first - self.page_segments)
+        for index in reversed(range(start, self.first)):
+            self._insert_top(index)
+        # keep the reader where they were instead of at the top of the new page
+        self.textbox.yview(anchor)
+        if self.last - self.first > self.max_segments:
+            self._trim_bottom(self.last - self.first - self.max_segments)
+        self.paging = False
+
+    def _page_newer(self):
+        self.textbox.mark_set('view_anchor', '@0,0')
+        end = min(len(self.store), self.last + self.page_segments)
+        for index in range(self.last, end):
+            self._insert_end(index)
+        if self.last - self.first > self.max_segments:
+            self._trim_top(self.last - self.first - self.max_segments)
+        self.textbox.yview('view_anchor')
+        self.paging = False
 
 class DeviceSelectDropdown:
     def __init__(self, master, row, col, device_names, device_changed_callback):
@@ -272,3 +727,12 @@ class DeviceSelectDropdown:
     def device_changed(self, *args):
         # handle selected device change
         self.device_changed_callback()
+
+    # replaces the dropdown entries, keeping the selection if the device is still there
+    def set_options(self, device_names):
+        menu = self.audio_input_dropdown['menu']
+        menu.delete(0, 'end')
+        for device_name in device_names:
+            menu.add_command(label=device_name, command=tk._setit(self.selected_option, device_name))
+        if self.selected_option.get() not in device_names:
+            self.selected_option.set(device_names[0])
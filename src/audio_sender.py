@@ -0,0 +1,147 @@
+import asyncio
+import time
+from bisect import bisect_right
+from collections import deque
+
+# bytes handed to a deepgram live connection that are not on the network yet: the audio waiting in the sdk
+# queue (shared with the incoming messages) and the socket transport write buffer.
+# these are sdk internals, when they are missing the depth reads 0 and frames are sent as they come.
+def live_buffered_bytes(live):
+    depth = 0
+    queue = getattr(live, '_queue', None)
+    if queue is not None:
+        depth += sum(len(body) for incoming, body in list(getattr(queue, '_queue', ())) if not incoming)
+    transport = getattr(getattr(live, '_socket', None), 'transport', None)
+    if transport is not None:
+        depth += transport.get_write_buffer_size()
+    return depth
+
+# sends the mixed audio frames from its own task instead of from the mixer callback.
+# while the link keeps up each frame goes out on its own, as soon as it arrives. when more than high_water_seconds
+# of audio are buffered downstream (buffered_bytes), frames wait here and go out coalesced into messages of up to
+# max_message_seconds once the buffers drain, so a slow uplink gets fewer, larger messages.
+# at most max_queue_seconds are kept, the oldest frames are dropped beyond that.
+# put() is called on the asyncio loop. on_sent(frames, time), when set, gets the (queued, captured, size) of the
+# frames of each message.
+class AudioSender:
+    def __init__(self, send, buffered_bytes=None, bytes_per_second=32000, high_water_seconds=0.3, max_message_seconds=1.0,
+                 max_queue_seconds=30.0, poll_interval=0.02, warn_latency=1.0):
+        self.send = send
+        self.buffered_bytes = buffered_bytes if buffered_bytes is not None else (lambda: 0)
+        self.bytes_per_second = bytes_per_second
+        self.high_water = int(high_water_seconds * bytes_per_second)
+        self.max_message = int(max_message_seconds * bytes_per_second)
+        self.max_queue = int(max_queue_seconds * bytes_per_second)
+        self.poll_interval = poll_interval
+        self.warn_latency = warn_latency
+        self.frames = deque() # (time queued, frame, time captured)
+        self.queued_bytes = 0
+        self.latencies = deque(maxlen=500) # seconds each recent frame waited here
+        self.messages = 0
+        self.frames_sent = 0
+        self.dropped_bytes = 0
+        self.put_bytes = 0 # audio put here, sent or not
+        self.sent_bytes = 0 # audio handed to send, what the receiver counts its stream time in
+        self.gap_offsets = [] # sent_bytes where dropped frames are missing from the sent stream
+        self.gap_dropped = [] # dropped_bytes up to each gap
+        self.last_warning = 0.0
+        self.wakeup = None
+        self.task = None
+        self.on_sent = None
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    # captured is when the audio was captured, for tracing
+    def put(self, frame, captured=None):
+        self.frames.append((time.perf_counter(), frame, captured))
+        self.queued_bytes += len(frame)
+        self.put_bytes += len(frame)
+        while self.queued_bytes > self.max_queue and len(self.frames) > 1:
+            _, dropped, _ = self.frames.popleft()
+            self.queued_bytes -= len(dropped)
+            self.dropped_bytes += len(dropped)
+            # frames before the dropped one are all sent, the gap is at the end of the sent stream
+            if self.gap_offsets and self.gap_offsets[-1] == self.sent_bytes:
+                self.gap_dropped[-1] = self.dropped_bytes
+            else:
+                self.gap_offsets.append(self.sent_bytes)
+                self.gap_dropped.append(self.dropped_bytes)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.frames:
+                if self.buffered_bytes() > self.high_water:
+                    # the link is behind, let the frames pile up and coalesce
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                self._send_message()
+                await asyncio.sleep(0)
+
+    def _send_message(self):
+        now = time.perf_counter()
+        batch = []
+        size = 0
+        timings = []
+        while self.frames and (not batch or size + len(self.frames[0][1]) <= self.max_message):
+            queued, frame, captured = self.frames.popleft()
+            batch.append(frame)
+            size += len(frame)
+            self.latencies.append(now - queued)
+            timings.append((queued, captured, len(frame)))
+        self.queued_bytes -= size
+        self.sent_bytes += size
+        try:
+            self.send(batch[0] if len(batch) == 1 else b''.join(batch))
+        except Exception as e:
+            print(f"audio send exception {e}")
+        if self.on_sent is not None:
+            self.on_sent(timings, now)
+        self.messages += 1
+        self.frames_sent += len(batch)
+        latency = self.latencies[-len(batch)]
+        if latency > self.warn_latency and now - self.last_warning > 10:
+            self.last_warning = now
+            print(f"audio send queue {latency:.1f}s behind ({self.buffered_bytes() / self.bytes_per_second:.1f}s more in the socket buffers)")
+
+    # position in the audio put here of the byte at sent_offset in the sent stream, counting the dropped frames
+    def put_offset(self, sent_offset):
+        i = bisect_right(self.gap_offsets, sent_offset) - 1
+        return sent_offset + (self.gap_dropped[i] if i >= 0 else 0)
+
+    # sends what is left, waiting up to timeout for the link
+    async def flush(self, timeout=2.0):
+        deadline = time.perf_counter() + timeout
+        while self.frames and time.perf_counter() < deadline:
+            if self.buffered_bytes() > self.high_water:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            self._send_message()
+        if self.frames:
+            print(f"audio sender closed with {self.queued_bytes / self.bytes_per_second:.1f}s unsent")
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    # send queue latency (ms, over the last frames), audio waiting here and downstream (seconds) and coalescing
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000 if latencies else 0.0
+        return {
+            'queue_latency_ms_p50': percentile(50),
+            'queue_latency_ms_p95': percentile(95),
+            'queue_latency_ms_max': latencies[-1] * 1000 if latencies else 0.0,
+            'queued_seconds': self.queued_bytes / self.bytes_per_second,
+            'socket_buffered_seconds': self.buffered_bytes() / self.bytes_per_second,
+            'messages': self.messages,
+            'frames_per_message': self.frames_sent / self.messages if self.messages else 0.0,
+            'dropped_seconds': self.dropped_bytes / self.bytes_per_second,
+        }
@@ -0,0 +1,309 @@
+"""
+    batch transcription of recordings (like the mixed_audio.lin16 the mixer writes) with the Deepgram prerecorded api.
+
+    * each recording is cut into chunks of about --chunk-seconds, at the quietest point before the cut so words aren't split.
+    * the chunks of every recording are transcribed concurrently by a bounded pool of workers. a rate limited answer (429)
+      halves the requests in flight and pauses them for its Retry-After, successes raise the limit back one at a time.
+      server errors and broken connections are retried with backoff.
+    * utterances are put back on the recording timeline (chunk offset + utterance start). channel 0 is the user and channel 1
+      the system, like in live transcription. the result is saved as a session file in --out-dir (json lines like
+      TranscriptStore), so saving to TRANSCRIPTS_DIR makes it searchable in the Search tab.
+    * .lin16 files are raw 16kHz int16 audio with --channels interleaved channels, .wav files carry their own format.
+      the mixer appends every capture to the same file, so the recording start time (--start-time) defaults to the file
+      modification time minus the audio duration.
+    * DEEPGRAM_API_URL points to another server, e.g. the local stand-in benchmarks/mock_deepgram_server.py.
+
+    usage: python src/batch_transcriber.py mixed_audio.lin16 --channels 2 --language en-US --workers 8
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import random
+import time
+import wave
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+from transcript_store import TranscriptStore
+
+DEFAULT_API_URL = 'https://api.deepgram.com'
+SPEAKERS = ['user', 'system'] # by channel, like live transcription
+FRAME_SECONDS = 0.1 # resolution of the quiet point search
+
+# a recording as a (frames, channels) int16 array, memory mapped for raw files so long recordings aren't loaded at once
+class Recording:
+    def __init__(self, path, channels=2, rate=16000):
+        self.path = path
+        if path.lower().endswith('.wav'):
+            with wave.open(path, 'rb') as file:
+                if file.getsampwidth() != 2:
+                    raise ValueError('only 16 bit wav files are supported')
+                channels, rate = file.getnchannels(), file.getframerate()
+                samples = np.frombuffer(file.readframes(file.getnframes()), dtype=np.int16)
+        elif os.path.getsize(path) < 2 * channels:
+            samples = np.zeros(0, dtype=np.int16)
+        else:
+            samples = np.memmap(path, dtype=np.int16, mode='r')
+        self.channels = channels
+        self.rate = rate
+        frames = len(samples) // channels
+        self.samples = samples[:frames * channels].reshape(frames, channels)
+        self.duration = frames / rate
+
+    # (start, end) frames of each chunk, cut at the quietest FRAME_SECONDS of the search_seconds before the chunk length
+    def split(self, chunk_seconds, search_seconds=5.0):
+        size = int(chunk_seconds * self.rate)
+        step = int(FRAME_SECONDS * self.rate)
+        search = int(search_seconds * self.rate)
+        total = len(self.samples)
+        bounds = [0]
+        while total - bounds[-1] > size:
+            end = bounds[-1] + size
+            start = max(bounds[-1] + step, end - search)
+            count = (end - start) // step
+            window = self.samples[start:start + count * step].reshape(count, step, self.channels)
+            energy = np.abs(window.astype(np.int32)).sum(axis=(1, 2))
+            bounds.append(start + int(np.argmin(energy)) * step + step // 2)
+        if total > 0:
+            bounds.append(total)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def wav_bytes(self, start, end):
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as file:
+            file.setnchannels(self.channels)
+            file.setsampwidth(2)
+            file.setframerate(self.rate)
+            file.writeframes(np.ascontiguousarray(self.samples[start:end]).tobytes())
+        return buffer.getvalue()
+
+# limits the requests in flight to limit (at most max_in_flight), adapting it to the api rate limit:
+# a 429 halves it and pauses new requests until its retry time, limit successes in a row raise it by one.
+# a burst of 429s for requests sent before the pause only counts once.
+class AdaptiveLimiter:
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.rate_limited_count = 0
+        self.condition = None # created on the loop
+
+    async def acquire(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < self.limit:
+                    break
+                else:
+                    await self.condition.wait()
+            self.in_flight += 1
+
+    async def release(self, ok=True):
+        async with self.condition:
+            self.in_flight -= 1
+            if ok:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_in_flight:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    async def rate_limited(self, retry_after):
+        async with self.condition:
+            self.in_flight -= 1
+            self.rate_limited_count += 1
+            self.successes = 0
+            now = time.monotonic()
+            if now >= self.paused_until:
+                self.limit = max(1, self.limit // 2)
+                print(f"rate limited, {self.limit} requests in flight after {retry_after:.1f}s")
+            self.paused_until = max(self.paused_until, now + retry_after)
+            self.condition.notify_all()
+
+class BatchTranscriber:
+    def __init__(self, api_key, api_url=DEFAULT_API_URL, model='nova-2', language='en-US', workers=4, max_retries=5, timeout=300):
+        self.api_key = api_key
+        self.url = api_url.rstrip('/') + '/v1/listen'
+        self.model = model
+        self.language = language
+        self.workers = workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = AdaptiveLimiter(workers)
+        self.retries = 0
+        self.failed_chunks = 0
+
+    @classmethod
+    def from_env(cls, **options):
+        return cls(os.getenv('DEEPGRAM_API_KEY', ''), os.getenv('DEEPGRAM_API_URL', DEFAULT_API_URL), **options)
+
+    # transcribes the chunks of every recording, returns per recording the (start, end, speaker, text) utterances
+    # in recording time (seconds), sorted by start
+    async def transcribe(self, recordings: list, chunk_seconds=60):
+        jobs = asyncio.Queue()
+        results = []
+        for recording_index, recording in enumerate(recordings):
+            chunks = recording.split(chunk_seconds)
+            results.append([None] * len(chunks))
+            for chunk_index, (start, end) in enumerate(chunks):
+                jobs.put_nowait((recording_index, chunk_index, start, end))
+        limits = httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers)
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(self.timeout, connect=10)) as client:
+            async def worker():
+                while not jobs.empty():
+                    recording_index, chunk_index, start, end = jobs.get_nowait()
+                    recording = recordings[recording_index]
+                    response = await self._transcribe_chunk(client, recording, start, end)
+                    results[recording_index][chunk_index] = self._utterances(response, start / recording.rate) if response else []
+            await asyncio.gather(*(worker() for _ in range(self.workers)))
+        return [sorted(utterance for chunk in chunks for utterance in chunk) for chunks in results]
+
+    async def _transcribe_chunk(self, client: httpx.AsyncClient, recording: Recording, start, end):
+        params = {
+            'model': self.model,
+            'language': self.language,
+            'smart_format': 'true',
+            'utterances': 'true',
+            'multichannel': 'true' if recording.channels > 1 else 'false',
+        }
+        headers = {'Content-Type': 'audio/wav'}
+        if self.api_key:
+            headers['Authorization'] = f'Token {self.api_key}'
+        body = recording.wav_bytes(start, end)
+        chunk_name = f"{os.path.basename(recording.path)} at {start / recording.rate:.1f}s"
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+            await self.limiter.acquire()
+            try:
+                response = await client.post(self.url, params=params, headers=headers, content=body)
+            except httpx.HTTPError as e:
+                await self.limiter.release(ok=False)
+                error = f'{type(e).__name__} {e}'
+                if isinstance(e, httpx.LocalProtocolError):
+                    break # the request can't be sent as it is
+            else:
+                if response.status_code == 429:
+                    # the limiter holds every worker back until the retry time
+                    await self.limiter.rate_limited(self._retry_after(response, attempt))
+                    error = 'rate limited'
+                    continue
+                await self.limiter.release(ok=response.status_code == 200)
+                if response.status_code == 200:
+                    return response.json()
+                error = f'http {response.status_code} {response.text[:200]}'
+                if response.status_code < 500 and response.status_code != 408:
+                    break # the request itself is wrong, retrying won't help
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt))
+        self.failed_chunks += 1
+        print(f"batch transcription of {chunk_name} failed: {error}")
+        return None
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _retry_after(self, response: httpx.Response, attempt):
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return self._backoff(attempt)
+
+    # utterances of one chunk response moved to recording time. without utterances (older api versions)
+    # each channel transcript is one utterance spanning its words.
+    @staticmethod
+    def _utterances(response, offset):
+        results = response.get('results', {})
+        utterances = results.get('utterances')
+        if utterances is None:
+            utterances = []
+            for channel_index, channel in enumerate(results.get('channels', [])):
+                alternative = channel['alternatives'][0]
+                if alternative.get('words'):
+                    utterances.append({
+                        'start': alternative['words'][0]['start'],
+                        'end': alternative['words'][-1]['end'],
+                        'channel': channel_index,
+                        'transcript': alternative['transcript'],
+                    })
+        found = []
+        for utterance in utterances:
+            text = utterance['transcript'].replace('\n', ' ').strip()
+            if not text:
+                continue
+            channel = utterance.get('channel', 0)
+            speaker = SPEAKERS[channel] if channel < len(SPEAKERS) else f'channel {channel}'
+            found.append((offset + utterance['start'], offset + utterance['end'], speaker, text))
+        return found
+
+# saves utterances as a session file, with the speaker prefixes and separators of the live transcript
+def save_transcript(path, utterances, start_time):
+    store = TranscriptStore(path)
+    last_speaker = None
+    for start, end, speaker, text in utterances:
+        if last_speaker is None:
+            text = f'{speaker}: {text}'
+        elif speaker != last_speaker:
+            text = f'\n{speaker}: {text}'
+        else:
+            text = ' ' + text
+        store.append(text, speaker, start_time + start)
+        last_speaker = speaker
+    store.close()
+
+async def run(args):
+    recordings = []
+    for path in args.recordings:
+        try:
+            recordings.append(Recording(path, args.channels))
+        except (OSError, ValueError, EOFError, wave.Error) as e:
+            print(f"skipping {path}: {e}")
+    if not recordings:
+        return
+    transcriber = BatchTranscriber.from_env(model=args.model, language=args.language, workers=args.workers)
+    if args.api_url:
+        transcriber.url = args.api_url.rstrip('/') + '/v1/listen'
+    audio_seconds = sum(recording.duration for recording in recordings)
+    start = time.perf_counter()
+    results = await transcriber.transcribe(recordings, args.chunk_seconds)
+    elapsed = time.perf_counter() - start
+    print(f"{len(recordings)} recordings, {audio_seconds:.0f}s of audio in {elapsed:.1f}s ({audio_seconds / max(elapsed, 1e-9):.0f}x real time), "
+          f"{transcriber.retries} retries, {transcriber.limiter.rate_limited_count} rate limited, {transcriber.failed_chunks} chunks failed")
+    for recording, utterances in zip(recordings, results):
+        if not utterances:
+            print(f"{recording.path}: nothing transcribed")
+            continue
+        start_time = args.start_time if args.start_time is not None else os.path.getmtime(recording.path) - recording.duration
+        name = os.path.splitext(os.path.basename(recording.path))[0]
+        path = os.path.join(args.out_dir, time.strftime(f'batch-{name}-%Y%m%d-%H%M%S.jsonl'))
+        save_transcript(path, utterances, start_time)
+        print(f"{recording.path}: {len(utterances)} utterances saved to {path}")
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='transcribe recordings with the Deepgram prerecorded api')
+    parser.add_argument('recordings', nargs='+', help='.lin16 (raw 16kHz int16) or .wav files')
+    parser.add_argument('--channels', type=int, default=2, help='interleaved channels of the .lin16 files')
+    parser.add_argument('--language', default='en-US')
+    parser.add_argument('--model', default='nova-2')
+    parser.add_argument('--workers', type=int, default=4, help='most requests in flight')
+    parser.add_argument('--chunk-seconds', type=float, default=60)
+    parser.add_argument('--api-url', help='defaults to DEEPGRAM_API_URL or the Deepgram api')
+    parser.add_argument('--start-time', type=float, help='unix time of the recording start')
+    parser.add_argument('--out-dir', default=os.getenv('TRANSCRIPTS_DIR', 'transcripts'))
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import asyncio
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+
+HEADER_BYTES = 64
+# 64 stereo chunks of the mixer (about 16s of audio), a multiple of the frame size so samples are never split
+DEFAULT_CAPACITY = 64 * 1024 * 4 * 2
+
+# single producer / single consumer byte ring in shared memory.
+# the header holds the total bytes written, the total bytes read and the bytes dropped because the ring was full,
+# each position is only written by one side. the creator owns the block and unlinks it on close.
+class SharedRing:
+    def __init__(self, capacity=DEFAULT_CAPACITY, name=None):
+        self.capacity = capacity
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_BYTES + capacity)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.header = np.ndarray((3,), dtype=np.int64, buffer=self.shm.buf[:24]) # written, read, dropped
+        self.data = self.shm.buf[HEADER_BYTES:HEADER_BYTES + capacity]
+        if self.owner:
+            self.header[:] = 0
+
+    # producer side. copies data in, or drops it all when there is no room (the consumer is stalled).
+    def write(self, data):
+        written, read = int(self.header[0]), int(self.header[1])
+        size = len(data)
+        if size > self.capacity - (written - read):
+            self.header[2] += size
+            return False
+        start = written % self.capacity
+        first = min(size, self.capacity - start)
+        self.data[start:start + first] = data[:first]
+        if first < size:
+            self.data[:size - first] = data[first:]
+        # publish after the data is in place
+        self.header[0] = written + size
+        return True
+
+    # consumer side. returns views of the unread bytes (two when they wrap around), valid until commit
+    def read(self):
+        written, read = int(self.header[0]), int(self.header[1])
+        size = written - read
+        if size == 0:
+            return []
+        start = read % self.capacity
+        first = min(size, self.capacity - start)
+        views = [self.data[start:start + first]]
+        if first < size:
+            views.append(self.data[:size - first])
+        return views
+
+    # marks size bytes as read, freeing them for the producer
+    def commit(self, size):
+        self.header[1] += size
+
+    def pending(self):
+        return int(self.header[0] - self.header[1])
+
+    def dropped(self):
+        return int(self.header[2])
+
+    def close(self):
+        # views must be released before the block can be closed
+        self.data.release()
+        del self.header
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+# capture process entry point: opens the audio streams, resamples and mixes them like the in-process pipeline
+# and writes the mixed frames into the ring until stop_event is set
+def _capture_main(ring_name, capacity, device_ids, device_input_rates, mixer_mode, output_file, stop_event, status_conn):
+    import pyaudiowpatch as pyaudio
+    from live_transcriber import AudioMixer, AudioStream
+    from echo_suppression import EchoSuppressor
+    ring = SharedRing(capacity, ring_name)
+    p = pyaudio.PyAudio()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    audio_streams = []
+    try:
+        audio_mixer = AudioMixer(device_ids, mixer_mode, ring.write, echo_suppressor=EchoSuppressor.from_env())
+        if output_file:
+            audio_mixer.save_mixed_data_to_file(output_file)
+        for device_id, device_input_rate in zip(device_ids, device_input_rates):
+            audio_streams.append(AudioStream(p, device_id, audio_mixer.audio_handler, loop, device_input_rate))
+        status_conn.send(('started', os.getpid()))
+        loop.run_until_complete(loop.run_in_executor(None, stop_event.wait))
+    except Exception as e:
+        print(f"capture process exception {e}")
+        status_conn.send(('error', str(e)))
+    finally:
+        for audio_stream in audio_streams:
+            audio_stream.stop()
+        # let the consumer tasks see their cancellation
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+        p.terminate()
+        ring.close()
+
+# runs audio capture, resampling and mixing in a separate process so they don't share the GIL with Tk,
+# the tokenizer and the asyncio loop. the mixed frames are read from the shared ring on the asyncio loop
+# and passed to audio_callback as memoryviews, which are only valid during the call (copy to keep them).
+class CaptureProcess:
+    def __init__(self, device_ids: list, device_input_rates: list, mixer_mode: int, audio_callback, output_file=None, capacity=DEFAULT_CAPACITY, poll_interval=0.02, start_timeout=10):
+        self.device_ids = list(device_ids)
+        self.device_input_rates = list(device_input_rates)
+        self.mixer_mode = mixer_mode
+        self.audio_callback = audio_callback
+        self.output_file = output_file
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.start_timeout = start_timeout
+        self.ring = None
+        self.process = None
+        self.stop_event = None
+        self.reader_task = None
+
+    # starts the process and waits until its streams are open, returns False if they could not be opened
+    async def start(self):
+        context = multiprocessing.get_context('spawn')
+        self.ring = SharedRing(self.capacity)
+        status_conn, child_conn = context.Pipe(duplex=False)
+        self.stop_event = context.Event()
+        self.process = context.Process(
+            target=_capture_main,
+            args=(self.ring.name, self.capacity, self.device_ids, self.device_input_rates, self.mixer_mode, self.output_file, self.stop_event, child_conn),
+            daemon=True)
+        self.process.start()
+        child_conn.close()
+        loop = asyncio.get_running_loop()
+        try:
+            ready = await loop.run_in_executor(None, status_conn.poll, self.start_timeout)
+            status = status_conn.recv() if ready else ('error', 'capture process did not start in time')
+        except EOFError:
+            status = ('error', 'capture process exited')
+        finally:
+            status_conn.close()
+        if status[0] != 'started':
+            print(f"capture process start failed: {status[1]}")
+            await self.stop()
+            return False
+        print(f"capture process {status[1]} started")
+        self.reader_task = loop.create_task(self._read_ring())
+        return True
+
+    async def _read_ring(self):
+        while True:
+            views = self.ring.read()
+            size = 0
+            for view in views:
+                try:
+                    self.audio_callback(view)
+                except Exception as e:
+                    print(f"capture ring callback exception {e}")
+                size += len(view)
+                view.release()
+            if size:
+                self.ring.commit(size)
+            await asyncio.sleep(self.poll_interval)
+
+    # waits for the process to exit in an executor, a slow child must not block the asyncio loop
+    async def stop(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.process is not None:
+            process = self.process
+            self.process = None
+            self.stop_event.set()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, process.join, 2)
+            if process.is_alive():
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+        if self.ring is not None:
+            print(f"capture ring dropped {self.ring.dropped()} bytes")
+            self.ring.close()
+            self.ring = None
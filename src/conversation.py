@@ -0,0 +1,131 @@
+import os
+
+TRANSCRIPTION_TAG = '[INPUT_TRANSCRIPTION]'
+
+# multi-turn history for asking the same prompt again and again over a growing transcript.
+# the prompt text before [INPUT_TRANSCRIPTION] is the system message. the first ask sends the transcript so far and
+# the rest of the prompt, each later ask only the transcript said since the previous ask and the rest of the prompt,
+# with the previous answer kept in between as an assistant message.
+# the chat api is stateless so each request still carries the whole history, but the history only grows at the end:
+# the provider can reuse its cached prefix and only the new messages have to be processed.
+# once the history would go past max_tokens it is compacted, the conversation starts over from the last
+# tail_tokens of the transcript.
+# the [DOC:name] passages are chosen for the transcript when the conversation starts and kept until it starts over
+# (another prompt, a cleared log or a compaction), changing them on every ask would change the prefix of every request.
+class Conversation:
+    def __init__(self, count_tokens, max_tokens=6000, tail_tokens=1500):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.tail_tokens = tail_tokens
+        # totals since the app started, against filling the whole transcript in a single prompt each time
+        self.asks = 0
+        self.new_tokens = 0
+        self.input_tokens = 0
+        self.single_prompt_tokens = 0
+        self.reset()
+
+    @classmethod
+    def from_env(cls, count_tokens):
+        return cls(count_tokens, int(os.getenv('CONVERSATION_MAX_TOKENS', '6000')), int(os.getenv('CONVERSATION_TAIL_TOKENS', '1500')))
+
+    # drops the history, the next ask starts a new conversation
+    def reset(self):
+        self.base_prompt = None
+        self.head = '' # system message, with the reference passages chosen at the start
+        self.tail = '' # repeated at the end of every ask
+        self.tail_tokens_count = 0
+        self.transcript_tokens = 0 # estimated tokens of the whole transcript, for the single prompt comparison
+        self.uses_transcript = True
+        self.messages = [] # (message, tokens)
+        self.sent = '' # transcript covered by the history
+        self.pending = None # AnswerRequest of the last ask, its answer is added on the next ask
+
+    def tokens(self):
+        return sum(tokens for _, tokens in self.messages)
+
+    def _append(self, role, content):
+        self.messages.append(({"role": role, "content": content}, self.count_tokens(content)))
+
+    # an interrupted answer (abandoned for a newer ask) is left out, a truncated assistant turn would stay in every
+    # later request
+    def _record_answer(self):
+        if self.pending is not None and self.pending.finished is not None and self.pending.answer:
+            self._append('assistant', ''.join(self.pending.answer))
+        self.pending = None
+
+    def _start(self, base_prompt, transcription, fill_docs):
+        self.reset()
+        self.base_prompt = base_prompt
+        filled = fill_docs(base_prompt, transcription) if fill_docs is not None else base_prompt
+        head, tag, tail = filled.partition(TRANSCRIPTION_TAG)
+        # without the tag the prompt doesn't use the transcript, every ask is the whole prompt
+        self.head, self.tail = (head.rstrip(), tail) if tag else ('', head)
+        self.uses_transcript = bool(tag)
+        self.tail_tokens_count = self.count_tokens(self.tail)
+        if self.head:
+            self._append('system', self.head)
+
+    # last tail_tokens of the transcript, cut at a line when there is one
+    def _transcript_tail(self, transcription):
+        if self.count_tokens(transcription) <= self.tail_tokens:
+            return transcription
+        text = transcription[-self.tail_tokens * 4:]
+        while len(text) > 1 and self.count_tokens(text) > self.tail_tokens:
+            text = text[len(text) // 8:]
+        line = text.find('\n')
+        return text[line:] if 0 <= line < len(text) // 2 else text
+
+    # messages for a new ask and their token count.
+    # fill_docs(prompt, transcription) fills the [DOC:name] placeholders when the conversation starts, compaction
+    # starts over so it fills them again for the latest turns.
+    def ask(self, base_prompt, transcription, fill_docs=None):
+        self._record_answer()
+        transcription = transcription.rstrip()
+        fresh = False # nothing the provider has seen before
+        if base_prompt != self.base_prompt or not transcription.startswith(self.sent):
+            # another prompt, or the log was cleared or edited
+            if self.base_prompt is not None:
+                print('conversation restarted')
+            self._start(base_prompt, transcription, fill_docs)
+            fresh = True
+        first = not any(message['role'] == 'user' for message, _ in self.messages)
+        if not self.uses_transcript:
+            content = self.tail
+        elif first:
+            content = transcription + self.tail
+        else:
+            delta = transcription[len(self.sent):]
+            content = f"(transcription continued){delta}{self.tail}" if delta.strip() else f"(no new transcription){self.tail}"
+        content_tokens = self.count_tokens(content)
+        # the transcript is only counted once, then grows by the counted deltas
+        if not self.uses_transcript:
+            transcript_tokens = 0
+        elif first:
+            transcript_tokens = content_tokens - self.tail_tokens_count
+        else:
+            transcript_tokens = self.transcript_tokens + (self.count_tokens(delta) if delta.strip() else 0)
+        if self.tokens() + content_tokens > self.max_tokens:
+            before = self.tokens() + content_tokens
+            self._start(base_prompt, transcription, fill_docs)
+            fresh = True
+            if self.uses_transcript:
+                content = f"(earlier conversation left out){self._transcript_tail(transcription)}{self.tail}"
+            print(f'conversation compacted from {before} to {self.tokens() + self.count_tokens(content)} tokens')
+        history = self.tokens()
+        self._append('user', content)
+        self.sent = transcription
+        self.transcript_tokens = transcript_tokens
+
+        input_tokens = history + self.messages[-1][1]
+        new_tokens = input_tokens if fresh else self.messages[-1][1]
+        # estimated from the counts above, counting the whole transcript again on every ask would block the loop
+        head_tokens = self.messages[0][1] if self.head else 0
+        single_prompt_tokens = head_tokens + transcript_tokens + self.tail_tokens_count
+        self.asks += 1
+        self.new_tokens += new_tokens
+        self.input_tokens += input_tokens
+        self.single_prompt_tokens += single_prompt_tokens
+        print(f'conversation ask {self.asks}: {new_tokens} new tokens, {input_tokens} input tokens with the history, '
+              f'{single_prompt_tokens} as a single prompt (totals {self.new_tokens} new / {self.input_tokens} input / '
+              f'{self.single_prompt_tokens} single prompt)')
+        return [message for message, _ in self.messages], input_tokens
@@ -0,0 +1,99 @@
+import os
+import time
+from collections import deque
+import numpy as np
+from trigger_engine import normalize
+
+# ECHO_SUPPRESSION=0 turns off both the audio and the transcript stages, the transcript stage is only on with
+# TRANSCRIPT_DEDUP=1
+def echo_suppression_enabled():
+    return os.getenv('ECHO_SUPPRESSION', '1') != '0'
+
+# removes the system audio (channel 1) picked up by the mic (channel 0) when speakers are used.
+# for each mixer chunk the delay and gain of the system audio inside the mic are estimated by
+# cross-correlation (fft, over every delay up to max_delay), the aligned system audio is subtracted,
+# and when what is left is small the mic is gated since nobody is talking locally.
+class EchoSuppressor:
+    def __init__(self, rate=16000, max_delay=0.3, min_correlation=0.3, min_level=100, gate_ratio=0.3, gate_gain=0.1):
+        self.max_delay = int(max_delay * rate)
+        self.min_correlation = min_correlation # below this the mic is not echoing the system audio
+        self.min_level = min_level # rms under which the system channel is treated as silent
+        self.gate_ratio = gate_ratio # residual / mic energy under which only echo is left
+        self.gate_gain = gate_gain
+        self.history = np.zeros(self.max_delay, dtype=np.float64) # system audio preceding the current chunk
+        self.delay = None # last estimated delay in samples
+        self.chunks = 0
+        self.suppressed = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls() if echo_suppression_enabled() else None
+
+    # mic and system are int16 arrays of the same length, returns the mic without the echo
+    def process(self, mic: np.ndarray, system: np.ndarray):
+        size = len(mic)
+        mic_f = mic.astype(np.float64)
+        # the echo of window[j] shows up in the mic max_delay - k samples later, for the lag k that matches
+        window = np.concatenate([self.history, system.astype(np.float64)])
+        self.history = window[-self.max_delay:]
+        self.chunks += 1
+        if np.sqrt(np.mean(window[-size:] ** 2)) < self.min_level:
+            return mic
+        mic_energy = np.dot(mic_f, mic_f)
+        if mic_energy == 0:
+            return mic
+        # corr[k] = sum_i window[k + i] * mic[i], for every lag at once
+        fft_size = 1 << int(np.ceil(np.log2(len(window) + size)))
+        corr = np.fft.irfft(np.fft.rfft(window, fft_size) * np.conj(np.fft.rfft(mic_f, fft_size)), fft_size)[:self.max_delay + 1]
+        squares = np.concatenate([[0.0], np.cumsum(window ** 2)])
+        window_energy = squares[size:size + self.max_delay + 1] - squares[:self.max_delay + 1]
+        normalized = corr / np.sqrt(window_energy * mic_energy + 1e-9)
+        lag = int(np.argmax(normalized))
+        if normalized[lag] < self.min_correlation:
+            # local speech hides the echo (double talk), keep cancelling at the delay found before when it still matches
+            if self.delay is None or normalized[self.max_delay - self.delay] < self.min_correlation / 3:
+                return mic
+            lag = self.max_delay - self.delay
+        aligned = window[lag:lag + size]
+        gain = corr[lag] / window_energy[lag]
+        residual = mic_f - gain * aligned
+        if np.dot(residual, residual) < self.gate_ratio * mic_energy:
+            residual *= self.gate_gain
+        self.delay = self.max_delay - lag
+        self.suppressed += 1
+        return np.clip(residual, -32768, 32767).astype(np.int16)
+
+# drops user (mic) segments that repeat what the system speaker just said, for echo the audio stage missed.
+# a segment is an echo when most of its word pairs were in the system segments of the last window seconds.
+# segments under min_words words are always kept, a short "yes" is too common to tell.
+# off unless TRANSCRIPT_DEDUP=1: it also drops user segments that quote or paraphrase the other party, and misses
+# echoes transcribed before the system segment they repeat.
+class TranscriptDedup:
+    def __init__(self, window=6.0, threshold=0.6, min_words=3):
+        self.window = window
+        self.threshold = threshold
+        self.min_words = min_words
+        self.system_segments = deque() # (time, word pairs)
+
+    @classmethod
+    def from_env(cls):
+        return cls() if echo_suppression_enabled() and os.getenv('TRANSCRIPT_DEDUP', '0') == '1' else None
+
+    @staticmethod
+    def _pairs(words):
+        return set(zip(words, words[1:]))
+
+    # remembers system segments, returns True for user segments that are echoes of them
+    def is_echo(self, is_user, text):
+        now = time.monotonic()
+        while self.system_segments and now - self.system_segments[0][0] > self.window:
+            self.system_segments.popleft()
+        words = normalize(text).split()
+        if not is_user:
+            self.system_segments.append((now, self._pairs(words)))
+            return False
+        if len(words) < self.min_words or not self.system_segments:
+            return False
+        pairs = self._pairs(words)
+        recent = set().union(*(segment for _, segment in self.system_segments))
+        return len(pairs & recent) / len(pairs) >= self.threshold
@@ -1,8 +1,14 @@
-import queue
-from openai import AsyncOpenAI
+import itertools
+import time
+from openai import AsyncOpenAI, APIStatusError
 import os
 from dotenv import load_dotenv
 import asyncio
+from stream_buffer import StreamBuffer
+from http_pool import ConnectionTrace, create_http_client, current_trace, pool_config_from_env
+from model_router import Backend, ModelRouter
+from conversation import Conversation
+from tracing import Trace
 
 # avoid ProactorEventLoop issues on windows
 if os.name == 'nt':
@@ -10,20 +16,350 @@ if os.name == 'nt':
 
 load_dotenv()
 
+# rough token count when the caller didn't count them with tiktoken
+def estimate_tokens(text):
+    return len(text) // 4
+
+# single streamed answer. chunks are tagged with the request id when put in the output buffer.
+# speculative answers have no output yet, their chunks are kept until adopted.
+# messages replaces the single user message with the prompt (conversation mode).
+class AnswerRequest:
+    def __init__(self, request_id, prompt, output: StreamBuffer = None, latency_class='standard', prompt_tokens=None, messages=None):
+        self.request_id = request_id
+        self.prompt = prompt
+        self.messages = messages if messages is not None else [{"role": "user", "content": prompt}]
+        self.latency_class = latency_class
+        self.prompt_tokens = prompt_tokens if prompt_tokens is not None else estimate_tokens(prompt)
+        self.backend = None # name of the backend that answered
+        self.output = output
+        self.chunks = []
+        self.answer = [] # every chunk, kept for the conversation history
+        self.tokens = 0 # each streamed delta is roughly one token
+        self.task = None
+        self.started = None
+        self.first_chunk = None
+        self.finished = None
+        self.stall_time = 0.0 # time spent waiting for the consumer
+        self.connection = None # ConnectionTrace of the http request
+        self.trace = None # Trace of the ask, when tracing
+
+    @property
+    def speculative(self):
+        return self.output is None
+
+    async def emit(self, chunk):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
+        self.tokens += 1
+        self.answer.append(chunk)
+        if self.output is None:
+            self.chunks.append(chunk)
+        else:
+            self.stall_time += await self.output.put(self.request_id, chunk)
+
+    async def adopt(self, request_id, output: StreamBuffer):
+        self.request_id = request_id
+        self.output = output
+        chunks = self.chunks
+        self.chunks = []
+        if chunks:
+            self.stall_time += await output.put(request_id, ''.join(chunks))
+
+    # time to first token, tokens/sec after the first token and consumer stall time
+    def stats(self):
+        if self.first_chunk is None or self.finished is None:
+            return 'no answer'
+        ttft = self.first_chunk - self.started
+        duration = self.finished - self.first_chunk
+        rate = (self.tokens - 1) / duration if duration > 0 else 0
+        stats = f'{self.backend}, ttft {ttft * 1000:.0f}ms, {self.tokens} tokens at {rate:.1f} tokens/s, stalled {self.stall_time * 1000:.0f}ms'
+        if self.connection is not None:
+            stats += f', {self.connection.report()}'
+        return stats
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
 class GPTController:
-    def __init__(self, api_key):
-        self.client = AsyncOpenAI(api_key=api_key)
-        self.queue = queue.Queue(maxsize=50)
-    
-    async def send_prompt(self, prompt):
+    # base_url defaults to OPENAI_BASE_URL or the OpenAI api, set it to use a local compatible server.
+    # http_client and router can be taken from another controller so several sessions share one pool and its routing stats.
+    def __init__(self, api_key, base_url=None, http_client=None, router: ModelRouter = None):
+        # one pooled http client shared by every request, kept warm while capturing
+        self.pool_config = pool_config_from_env()
+        self.http_client = http_client if http_client is not None else create_http_client(self.pool_config)
+        self.router = router if router is not None else ModelRouter.from_env(api_key, base_url)
+        self.clients = {} # (base_url, api_key) -> AsyncOpenAI, all on the shared http client
+        self.keepalive_task = None
+        self.answer_buffer = StreamBuffer()
+        self.request_ids = itertools.count(1)
+        self.active_request_id = 0 # chunks from other requests are stale
+        self.active_request = None # only touched from the asyncio loop
+        self.speculation = None # only touched from the asyncio loop
+        self.abandoned_tokens = 0
+        self.conversation = Conversation.from_env(estimate_tokens) # only touched from the asyncio loop
+        # panel: several prompts answered concurrently, each into its own buffer
+        # every selected prompt streams at once by default, so the panel takes as long as its slowest answer.
+        # PANEL_MAX_STREAMS caps it (e.g. for rate limited endpoints), the prompts over the cap wait for a slot.
+        self.max_panel_streams = int(os.getenv('PANEL_MAX_STREAMS', '0')) or None
+        self.panel_buffers = {} # prompt name -> StreamBuffer
+        self.active_panel_request_id = 0
+        self.panel_requests = []
+
+    # output buffer for a panel prompt, created on first use
+    def panel_buffer(self, name):
+        if name not in self.panel_buffers:
+            self.panel_buffers[name] = StreamBuffer()
+        return self.panel_buffers[name]
+
+    def new_panel_request_id(self):
+        self.active_panel_request_id = next(self.request_ids)
+        return self.active_panel_request_id
+
+    # called from the GUI thread before scheduling send_prompt, so stale chunks can be dropped right away
+    def new_request_id(self):
+        self.active_request_id = next(self.request_ids)
+        return self.active_request_id
+
+    def _client_for(self, backend: Backend):
+        key = (backend.base_url, backend.api_key)
+        if key not in self.clients:
+            self.clients[key] = AsyncOpenAI(api_key=backend.api_key, base_url=backend.base_url, http_client=self.http_client)
+        return self.clients[key]
+
+    # starts streaming an answer, aborting the previous one.
+    # latency_class and prompt_tokens are used to pick the backend. trace gets the answer spans.
+    async def send_prompt(self, prompt, request_id=None, latency_class='standard', prompt_tokens=None, trace: Trace = None):
+        if request_id is None:
+            request_id = self.new_request_id()
+        if trace is not None:
+            trace.span_from('scheduled', 'dispatch')
+        self._abandon(self.active_request)
+        self.active_request = None
+
+        # reuse the speculative answer if it was started with the exact same prompt, while it is still streaming or
+        # once it finished with an answer. one that failed (no backend answered, broken stream) is asked again.
+        speculation = self.speculation
+        self.speculation = None
+        usable = speculation is not None and (not speculation.task.done() or speculation.finished is not None)
+        if usable and speculation.prompt == prompt:
+            print(f'request {request_id}: using speculative answer')
+            self.active_request = speculation
+            speculation.trace = trace
+            await speculation.adopt(request_id, self.answer_buffer)
+            if trace is not None and speculation.finished is not None:
+                trace.span('speculative answer', speculation.started, speculation.finished)
+            return
+        self._abandon(speculation)
+
+        request = AnswerRequest(request_id, prompt, self.answer_buffer, latency_class, prompt_tokens)
+        request.trace = trace
+        request.task = asyncio.create_task(self._stream_answer(request))
+        self.active_request = request
+
+    # conversation mode: asks base_prompt over the transcription as the next turn of a multi-turn conversation,
+    # sending only the transcript since the last ask with the history, see Conversation.
+    # fill_docs(prompt, transcription) fills the reference document placeholders.
+    async def send_conversation_prompt(self, base_prompt, transcription, request_id=None, latency_class='standard', fill_docs=None, trace: Trace = None):
+        if request_id is None:
+            request_id = self.new_request_id()
+        if trace is not None:
+            trace.span_from('scheduled', 'dispatch')
+        self._abandon(self.active_request)
+        self.active_request = None
+        await self.cancel_speculation()
+        messages, prompt_tokens = self.conversation.ask(base_prompt, transcription, fill_docs)
+        request = AnswerRequest(request_id, messages[-1]['content'], self.answer_buffer, latency_class, prompt_tokens, messages)
+        request.trace = trace
+        request.task = asyncio.create_task(self._stream_answer(request))
+        self.active_request = request
+        self.conversation.pending = request
+
+    async def reset_conversation(self):
+        self.conversation.reset()
+
+    # streams every prompt concurrently (capped by max_panel_streams when set) over the client's shared connection pool.
+    # prompts is a dict of prompt name -> final prompt, all built from the same transcript snapshot.
+    # latency_classes optionally maps prompt names to their latency class.
+    async def send_panel_prompts(self, prompts: dict, request_id, latency_classes=None):
+        latency_classes = latency_classes or {}
+        for request in self.panel_requests:
+            self._abandon(request)
+        # semaphore is created here so it binds to the running loop
+        slots = asyncio.Semaphore(self.max_panel_streams) if self.max_panel_streams else None
+        requests = []
+        start = time.perf_counter()
+        for name, prompt in prompts.items():
+            request = AnswerRequest(request_id, prompt, self.panel_buffer(name), latency_classes.get(name, 'standard'))
+            request.task = asyncio.create_task(self._stream_answer(request, slots))
+            requests.append(request)
+        self.panel_requests = requests
+
+        await asyncio.gather(*[request.task for request in requests], return_exceptions=True)
+        if request_id != self.active_panel_request_id:
+            return
+        total = time.perf_counter() - start
+        slowest = max((request.finished - request.started for request in requests if request.finished), default=0)
+        print(f'panel {request_id}: {len(requests)} answers in {total:.2f}s (slowest single answer {slowest:.2f}s)')
+
+    # starts streaming an answer in the background, replacing any previous speculation
+    async def speculate(self, prompt, latency_class='standard', prompt_tokens=None):
+        await self.cancel_speculation()
+        speculation = AnswerRequest(None, prompt, None, latency_class, prompt_tokens)
+        speculation.task = asyncio.create_task(self._stream_answer(speculation))
+        self.speculation = speculation
+
+    async def cancel_speculation(self):
+        self._abandon(self.speculation)
+        self.speculation = None
+
+    # stops every answer still streaming, when the session using this controller ends
+    async def cancel_answers(self):
+        self._abandon(self.active_request)
+        self.active_request = None
+        await self.cancel_speculation()
+        for request in self.panel_requests:
+            self._abandon(request)
+
+    # opens a pooled connection ahead of the first ask and keeps it alive while the session is active
+    async def start_session(self):
+        if self.keepalive_task is None or self.keepalive_task.done():
+            self.keepalive_task = asyncio.create_task(self._keep_connection_warm())
+
+    async def stop_session(self):
+        if self.keepalive_task is not None:
+            self.keepalive_task.cancel()
+            self.keepalive_task = None
+
+    async def _keep_connection_warm(self):
+        while True:
+            await self.warm_up()
+            await asyncio.sleep(self.pool_config['keepalive_interval'])
+
+    # warms every endpoint used by the router
+    async def warm_up(self):
+        endpoints = {}
+        for backend in self.router.backends.values():
+            endpoints.setdefault((backend.base_url, backend.api_key), backend)
+        await asyncio.gather(*[self._warm_up_endpoint(backend) for backend in endpoints.values()])
+
+    # cheap authenticated request to the api host so dns, tcp and tls are done outside the ask path
+    async def _warm_up_endpoint(self, backend: Backend):
+        trace = ConnectionTrace()
+        current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            await self._client_for(backend).models.retrieve(backend.model)
+        except APIStatusError:
+            # some local servers don't implement this route, the connection is warm anyway
+            pass
+        except Exception as e:
+            print(f'connection warm-up exception {e}')
+            return
+        if trace.new_connection:
+            print(f'connection warm-up {backend.base_url or "openai"} {(time.perf_counter() - start) * 1000:.0f}ms: {trace.report()}')
+
+    # cancels an unfinished request and accounts for the tokens it already consumed
+    def _abandon(self, request):
+        if request is None:
+            return
+        if not request.speculative and request.task.done():
+            return
+        request.cancel()
+        self.abandoned_tokens += request.tokens
+        name = 'speculative request' if request.speculative else f'request {request.request_id}'
+        print(f'{name} abandoned after {request.tokens} tokens ({self.abandoned_tokens} abandoned tokens total)')
+
+    async def _stream_answer(self, request: AnswerRequest, slots: asyncio.Semaphore = None):
+        if slots is None:
+            await self._stream(request)
+            return
+        async with slots:
+            await self._stream(request)
+
+    # tries the routed backends in order, falling back while no token has been emitted yet
+    async def _stream(self, request: AnswerRequest):
+        request.started = time.perf_counter()
+        request.connection = ConnectionTrace()
+        current_trace.set(request.connection)
+        candidates = self.router.route(request.prompt_tokens, request.latency_class)
+        decision = {
+            'time': time.time(),
+            'request_id': request.request_id,
+            'latency_class': request.latency_class,
+            'prompt_tokens': request.prompt_tokens,
+            'candidates': [[backend.name, round(backend.expected_ttft(request.prompt_tokens), 3)] for backend in candidates],
+            'attempts': [],
+        }
+        try:
+            for i, backend in enumerate(candidates):
+                attempt_start = time.perf_counter()
+                try:
+                    # only the last candidate uses the client's own retries. it also gets no ttft timeout: with nothing
+                    # to fall back to, a slow first token is better than no answer
+                    last = i == len(candidates) - 1
+                    timeout = None if last else self.router.ttft_timeout(request.latency_class)
+                    opened = await asyncio.wait_for(self._open_stream(backend, request.messages, last), timeout)
+                except asyncio.CancelledError:
+                    raise
+                except asyncio.TimeoutError:
+                    self.router.record_failure(backend, 'slow')
+                    decision['attempts'].append({'backend': backend.name, 'error': 'slow'})
+                    continue
+                except Exception as e:
+                    self.router.record_failure(backend, e)
+                    decision['attempts'].append({'backend': backend.name, 'error': str(e)})
+                    continue
+                ttft = time.perf_counter() - attempt_start
+                self.router.record_success(backend, ttft, request.prompt_tokens)
+                decision['attempts'].append({'backend': backend.name, 'ttft': round(ttft, 3)})
+                request.backend = backend.name
+                await self._read_stream(request, *opened)
+                return
+            print('exception send prompt: no backend answered')
+        finally:
+            self.router.record_decision(decision)
+
+    # opens the stream and waits for the first content chunk
+    async def _open_stream(self, backend: Backend, messages, retries=True):
+        client = self._client_for(backend)
+        if not retries:
+            client = client.with_options(max_retries=0)
+        stream = await client.chat.completions.create(
+            model=backend.model,
+            messages=messages,
+            stream=True,
+        )
+        chunks = stream.__aiter__()
+        try:
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    return stream, chunks, chunk.choices[0].delta.content
+        except BaseException:
+            await stream.response.aclose()
+            raise
+        return stream, chunks, None
+
+    async def _read_stream(self, request: AnswerRequest, stream, chunks, first_content):
         try:
-            stream = await self.client.chat.completions.create(
-                model="gpt-4-1106-preview",
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-            )
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    self.queue.put_nowait(chunk.choices[0].delta.content)
-        except:
-            print('exception send prompt')
+            if first_content:
+                await request.emit(first_content)
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    await request.emit(chunk.choices[0].delta.content)
+            request.finished = time.perf_counter()
+            if request.trace is not None:
+                request.trace.span('first token', request.started, request.first_chunk)
+                request.trace.span('stream', request.first_chunk, request.finished)
+            name = 'speculative request' if request.speculative else f'request {request.request_id}'
+            print(f'{name}: {request.stats()}')
+        except asyncio.CancelledError:
+            # abort the http stream so the server stops generating
+            await stream.response.aclose()
+            raise
+        except Exception as e:
+            print(f'exception send prompt {e}')
+            # failed after its first token, too late to fall back but the backend still cools down
+            backend = self.router.backends.get(request.backend)
+            if backend is not None:
+                self.router.record_failure(backend, e)
@@ -0,0 +1,66 @@
+import os
+import time
+import contextvars
+import httpx
+
+# connection trace of the request running in the current task.
+# tasks get a copy of the context, so each request sets its own trace.
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+# collects httpcore trace events for one request, telling if a pooled connection was reused
+# and how long the tcp connect and tls handshake took otherwise.
+class ConnectionTrace:
+    def __init__(self):
+        self.new_connection = False
+        self.connect_time = 0.0
+        self.tls_time = 0.0
+        self.started = {}
+
+    # httpcore calls this with events like 'connection.connect_tcp.started' / '.complete'
+    async def __call__(self, event_name, info):
+        name, _, stage = event_name.rpartition('.')
+        if stage == 'started':
+            self.started[name] = time.perf_counter()
+        elif stage in ('complete', 'failed') and name in self.started:
+            elapsed = time.perf_counter() - self.started.pop(name)
+            if name == 'connection.connect_tcp':
+                self.new_connection = True
+                self.connect_time += elapsed
+            elif name == 'connection.start_tls':
+                self.tls_time += elapsed
+
+    def report(self):
+        if not self.new_connection:
+            return 'reused connection'
+        return f'new connection (connect {self.connect_time * 1000:.0f}ms, tls {self.tls_time * 1000:.0f}ms)'
+
+async def _attach_trace(request: httpx.Request):
+    trace = current_trace.get()
+    if trace is not None:
+        request.extensions['trace'] = trace
+
+# pool settings, overridable from the .env file
+def pool_config_from_env():
+    return {
+        'http2': os.getenv('OPENAI_HTTP2', '0') == '1',
+        'max_connections': int(os.getenv('OPENAI_MAX_CONNECTIONS', '10')),
+        'max_keepalive_connections': int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '10')),
+        'keepalive_expiry': float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '120')),
+        'keepalive_interval': float(os.getenv('OPENAI_KEEPALIVE_INTERVAL', '60')),
+    }
+
+# shared http client for all LLM requests
+def create_http_client(config: dict):
+    limits = httpx.Limits(
+        max_connections=config['max_connections'],
+        max_keepalive_connections=config['max_keepalive_connections'],
+        keepalive_expiry=config['keepalive_expiry'],
+    )
+    timeout = httpx.Timeout(600, connect=10)
+    event_hooks = {'request': [_attach_trace]}
+    if config['http2']:
+        try:
+            return httpx.AsyncClient(http2=True, limits=limits, timeout=timeout, event_hooks=event_hooks)
+        except ImportError:
+            print('http2 requires the h2 package (pip install httpx[http2]), using http/1.1')
+    return httpx.AsyncClient(limits=limits, timeout=timeout, event_hooks=event_hooks)
@@ -1,92 +1,249 @@
 import asyncio
+import os
+import time
 # import pyaudio
 import pyaudiowpatch as pyaudio
 from deepgram import Deepgram
 import numpy as np
 import queue
+from stream_buffer import SignalQueue
+from trigger_engine import TriggerEngine, TriggerRules
+from echo_suppression import EchoSuppressor, TranscriptDedup
+from audio_sender import AudioSender, live_buffered_bytes
+import tracing
 
-# controls audio_stream -> mixer -> transcription pipeline
+# controls audio_stream -> mixer -> transcription pipeline.
+# capture lifecycle is a state machine driven from the asyncio loop: idle -> starting -> running -> stopping -> idle.
+# state changes are reported through on_state_change (called from the asyncio loop).
 class TranscriptionController:
+    IDLE = 'idle'
+    STARTING = 'starting'
+    RUNNING = 'running'
+    STOPPING = 'stopping'
+
     def __init__(self, p: pyaudio.PyAudio, DEEPGRAM_API_KEY: str):
         self.p = p  # PyAudio object
-        self.deepgram_transcriber = DeepgramTranscriber(DEEPGRAM_API_KEY)
+        self.trigger_rules = TriggerRules.from_env() # automatic asks, None when not configured
+        self.deepgram_transcriber = DeepgramTranscriber(DEEPGRAM_API_KEY, self.trigger_rules)
         self.audio_stream_0 = None
         self.audio_stream_1 = None
-        self.transcriptions_queue = queue.Queue(10) # thread safe interface
+        self.transcriptions_queue = SignalQueue(10) # thread safe interface, listener wakes the GUI
+        self.state = self.IDLE
+        self.on_state_change = None
+        # audio streams must be opened from the main thread (see AudioStream), main_thread_call(fn)
+        # runs fn there and returns a concurrent.futures.Future. fn is run in place when not set.
+        self.main_thread_call = None
+        self.lifecycle_lock = None # created on the asyncio loop
+        self.device_ids = []
+        # AUDIO_CAPTURE_PROCESS=1 captures, resamples and mixes in a separate process (see capture_process)
+        self.capture_in_process = os.getenv('AUDIO_CAPTURE_PROCESS', '0') == '1'
+        self.capture_process = None
+
+    def _set_state(self, state):
+        self.state = state
+        print(f'capture {state}')
+        if self.on_state_change is not None:
+            self.on_state_change(state)
+
+    async def _on_main_thread(self, fn):
+        if self.main_thread_call is None:
+            return fn()
+        return await asyncio.wrap_future(self.main_thread_call(fn))
+
+    def _lock(self):
+        if self.lifecycle_lock is None:
+            self.lifecycle_lock = asyncio.Lock()
+        return self.lifecycle_lock
+
+    # opens the deepgram session and then the audio streams
+    async def request_start(self, device_ids: list, device_input_rates: list, language: str):
+        async with self._lock():
+            if self.state != self.IDLE:
+                return
+            self._set_state(self.STARTING)
+            started = await self.start_deepgram(device_ids, language)
+            if started:
+                started = await self._open_capture(device_ids, device_input_rates)
+            if not started:
+                await self.stop()
+                self._set_state(self.IDLE)
+                return
+            self._set_state(self.RUNNING)
+
+    async def request_stop(self):
+        async with self._lock():
+            if self.state != self.RUNNING:
+                return
+            self._set_state(self.STOPPING)
+            await self.stop()
+            self._set_state(self.IDLE)
+
+    # swaps the audio streams for new devices while running, keeping the deepgram session open.
+    # a different channel count needs a new deepgram session, so capture is restarted then.
+    async def request_switch_devices(self, device_ids: list, device_input_rates: list, language: str):
+        if len(device_ids) == 0:
+            await self.request_stop()
+            return
+        async with self._lock():
+            if self.state != self.RUNNING or device_ids == self.device_ids:
+                return
+            if len(device_ids) == len(self.device_ids):
+                self._set_state(self.STARTING)
+                await self._close_capture()
+                started = await self._open_capture(device_ids, device_input_rates)
+                if started:
+                    self._set_state(self.RUNNING)
+                    return
+                self._set_state(self.STOPPING)
+                await self.stop()
+                self._set_state(self.IDLE)
+                return
+        await self.request_stop()
+        await self.request_start(device_ids, device_input_rates, language)
+
+    # changes the transcription language while capturing, without stopping the audio (see DeepgramTranscriber.switch_language).
+    # not under the lifecycle lock, a stop while the new connection opens abandons the switch.
+    async def request_switch_language(self, language: str):
+        if self.state != self.RUNNING:
+            return
+        await self.deepgram_transcriber.switch_language(language)
 
+    # opens the audio capture in this process or in the capture process, returns False if it could not be opened
+    async def _open_capture(self, device_ids: list, device_input_rates: list):
+        if self.capture_in_process:
+            return await self.start_capture_process(device_ids, device_input_rates)
+        loop = asyncio.get_running_loop()
+        try:
+            return await self._on_main_thread(lambda: self.start(device_ids, device_input_rates, loop))
+        except Exception as e:
+            print(f"audio controller start exception {e}")
+            return False
+
+    async def start_capture_process(self, device_ids: list, device_input_rates: list):
+        from capture_process import CaptureProcess
+        print(f'starting capture process with device ids {device_ids}')
+        mixer_mode = 1 if len(device_ids) > 1 else 0
+        # ring views are only valid during the callback and the AudioSender queues frames until the socket takes them,
+        # so each frame is copied once out of the shared ring (the read itself doesn't copy)
+        self.capture_process = CaptureProcess(device_ids, device_input_rates, mixer_mode, lambda view: self.deepgram_transcriber.send_audio(bytes(view)), output_file='mixed_audio.lin16')
+        if not await self.capture_process.start():
+            self.capture_process = None
+            return False
+        self.device_ids = list(device_ids)
+        return True
+
+    # opens the audio streams, returns False if they could not be opened
     def start(self, device_ids: list, device_input_rates: list, loop: asyncio.AbstractEventLoop):
         print (f'starting transcription controller with device ids {device_ids}')
         channels = len(device_ids)
         multichannel = channels > 1
         try:
             mixer_mode = 1 if multichannel else 0
-            audio_mixer = AudioMixer(device_ids, mixer_mode, self.deepgram_transcriber.send_audio)
+            audio_mixer = AudioMixer(device_ids, mixer_mode, self.deepgram_transcriber.send_audio, echo_suppressor=EchoSuppressor.from_env())
             self.audio_stream_0 = AudioStream(self.p, device_ids[0], audio_mixer.audio_handler, loop, device_input_rates[0])
             if (channels == 2):
                 self.audio_stream_1 = AudioStream(self.p, device_ids[1], audio_mixer.audio_handler, loop, device_input_rates[1])
             audio_mixer.save_mixed_data_to_file('mixed_audio.lin16') # uncomment to save mixed audio to file
+            self.device_ids = list(device_ids)
+            return True
         except Exception as e:
             print(f"audio controller start exception {e}")
+            self._close_streams()
+            return False
     
     async def start_deepgram(self, device_ids: list, language: str):
         channels = len(device_ids)
         multichannel = channels > 1
-        await self.deepgram_transcriber.initialize(self.transcriptions_queue, language, channels, multichannel)
+        return await self.deepgram_transcriber.initialize(self.transcriptions_queue, language, channels, multichannel)
+
+    def _close_streams(self):
+        if self.audio_stream_0 is not None:
+            self.audio_stream_0.stop()
+            self.audio_stream_0 = None
+        if self.audio_stream_1 is not None:
+            self.audio_stream_1.stop()
+            self.audio_stream_1 = None
+        self.device_ids = []
+
+    # closes the streams in this process or the capture process
+    async def _close_capture(self):
+        self._close_streams()
+        if self.capture_process is not None:
+            capture_process = self.capture_process
+            self.capture_process = None
+            await capture_process.stop()
 
     async def stop(self):
         try:
-            if self.audio_stream_0 is not None:
-                self.audio_stream_0.stop()
-                self.audio_stream_0 = None
-            if self.audio_stream_1 is not None:
-                self.audio_stream_1.stop()
-                self.audio_stream_1 = None
+            await self._close_capture()
             await self.deepgram_transcriber.close()
         except Exception as e:
             print(f"audio controller stop exception {e}")
 
     async def terminate(self):
-        await self.stop()
+        await self.request_stop()
     
 # mixes audio streams into a single or multi-channel buffer
 class AudioMixer:
     # mode 0: mix all devices into a single channel
     # mode 1: mix each device into its own channel
     # device_ids are needed so we can know when all chunks are available for mixing
-    def __init__(self, device_ids: list, mode: int, mixed_callback, chunk_size=1024*4):
-        self.device_ids = device_ids
+    # echo_suppressor (mode 1) removes the system audio (second device) picked up by the mic (first device)
+    # a device max_buffered_chunks ahead of another means the other one stopped delivering (loopback devices
+    # are silent while nothing plays) or runs on a slower clock, the gap is filled with silence so the
+    # leading device isn't held back
+    def __init__(self, device_ids: list, mode: int, mixed_callback, chunk_size=1024*4, echo_suppressor: EchoSuppressor = None, max_buffered_chunks=8):
         self.mode = mode
         self.mixed_callback = mixed_callback
         self.chunk_size = chunk_size
+        self.echo_suppressor = echo_suppressor
+        self.max_buffered = chunk_size * max_buffered_chunks
         self.output_file = None
-        self.audio_buffers = {device_id: b'' for device_id in device_ids}
+        self.set_new_device_ids(device_ids)
 
     def set_new_device_ids(self, device_ids: list):
+        self.device_ids = device_ids
         self.audio_buffers = {device_id: b'' for device_id in device_ids}
+        self.received_bytes = {device_id: 0 for device_id in device_ids}
+        self.padded_bytes = {device_id: 0 for device_id in device_ids} # silence inserted for each device
 
     def audio_handler(self, device_id, audio_chunk):
         # append new chunk to the buffer
         self.audio_buffers[device_id] += audio_chunk
+        self.received_bytes[device_id] += len(audio_chunk)
 
-        # check if all data available
-        if not all(len(self.audio_buffers[device_id]) >= self.chunk_size for device_id in self.device_ids):
-            return
-        
-        # mix data
-        mixed_data = self._mix_audio()
+        while True:
+            # check if all data available
+            if not all(len(self.audio_buffers[device_id]) >= self.chunk_size for device_id in self.device_ids):
+                longest = max(len(buffer) for buffer in self.audio_buffers.values())
+                if longest < self.max_buffered:
+                    return
+                # catch up with the whole chunks of the leading device
+                target = longest - longest % self.chunk_size
+                for other_id in self.device_ids:
+                    missing = target - len(self.audio_buffers[other_id])
+                    if missing > 0:
+                        self.audio_buffers[other_id] += bytes(missing)
+                        self.padded_bytes[other_id] += missing
 
-        # sends mixed data
-        if self.mixed_callback:
-            self.mixed_callback(mixed_data)
+            # mix data
+            mixed_data = self._mix_audio()
 
-        # save mixed data to file if specified
-        if self.output_file:
-            with open(self.output_file, 'ab') as file:
-                file.write(mixed_data)
-        
-        # clear used data from buffers
-        for device_id in self.device_ids:
-            self.audio_buffers[device_id] = self.audio_buffers[device_id][self.chunk_size:]
+            # sends mixed data
+            if self.mixed_callback:
+                self.mixed_callback(mixed_data)
+
+            # save mixed data to file if specified
+            if self.output_file:
+                with open(self.output_file, 'ab') as file:
+                    file.write(mixed_data)
+
+            # clear used data from buffers
+            for device_id in self.device_ids:
+                self.audio_buffers[device_id] = self.audio_buffers[device_id][self.chunk_size:]
+
+    def buffered_bytes(self):
+        return {device_id: len(buffer) for device_id, buffer in self.audio_buffers.items()}
 
     def _mix_audio(self):
         audio_arrays = []
@@ -102,6 +259,8 @@ class AudioMixer:
             mixed_array = np.mean(audio_arrays, axis=0).astype(np.int16)
             return mixed_array.tobytes()
         elif self.mode == 1: # multi channel
+            if self.echo_suppressor is not None and len(audio_arrays) == 2:
+                audio_arrays[0] = self.echo_suppressor.process(audio_arrays[0], audio_arrays[1])
             mixed_array = np.stack(audio_arrays, axis=-1).astype(np.int16)
         else:
             raise ValueError(f"invalid mixer mode {self.mode}")
@@ -143,7 +302,7 @@ class AudioStream:
 
     def _fill_buffer(self, in_data, frame_count, time_info, status):
         try:
-            self._buffer.put_nowait(in_data)
+            self._buffer.put_nowait((time.perf_counter(), in_data))
             return (None, pyaudio.paContinue)
         except asyncio.QueueFull:
             print("buffer full, dropping audio data")
@@ -154,10 +313,14 @@ class AudioStream:
     async def _consume_buffer(self):
         try:
             while True:
-                audio_data = await self._buffer.get()
-                if audio_data is None:
+                item = await self._buffer.get()
+                if item is None:
                     print('audio worker: got None from buffer - returning')
                     return
+                captured, audio_data = item
+                if tracing.tracer is not None:
+                    # read where the mixed audio is queued, see DeepgramTranscriber.send_audio
+                    tracing.audio_captured.set(captured)
                 # convert bytes data to numpy array
                 np_audio_data = np.frombuffer(audio_data, dtype=np.int16)
                 # resample the audio using interpolation
@@ -172,7 +335,8 @@ class AudioStream:
             return
 
     # uses linear interpolation for resampling
-    def _resample(self, audio_data: np.ndarray, original_rate, new_rate):
+    @staticmethod
+    def _resample(audio_data: np.ndarray, original_rate, new_rate):
         try:
             # new number of samples
             ratio = new_rate / original_rate
@@ -186,46 +350,339 @@ class AudioStream:
             print("resample exception", e)
             return None
 
+# language switch of a live transcription without a gap: a second connection in the new language gets the same audio
+# from start on. on each channel it takes over at the end of the first old segment ending min_overlap after start,
+# or where the old results are after max_overlap seconds.
+# words before that cut come from the old connection and words after it from the new one, new results are held until
+# the cut of their channel is known and trimmed to the words after it.
+# a forced cut can fall inside an old segment still open, the old connection is then finished and its last results
+# trimmed to the words before the cut, new results of the channel wait for them so the transcript stays in order.
+# deepgram times count the audio each connection received, frames its AudioSender dropped on a congested link are
+# missing from them. old_position and new_position map them to seconds of the audio put to the old connection,
+# start and the cuts are in those seconds.
+class LanguageSwitch:
+    def __init__(self, language, channels, min_overlap=0.5, max_overlap=8.0):
+        self.language = language
+        self.channels = channels
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.live = None # new connection, its sender and timeline once open
+        self.sender = None
+        self.audio_timeline = None
+        self.start = None
+        self.old_position = None # old and new stream seconds -> seconds of the audio put to the old connection
+        self.new_position = None
+        self.cuts = {} # channel -> cut
+        self.last_end = {} # channel -> end of the last old result
+        self.forced = set() # channels cut at max_overlap whose old words up to the cut may still come
+        self.taken_over = set() # channels with a new result past their cut, earlier ones may straddle it
+        self.held = [] # new results waiting for the cut of their channel
+        self.old_live = None # old connection and timeline, after the cut over until it is closed
+        self.old_audio_timeline = None
+        self.cut_over = False
+        self.deadline = None
+
+    def _end(self, result, position):
+        return position(result['start'] + result.get('duration', 0))
+
+    # an old result, None when it is past the cut of its channel
+    def old_result(self, result):
+        if 'channel' not in result or 'start' not in result:
+            return None if self.cut_over else result
+        channel = result['channel_index'][0]
+        end = self._end(result, self.old_position)
+        if channel in self.forced:
+            if end >= self.cuts[channel]:
+                # the old segment holding the cut, nothing more before it
+                self.forced.discard(channel)
+            return self._trim(result, self.cuts[channel], self.old_position, after=False)
+        if channel in self.cuts:
+            return None
+        self.last_end[channel] = end
+        if end >= self.start + self.min_overlap:
+            self.cuts[channel] = end
+        return result
+
+    # cuts the channels still without one where their old results are
+    def force_cuts(self):
+        for channel in range(self.channels):
+            if channel not in self.cuts:
+                self.cuts[channel] = max(self.last_end.get(channel, self.start), self.start)
+                self.forced.add(channel)
+
+    # the old connection is closed, its results for the forced cuts came or never will
+    def old_closed(self):
+        self.forced.clear()
+        self.old_live = None
+
+    def done(self):
+        return len(self.cuts) == self.channels
+
+    # adds a new result (or none) and returns the held results now ready, trimmed to the words after the cuts
+    def new_results(self, result=None):
+        if result is not None:
+            if 'channel' not in result or 'start' not in result:
+                return [result] if self.cut_over else []
+            self.held.append(result)
+        ready, held = [], []
+        for result in self.held:
+            channel = result['channel_index'][0]
+            if channel not in self.cuts or channel in self.forced:
+                held.append(result)
+                continue
+            cut = self.cuts[channel]
+            if self._end(result, self.new_position) > cut:
+                self.taken_over.add(channel)
+            result = self._trim(result, cut, self.new_position, after=True)
+            if result is not None:
+                ready.append(result)
+        self.held = held
+        return ready
+
+    # whether results still need trimming or holding
+    def trimming(self):
+        return not self.cut_over or len(self.taken_over) < self.channels or bool(self.forced)
+
+    # the part of a result after (or before) cut, None when nothing is left.
+    # position maps the stream seconds of the result to the seconds of the cut.
+    @staticmethod
+    def _trim(result, cut, position, after):
+        start = position(result['start'])
+        end = position(result['start'] + result.get('duration', 0))
+        if (start >= cut - 0.01) if after else (end <= cut + 0.01):
+            return result
+        if (end <= cut) if after else (start >= cut):
+            return None
+        alternative = result['channel']['alternatives'][0]
+        words = alternative.get('words')
+        if words is None:
+            # no word timings, the segment goes to the side holding most of it
+            return result if ((start + end) / 2 >= cut) == after else None
+        if after:
+            words = [word for word in words if position(word['start']) >= cut - 0.01]
+        else:
+            words = [word for word in words if position(word['end']) <= cut + 0.01]
+        if not words:
+            return None
+        # times stay in the stream seconds of the result
+        start = words[0]['start'] if after else result['start']
+        end = result['start'] + result.get('duration', 0) if after else words[-1]['end']
+        transcript = ' '.join(word.get('punctuated_word', word['word']) for word in words)
+        alternative = dict(alternative, transcript=transcript, words=words)
+        return dict(result, start=start, duration=end - start, channel=dict(result['channel'], alternatives=[alternative]))
+
 # accept audio slices and sends them to deepgram returning transcriptions
 class DeepgramTranscriber:
-    def __init__(self, DEEPGRAM_API_KEY):
+    # seconds of silence on the system channel before we consider its turn over
+    TURN_END_DELAY_SPEECH_FINAL = 0.3
+    TURN_END_DELAY_SILENCE = 1.5
+
+    def __init__(self, DEEPGRAM_API_KEY, trigger_rules: TriggerRules = None):
         self.client = Deepgram(DEEPGRAM_API_KEY)
         self.deepgram_live = None
         self.results_queue = None
         self.last_speaker = ""
+        self.turn_end_timer = None
+        self.sender = None # AudioSender of the open connection
+        self.audio_timeline = None # when each sent frame was captured, queued and sent, while tracing
+        self.language = None
+        self.channels = 1
+        self.multichannel = False
+        self.switch = None # LanguageSwitch in progress
+        self.dedup = TranscriptDedup.from_env() # drops user segments that echo the system speaker
+        # fired rules are put on the results queue as ('trigger', rule name)
+        self.trigger_engine = TriggerEngine(trigger_rules, self._trigger_fired) if trigger_rules is not None else None
 
     async def initialize(self, results_queue: queue.Queue, language: str, channels: int, multichannel: bool):
         self.results_queue = results_queue
+        if self.trigger_engine is not None:
+            self.trigger_engine.reset()
+        self.language = language
+        self.channels = channels
+        self.multichannel = multichannel
+        opened = await self._open_live(language)
+        if opened is None:
+            return False
+        self.deepgram_live, self.sender, self.audio_timeline = opened
+        print("transcription live")
+        return True
+
+    # opens a websocket connection to deepgram and its sender, None when it could not be opened
+    async def _open_live(self, language):
         try:
-            # create a websocket connection to deepgram
-            self.deepgram_live = await self.client.transcription.live(
+            live = await self.client.transcription.live(
                 { 
                     "smart_format": True, 
                     "model": "nova-2", 
                     "language": language,
                     "encoding": "linear16",
-                    "multichannel": multichannel,
-                    "channels": channels,
-                    "sample_rate": 16000
+                    "multichannel": self.multichannel,
+                    "channels": self.channels,
+                    "sample_rate": 16000,
+                    # UtteranceEnd events (end of a turn, see _transcript_received) need the interim results
+                    "interim_results": True,
+                    "utterance_end_ms": 1000,
                 }
             )
-            print("transcription live")
         except Exception as e:
             print(f'could not open deepgram socket: {e}')
-        
-        # deepgram events
-        self.deepgram_live.register_handler(
-            self.deepgram_live.event.TRANSCRIPT_RECEIVED, 
-            self._transcript_received
-        )
-
-        self.deepgram_live.register_handler(
-            self.deepgram_live.event.CLOSE,
-            lambda _: print('deepgram connection closed')
-        )
+            return None
+
+        # audio goes out from its own task, coalesced while the socket is backed up
+        sender = AudioSender(live.send, lambda: live_buffered_bytes(live), bytes_per_second=16000 * 2 * self.channels)
+        audio_timeline = None
+        if tracing.tracer is not None:
+            audio_timeline = tracing.AudioTimeline(sender.bytes_per_second)
+            sender.on_sent = audio_timeline.sent
+        sender.start()
+
+        # deepgram events, results are routed by connection while switching language
+        async def transcript_received(transcript_json):
+            await self._live_result(live, transcript_json)
+        live.register_handler(live.event.TRANSCRIPT_RECEIVED, transcript_received)
+        live.register_handler(live.event.CLOSE, lambda _: print(f'deepgram connection closed ({language})'))
+        return live, sender, audio_timeline
+
+    # switches to another language while audio keeps flowing, see LanguageSwitch.
+    # returns False when the new connection could not be opened, the old one goes on then.
+    async def switch_language(self, language):
+        if self.deepgram_live is None:
+            return False
+        switch = self.switch
+        if switch is not None:
+            if not switch.cut_over:
+                print(f'language switch to {switch.language} abandoned')
+                self._close_switch()
+            else:
+                # still waiting on the last old results, let the held ones go
+                switch.old_closed()
+                for result in switch.new_results():
+                    await self._transcript_received(result, switch.audio_timeline)
+            self.switch = None
+        if language == self.language:
+            return True
+        switch = LanguageSwitch(language, self.channels)
+        self.switch = switch
+        opened = await self._open_live(language)
+        if self.switch is not switch:
+            # closed or switched again while connecting
+            if opened is not None:
+                asyncio.create_task(self._close_live(opened[0], opened[1]))
+            return False
+        if opened is None:
+            self.switch = None
+            return False
+        # the new connection gets the audio from here on
+        switch.live, switch.sender, switch.audio_timeline = opened
+        old_sender, new_sender = self.sender, switch.sender
+        bytes_per_second = old_sender.bytes_per_second
+        start = old_sender.put_bytes
+        switch.start = start / bytes_per_second
+        switch.old_position = lambda seconds: old_sender.put_offset(seconds * bytes_per_second) / bytes_per_second
+        switch.new_position = lambda seconds: (start + new_sender.put_offset(seconds * bytes_per_second)) / bytes_per_second
+        switch.deadline = asyncio.create_task(self._force_cut_over(switch))
+        print(f'transcribing {language} alongside {self.language}, switching at the next segment boundary')
+        return True
+
+    async def _force_cut_over(self, switch: LanguageSwitch):
+        await asyncio.sleep(switch.max_overlap)
+        if self.switch is not switch or switch.cut_over:
+            return
+        switch.force_cuts()
+        for result in switch.new_results():
+            await self._transcript_received(result, switch.audio_timeline)
+        self._cut_over(switch)
+
+    # the new connection becomes the open one, the old one is closed
+    def _cut_over(self, switch: LanguageSwitch):
+        old_live, old_sender, old_timeline = self.deepgram_live, self.sender, self.audio_timeline
+        self.deepgram_live, self.sender, self.audio_timeline = switch.live, switch.sender, switch.audio_timeline
+        previous = self.language
+        self.language = switch.language
+        switch.cut_over = True
+        if switch.deadline is not None:
+            switch.deadline.cancel()
+        if not switch.trimming():
+            self.switch = None
+        cuts = ', '.join(f'{cut - switch.start:.1f}s' for _, cut in sorted(switch.cuts.items()))
+        print(f'language switched from {previous} to {self.language} (cut {cuts} after the new connection started)')
+        switch.old_live, switch.old_audio_timeline = old_live, old_timeline
+        asyncio.create_task(self._close_old_live(switch, old_live, old_sender))
+
+    # closes the connection switched away from, the new results it held back can go once its last results are in
+    async def _close_old_live(self, switch: LanguageSwitch, live, sender):
+        await self._close_live(live, sender)
+        if self.switch is not switch:
+            return
+        switch.old_closed()
+        for result in switch.new_results():
+            await self._transcript_received(result, switch.audio_timeline)
+        if not switch.trimming() and self.switch is switch:
+            self.switch = None
+
+    def _close_switch(self):
+        switch = self.switch
+        if switch.deadline is not None:
+            switch.deadline.cancel()
+        if switch.live is not None:
+            asyncio.create_task(self._close_live(switch.live, switch.sender))
+
+    # sends the audio still queued for the connection before finishing it, its last results need it
+    async def _close_live(self, live, sender):
+        await sender.flush()
+        sender.stop()
+        try:
+            await live.finish()
+        except Exception as e:
+            print(f"exception when closing deepgram {e}")
+
+    # results of every connection come here, while switching language they are cut where the connections hand over
+    async def _live_result(self, live, transcript_json: dict):
+        if transcript_json.get('is_final') is False:
+            # interim results are only there for the utterance end events, the final result repeats their words.
+            # new speech on the open connection still means the turn is going on.
+            if live is self.deepgram_live and transcript_json['channel']['alternatives'][0]['transcript']:
+                self._cancel_turn_end()
+            return
+        switch = self.switch
+        if switch is not None and live is switch.live:
+            for result in switch.new_results(transcript_json):
+                await self._transcript_received(result, switch.audio_timeline)
+            if switch.cut_over and not switch.trimming() and self.switch is switch:
+                self.switch = None
+        elif switch is not None and live is switch.old_live:
+            # last results of the connection switched away from, up to the forced cuts
+            result = switch.old_result(transcript_json)
+            if result is not None:
+                await self._transcript_received(result, switch.old_audio_timeline)
+            for result in switch.new_results():
+                await self._transcript_received(result, switch.audio_timeline)
+            if not switch.trimming() and self.switch is switch:
+                self.switch = None
+        elif live is not self.deepgram_live:
+            # connection being closed, the open one has this audio
+            return
+        elif switch is not None and switch.live is not None and not switch.cut_over:
+            result = switch.old_result(transcript_json)
+            if result is not None:
+                await self._transcript_received(result, self.audio_timeline)
+            for result in switch.new_results():
+                await self._transcript_received(result, switch.audio_timeline)
+            if switch.done() and not switch.cut_over:
+                self._cut_over(switch)
+        else:
+            await self._transcript_received(transcript_json, self.audio_timeline)
     
     # put transcription results on queue appending the speaker prefix when needed.
-    async def _transcript_received(self, transcript_json: dict):
+    # audio_timeline is the one of the connection the result came from, for tracing.
+    async def _transcript_received(self, transcript_json: dict, audio_timeline=None):
+        received = time.perf_counter() if tracing.tracer is not None else None
+        # utterance end events carry [channel_index, channels] instead of results
+        if transcript_json.get('type') == 'UtteranceEnd':
+            if transcript_json.get('channel', [0])[0] == 1 and self.last_speaker == 'system: ':
+                self._schedule_turn_end(0)
+            return
+
         if not 'channel' in transcript_json:
             return
         
@@ -234,14 +691,24 @@ class DeepgramTranscriber:
         # stop propagation if empty
         if not transcription:
             return
+
+        # echo of the system speaker picked up by the mic, not new speech
+        is_channel_0 = transcript_json['channel_index'][0] == 0
+        if self.dedup is not None and self.dedup.is_echo(is_channel_0, transcription):
+            print(f"dropped echoed transcript: {transcription}")
+            return
+
+        # any new speech means the current turn is still going
+        self._cancel_turn_end()
         
         # clear new lines
         transcription = transcription.replace('\n', '').replace('\r', '')
 
         # check need for prefix and speaker identifier
-        is_channel_0 = transcript_json['channel_index'][0] == 0
         msg_type = 'user_msg' if is_channel_0 else 'system_msg'
         speaker = 'user: ' if is_channel_0 else 'system: '
+        if self.trigger_engine is not None:
+            self.trigger_engine.feed('user' if is_channel_0 else 'system', transcription)
         if self.last_speaker == "":
             # first message
             transcription = speaker + transcription
@@ -252,6 +719,10 @@ class DeepgramTranscriber:
             # same speaker
             transcription = " " + transcription
         
+        if received is not None:
+            tracing.tracer.last_segment = received
+            transcription = self._trace_segment(transcript_json, transcription, received, audio_timeline or self.audio_timeline)
+
         # put message in queue for consumption
         try:
             self.results_queue.put_nowait((msg_type, transcription))
@@ -262,20 +733,101 @@ class DeepgramTranscriber:
         
         # update last speaker
         self.last_speaker = speaker
+
+        # system speaker may have finished talking, confirm after a short silence
+        if not is_channel_0:
+            if transcript_json.get('speech_final'):
+                self._schedule_turn_end(self.TURN_END_DELAY_SPEECH_FINAL)
+            else:
+                self._schedule_turn_end(self.TURN_END_DELAY_SILENCE)
+
+    # for sampled segments, spans from the capture of the audio that ended the segment to it being queued for the GUI.
+    # the trace goes along with the text.
+    def _trace_segment(self, transcript_json, transcription, received, audio_timeline):
+        trace = tracing.tracer.sample_utterance(text=transcription.strip()[:80])
+        if trace is None:
+            return transcription
+        audio_end = transcript_json.get('start', 0) + transcript_json.get('duration', 0)
+        frame = audio_timeline.lookup(audio_end) if audio_timeline is not None else None
+        if frame is not None:
+            captured, queued, sent = frame
+            trace.span('capture and mix', captured, queued)
+            trace.span('send queue', queued, sent)
+            trace.span('deepgram', sent, received)
+        trace.span('transcript handling', received)
+        traced = tracing.TracedText(transcription)
+        traced.trace = trace
+        trace.mark('queued')
+        return traced
+
+    def _schedule_turn_end(self, delay):
+        self._cancel_turn_end()
+        loop = asyncio.get_running_loop()
+        self.turn_end_timer = loop.call_later(delay, self._turn_end)
+
+    def _cancel_turn_end(self):
+        if self.turn_end_timer is not None:
+            self.turn_end_timer.cancel()
+            self.turn_end_timer = None
+
+    # signals the end of a system speaker turn, used to start speculative answers
+    def _turn_end(self):
+        self.turn_end_timer = None
+        try:
+            self.results_queue.put_nowait(('system_turn_end', ''))
+        except queue.Full:
+            print("results queue full")
     
-    # sends audio chunk to live transcription API
-    def send_audio(self, chunk):
+    def _trigger_fired(self, rule_name):
         try:
-            self.deepgram_live.send(chunk)
-        except Exception as e:
-            print(f"deepgram send audio exception {e}")
+            self.results_queue.put_nowait(('trigger', rule_name))
+        except queue.Full:
+            print("results queue full")
+
+    # queues audio chunk for the live transcription API
+    def send_audio(self, chunk):
+        if self.sender is None:
+            return
+        captured = tracing.audio_captured.get() if tracing.tracer is not None else None
+        self.sender.put(chunk, captured)
+        switch = self.switch
+        if switch is not None and switch.sender is not None and not switch.cut_over:
+            # same audio to the connection in the new language until it takes over
+            switch.sender.put(chunk, captured)
+
+    # send queue latency and buffer depths of the open connection, None when closed
+    def send_stats(self):
+        return self.sender.stats() if self.sender is not None else None
     
     async def close(self):
+        self._cancel_turn_end()
+        if self.trigger_engine is not None:
+            self.trigger_engine.reset()
+        switch = self.switch
+        if switch is not None and not switch.cut_over:
+            # the new connection never took over, the old one has all the audio
+            self._close_switch()
+            self.switch = switch = None
         # check if deepgram connection is open before finishing
         if self.deepgram_live is None:
+            self.switch = None
             return
+        if self.sender is not None:
+            sender = self.sender
+            self.sender = None
+            await sender.flush()
+            sender.stop()
+            print(f"audio sender: {sender.stats()}")
+        # after a cut over the switch stays in place while finishing, the last results of the connection may start
+        # before the cut and still need trimming
         try:
             await self.deepgram_live.finish()
             self.deepgram_live = None
         except:
             print("exception when closing deepgram")
+        if switch is not None and self.switch is switch:
+            # nothing more comes from either connection, let the held results go
+            switch.old_closed()
+            for result in switch.new_results():
+                await self._transcript_received(result, switch.audio_timeline)
+            self.switch = None
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+# event loop for the asyncio thread. ASYNCIO_LOOP=uvloop runs it on uvloop when installed (not available on windows).
+def new_event_loop():
+    if os.getenv('ASYNCIO_LOOP', 'asyncio') == 'uvloop':
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError as e:
+            print(f'uvloop not available, using the asyncio loop ({e})')
+    # avoid ProactorEventLoop issues on windows
+    if os.name == 'nt':
+        return asyncio.SelectorEventLoop()
+    return asyncio.new_event_loop()
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# measures how late the loop runs a sleeping task (scheduling lag) and reports what blocks it.
+# a watchdog thread looks at the loop thread stack when the lag passes slow_callback seconds,
+# so slow callbacks are caught while they still run, on the asyncio loop and on uvloop alike.
+class LoopMonitor:
+    def __init__(self, interval=0.1, slow_callback=0.05, log_path=None, max_samples=3000):
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.log_path = log_path
+        self.samples = deque(maxlen=max_samples) # lag in seconds of each tick
+        self.slow_callbacks = deque(maxlen=100) # reports of the last stalls
+        self.task = None
+        self.loop_thread_id = None
+        self.expected = None # when the sampler should wake up next
+        self.stall = None # report of the stall in progress, filled by the watchdog
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.watchdog = None
+
+    # LOOP_MONITOR=1 enables it, LOOP_SLOW_CALLBACK_MS sets the threshold and LOOP_MONITOR_LOG a json lines file
+    @classmethod
+    def from_env(cls):
+        if os.getenv('LOOP_MONITOR', '0') != '1':
+            return None
+        slow_callback = float(os.getenv('LOOP_SLOW_CALLBACK_MS', '50')) / 1000
+        return cls(slow_callback=slow_callback, log_path=os.getenv('LOOP_MONITOR_LOG'))
+
+    # call from the loop thread
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.stopped.clear()
+        self.task = asyncio.get_running_loop().create_task(self._sample())
+        self.watchdog = threading.Thread(target=self._watch, daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _sample(self):
+        while True:
+            with self.lock:
+                self.expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            with self.lock:
+                lag = max(0.0, now - self.expected)
+                stall = self.stall
+                self.stall = None
+                self.expected = None
+            self.samples.append(lag)
+            if stall is not None:
+                stall['lag'] = lag
+                self._report(stall)
+
+    def _watch(self):
+        while not self.stopped.wait(self.slow_callback / 2):
+            with self.lock:
+                if self.expected is None or self.stall is not None:
+                    continue
+                if time.perf_counter() - self.expected < self.slow_callback:
+                    continue
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is None:
+                    continue
+                self.stall = {
+                    'time': time.time(),
+                    'callback': _running_callback(frame),
+                    'stack': traceback.format_stack(frame),
+                }
+
+    def _report(self, stall):
+        self.slow_callbacks.append(stall)
+        where = stall['stack'][-1].strip().splitlines()[0] if stall['stack'] else 'unknown'
+        print(f"event loop lag {stall['lag'] * 1000:.0f}ms while running {stall['callback']} at {where}")
+        if self.log_path:
+            try:
+                with open(self.log_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(stall) + '\n')
+            except OSError as e:
+                print(f'could not write loop monitor log {e}')
+
+    def stats(self):
+        samples = list(self.samples)
+        if not samples:
+            return {'samples': 0}
+        return {
+            'samples': len(samples),
+            'lag_p50_ms': _percentile(samples, 50) * 1000,
+            'lag_p95_ms': _percentile(samples, 95) * 1000,
+            'lag_max_ms': max(samples) * 1000,
+            'slow_callbacks': len(self.slow_callbacks),
+        }
+
+# name of the callback the asyncio loop is running in the captured stack, found from the Handle._run frame.
+# uvloop runs callbacks from C, there the stack alone tells where the time went.
+def _running_callback(frame):
+    callback = 'unknown callback'
+    while frame is not None:
+        if frame.f_code.co_name == '_run':
+            handle = frame.f_locals.get('self')
+            if isinstance(handle, asyncio.Handle):
+                callback = repr(handle)
+        frame = frame.f_back
+    return callback
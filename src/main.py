@@ -15,14 +15,15 @@
 """
 
 from threading import Thread
-import pyaudiowpatch as pyaudio
 import os
+import time
 import asyncio
 import signal
+import traceback
 from dotenv import load_dotenv
 from app_gui import AppGUI
-from live_transcriber import TranscriptionController
-from gpt_controller import GPTController
+from loop_monitor import LoopMonitor, new_event_loop
+import tracing
 
 load_dotenv()
 
@@ -54,39 +55,89 @@ def start_asyncio_loop(loop, terminate_event: EventAsyncio):
 
 # keep asyncio loop running
 async def asyncio_main(terminate_event: EventAsyncio):
+    loop_monitor = LoopMonitor.from_env()
+    if loop_monitor is not None:
+        loop_monitor.start()
     try:
         await terminate_event.wait()
         print('asyncio_main() terminating...')
     except Exception as e:
         print(f'main routine exception {e}')
+    if loop_monitor is not None:
+        loop_monitor.stop()
+        print(f'event loop lag: {loop_monitor.stats()}')
 
 # ctrl+C handler
 def SIGINT_handler(signal, frame, app_gui: AppGUI):
     print('SIGINT received')
     app_gui.root.after(0, app_gui.close_program)
 
+# imports the heavy modules and builds what does not need the Tk thread, then hands over to finish on the Tk thread.
+# any error is shown in the window and closes the app, it can't capture or ask without the controllers.
+def load_controllers(app_gui: AppGUI, started):
+    resources = {}
+    try:
+        import pyaudiowpatch as pyaudio
+        import tiktoken
+        from live_transcriber import TranscriptionController
+        from gpt_controller import GPTController
+        from transcript_index import TranscriptIndex
+        from reference_index import ReferenceLibrary
+        imported = time.perf_counter()
+        gpt_controller = GPTController(OPENAI_API_KEY)
+        token_encoder = tiktoken.get_encoding("cl100k_base")
+        transcript_index = TranscriptIndex.from_env()
+        reference_library = ReferenceLibrary.from_env()
+        loaded = time.perf_counter()
+
+        # PyAudio must be created on the main thread, loopback streams fail to open otherwise
+        def finish():
+            p = pyaudio.PyAudio()
+            resources['p'] = p
+            transcription_controller = TranscriptionController(p, DEEPGRAM_API_KEY)
+            app_gui.attach(transcription_controller, gpt_controller, token_encoder, transcript_index, reference_library)
+            print(f'startup: imports {(imported - started) * 1000:.0f}ms, controllers {(loaded - imported) * 1000:.0f}ms, ready {(time.perf_counter() - started) * 1000:.0f}ms')
+
+        app_gui.wakeup.call(finish).result()
+    except Exception as e:
+        if app_gui.wakeup.closed:
+            return resources # window closed before loading finished
+        traceback.print_exc()
+        app_gui.wakeup.call(lambda: app_gui.startup_failed(e))
+    return resources
+
 def main():
-    p = pyaudio.PyAudio()
-    transcription_controller = TranscriptionController(p, DEEPGRAM_API_KEY)
-    gpt_controller = GPTController(OPENAI_API_KEY)
+    started = time.perf_counter()
     terminate_event = EventAsyncio()
-    asyncio_loop = asyncio.new_event_loop()
-    app_gui = AppGUI(transcription_controller, gpt_controller, asyncio_loop, terminate_event)
-    
-    # ctrl+C handler
-    signal.signal(signal.SIGINT, lambda signal, frame: SIGINT_handler(signal, frame, app_gui))
+    asyncio_loop = new_event_loop()
 
     # start the asyncio loop in a separate thread
     asyncio_thread = Thread(target=start_asyncio_loop, args=(asyncio_loop, terminate_event), daemon=True)
     asyncio_thread.start()
 
+    # show the window first, the controllers are attached once loaded
+    app_gui = AppGUI(asyncio_loop, terminate_event)
+    print(f'startup: window {(time.perf_counter() - started) * 1000:.0f}ms')
+    resources = {}
+    loader_thread = Thread(target=lambda: resources.update(load_controllers(app_gui, started)), daemon=True)
+    loader_thread.start()
+    
+    # ctrl+C handler
+    signal.signal(signal.SIGINT, lambda signal, frame: SIGINT_handler(signal, frame, app_gui))
+
     # start GUI loop in mainthread
     app_gui.run_mainloop()
 
-    p.terminate()
-    
-    # wait until asyncio loop is terminated
+    # wait until asyncio loop is terminated (capture is stopped there), then release PortAudio
     asyncio_thread.join()
+    loader_thread.join(timeout=5)
+
+    if 'p' in resources:
+        resources['p'].terminate()
+
+    # TRACE_SAMPLE_RATE set: spans of the session for chrome://tracing or ui.perfetto.dev
+    if tracing.tracer is not None:
+        tracing.tracer.export()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+from collections import deque
+
+# default routing when no LLM_BACKENDS file is configured
+DEFAULT_ROUTING = {
+    "backends": [
+        {"name": "gpt-4-turbo", "model": "gpt-4-1106-preview", "max_prompt_tokens": 120000, "expected_ttft": 1.0, "prefill_per_1k": 0.05},
+        {"name": "gpt-3.5-turbo", "model": "gpt-3.5-turbo-1106", "max_prompt_tokens": 15000, "expected_ttft": 0.5, "prefill_per_1k": 0.02},
+    ],
+    "classes": {
+        "quick": {"ttft_budget": 1.0, "backends": ["gpt-3.5-turbo", "gpt-4-turbo"]},
+        "standard": {"ttft_budget": 3.0, "backends": ["gpt-4-turbo", "gpt-3.5-turbo"]},
+        "deep": {"ttft_budget": 10.0, "backends": ["gpt-4-turbo"]},
+    },
+}
+
+# one model on one OpenAI compatible endpoint (OpenAI itself or a local server)
+class Backend:
+    def __init__(self, name, model, base_url=None, api_key=None, max_prompt_tokens=120000, expected_ttft=1.0, prefill_per_1k=0.05):
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_prompt_tokens = max_prompt_tokens
+        self.prefill_per_1k = prefill_per_1k # extra ttft seconds per 1k prompt tokens
+        self.base_ttft = expected_ttft # moving average of ttft without the prefill part
+        self.failures = 0
+        self.down_until = 0.0
+
+    def expected_ttft(self, prompt_tokens):
+        return self.base_ttft + prompt_tokens / 1000 * self.prefill_per_1k
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+# picks the backend for each request from the prompt size, the prompt latency class
+# and the ttft each backend has recently shown. failing or slow backends are put on cooldown.
+class ModelRouter:
+    def __init__(self, config: dict, default_api_key=None, default_base_url=None, log_path=None):
+        self.backends = {}
+        for backend_config in config["backends"]:
+            backend_config = dict(backend_config)
+            api_key_env = backend_config.pop("api_key_env", None)
+            if api_key_env:
+                backend_config["api_key"] = os.getenv(api_key_env)
+            backend_config.setdefault("api_key", default_api_key)
+            backend_config.setdefault("base_url", default_base_url)
+            backend = Backend(**backend_config)
+            self.backends[backend.name] = backend
+        self.classes = config["classes"]
+        self.ewma_weight = 0.3
+        self.decisions = deque(maxlen=500)
+        self.log_path = log_path
+
+    # reads the routing config from the LLM_BACKENDS json file if set
+    @classmethod
+    def from_env(cls, default_api_key=None, default_base_url=None):
+        config = DEFAULT_ROUTING
+        config_path = os.getenv('LLM_BACKENDS')
+        if config_path:
+            with open(config_path) as file:
+                config = json.load(file)
+        return cls(config, default_api_key, default_base_url, os.getenv('LLM_ROUTING_LOG'))
+
+    # ordered backends to try: healthy ones within the ttft budget in configured order,
+    # then the remaining healthy ones by expected ttft, then the ones cooling down.
+    def route(self, prompt_tokens, latency_class='standard'):
+        class_config = self.classes.get(latency_class) or self.classes['standard']
+        budget = class_config['ttft_budget']
+        now = time.monotonic()
+        fitting = [self.backends[name] for name in class_config['backends'] if self.backends[name].max_prompt_tokens >= prompt_tokens]
+        if not fitting:
+            # nothing fits, let the biggest context try anyway
+            fitting = [max(self.backends.values(), key=lambda backend: backend.max_prompt_tokens)]
+        healthy = [backend for backend in fitting if backend.healthy(now)]
+        within_budget = [backend for backend in healthy if backend.expected_ttft(prompt_tokens) <= budget]
+        over_budget = sorted((backend for backend in healthy if backend not in within_budget), key=lambda backend: backend.expected_ttft(prompt_tokens))
+        cooling_down = sorted((backend for backend in fitting if backend not in healthy), key=lambda backend: backend.down_until)
+        return within_budget + over_budget + cooling_down
+
+    # how long a backend may take to its first token before the next candidate is tried (the last one waits)
+    def ttft_timeout(self, latency_class='standard'):
+        class_config = self.classes.get(latency_class) or self.classes['standard']
+        return class_config.get('ttft_timeout', class_config['ttft_budget'] * 3)
+
+    def record_success(self, backend: Backend, ttft, prompt_tokens):
+        base_ttft = max(0.0, ttft - prompt_tokens / 1000 * backend.prefill_per_1k)
+        backend.base_ttft += self.ewma_weight * (base_ttft - backend.base_ttft)
+        backend.failures = 0
+        backend.down_until = 0.0
+
+    # exponential cooldown, capped at a minute
+    def record_failure(self, backend: Backend, reason):
+        backend.failures += 1
+        cooldown = min(60.0, 5.0 * 2 ** (backend.failures - 1))
+        backend.down_until = time.monotonic() + cooldown
+        print(f'backend {backend.name} failed ({reason}), cooling down for {cooldown:.0f}s')
+
+    def record_decision(self, decision: dict):
+        self.decisions.append(decision)
+        if self.log_path:
+            with open(self.log_path, 'a') as file:
+                file.write(json.dumps(decision) + '\n')
@@ -1,3 +1,8 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
 
 base_prompts = {
     'interview_candidate': (
@@ -111,3 +116,26 @@ base_prompts = {
 ),  
 
 }
+
+# display names, in the order the buttons are shown
+prompt_names = {
+    'interview_candidate': "The Perfect Candidate",
+    'interview_host': "The Perfect Interviewer",
+    'salesperson': "The Perfect Salesperson",
+    'customer_easy': "Easy Customer",
+    'customer_hard': "Hard Customer",
+}
+
+# how fast each prompt needs its answer, used to route it to a model (quick, standard or deep).
+# every prompt is standard (gpt-4 first) unless PROMPT_LATENCY_CLASSES opts it in to another class,
+# e.g. PROMPT_LATENCY_CLASSES=interview_candidate:quick,salesperson:quick
+prompt_latency_classes = {name: 'standard' for name in base_prompts}
+for entry in filter(None, os.getenv('PROMPT_LATENCY_CLASSES', '').split(',')):
+    name, _, latency_class = entry.strip().partition(':')
+    prompt_latency_classes[name] = latency_class or 'standard'
+
+# puts the transcription (and the relevant parts of the reference documents) into a base prompt
+def fill_prompt(prompt, transcription, reference_library=None):
+    if reference_library is not None:
+        prompt = reference_library.fill(prompt, transcription)
+    return prompt.replace("[INPUT_TRANSCRIPTION]", transcription)
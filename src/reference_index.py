@@ -0,0 +1,118 @@
+import os
+import re
+import numpy as np
+from trigger_engine import normalize
+
+# [DOC:name] or [DOC:name:k] in a prompt is replaced by the k chunks of that document most relevant to the conversation
+DOC_PLACEHOLDER = re.compile(r'\[DOC:([\w\-. ]+?)(?::(\d+))?\]')
+
+# BM25 index over the chunks of one reference document (resume, job description, product sheet...).
+# built once when the document is loaded: each chunk row holds the BM25 weight of every vocabulary term,
+# so scoring a query is a column sum over its terms.
+class ReferenceIndex:
+    def __init__(self, name, text, chunk_words=120, overlap_words=20, k1=1.5, b=0.75):
+        self.name = name
+        self.chunks = self._split(text, chunk_words, overlap_words)
+        self.full_chars = len(text)
+        self.vocabulary = {}
+        rows = []
+        for chunk in self.chunks:
+            counts = {}
+            for word in normalize(chunk).split():
+                term = self.vocabulary.setdefault(word, len(self.vocabulary))
+                counts[term] = counts.get(term, 0) + 1
+            rows.append(counts)
+        tf = np.zeros((len(self.chunks), len(self.vocabulary)), dtype=np.float32)
+        for i, counts in enumerate(rows):
+            tf[i, list(counts.keys())] = list(counts.values())
+        lengths = tf.sum(axis=1, keepdims=True)
+        document_frequency = (tf > 0).sum(axis=0)
+        idf = np.log(1 + (len(self.chunks) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        self.weights = idf * tf * (k1 + 1) / (tf + norm)
+
+    # chunks of about chunk_words words, cut at paragraph or sentence ends when possible, overlapping a little
+    # so an answer that straddles two chunks is still found whole in one of them
+    @staticmethod
+    def _split(text, chunk_words, overlap_words):
+        sentences = [s for s in re.split(r'(?<=[.!?])\s+|\n\s*\n', text) if s.strip()]
+        chunks = []
+        current = []
+        for sentence in sentences:
+            words = sentence.split()
+            if current and len(current) + len(words) > chunk_words:
+                chunks.append(' '.join(current))
+                current = current[-overlap_words:] if overlap_words else []
+            current.extend(words)
+            while len(current) > chunk_words: # very long sentence
+                chunks.append(' '.join(current[:chunk_words]))
+                current = current[chunk_words - overlap_words:]
+        if current:
+            chunks.append(' '.join(current))
+        return chunks
+
+    # the k best chunks for the query, in document order so the text still reads naturally
+    def top_chunks(self, query, k=3):
+        if len(self.chunks) <= k:
+            return list(self.chunks)
+        terms = [self.vocabulary[word] for word in set(normalize(query).split()) if word in self.vocabulary]
+        if not terms:
+            return self.chunks[:k] # nothing in common yet, the start of a document is usually its summary
+        scores = self.weights[:, terms].sum(axis=1)
+        best = np.argpartition(-scores, k)[:k]
+        return [self.chunks[i] for i in sorted(best)]
+
+# reference documents by name, filled into prompts at ask time from the latest transcript turns
+class ReferenceLibrary:
+    def __init__(self, top_k=3, query_turns=4):
+        self.top_k = top_k
+        self.query_turns = query_turns
+        self.documents = {}
+
+    # every .txt / .md file in REFERENCE_DOCS_DIR, named after the file (resume.txt -> [DOC:resume])
+    @classmethod
+    def from_env(cls):
+        library = cls(int(os.getenv('REFERENCE_TOP_K', '3')))
+        directory = os.getenv('REFERENCE_DOCS_DIR')
+        if directory and os.path.isdir(directory):
+            for file_name in sorted(os.listdir(directory)):
+                if file_name.endswith(('.txt', '.md')):
+                    library.load(os.path.join(directory, file_name))
+        return library
+
+    # returns the name to use in the placeholder
+    def load(self, path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding='utf-8', errors='replace') as file:
+            self.add(name, file.read())
+        return name
+
+    def add(self, name, text):
+        document = ReferenceIndex(name, text)
+        self.documents[name] = document
+        print(f"reference document {name}: {len(document.chunks)} chunks, {len(document.vocabulary)} terms")
+
+    # replaces the [DOC:name] placeholders with the chunks relevant to the last turns of the transcript
+    def fill(self, prompt, transcription):
+        if '[DOC:' not in prompt:
+            return prompt
+        turns = [line for line in transcription.split('\n') if line.strip()]
+        query = ' '.join(turns[-self.query_turns:])
+        selected_chars, full_chars = 0, 0
+
+        def replace(match):
+            nonlocal selected_chars, full_chars
+            document = self.documents.get(match.group(1))
+            if document is None:
+                print(f"reference document {match.group(1)} not loaded")
+                return match.group(0)
+            chunks = document.top_chunks(query, int(match.group(2) or self.top_k))
+            text = '\n...\n'.join(chunks)
+            selected_chars += len(text)
+            full_chars += document.full_chars
+            return text
+
+        prompt = DOC_PLACEHOLDER.sub(replace, prompt)
+        if full_chars:
+            print(f"reference documents: about {selected_chars // 4} tokens sent instead of {full_chars // 4}")
+        return prompt
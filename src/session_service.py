@@ -0,0 +1,269 @@
+"""
+    multi-session service: many independent transcription sessions in one asyncio process.
+
+    * each websocket connection to /session is a session with its own transcriber, transcript and answer stream.
+    * every session shares one LLM connection pool and model router (see GPTController).
+    * listens on tcp and optionally on a local unix socket (--unix).
+
+    protocol (one websocket per session, query parameters language=en-US&channels=2):
+    * client -> service binary messages: linear16 16kHz audio, channels interleaved like the AudioMixer output.
+    * client -> service text messages (json):
+        {"type": "ask", "prompt_id": "interview_candidate"} or {"type": "ask", "prompt": "... [INPUT_TRANSCRIPTION] ..."}
+        {"type": "ping", "time": <any>} answered with a pong carrying the same time.
+        {"type": "language", "language": "fr"} switches the transcription language without a gap in the transcript.
+    * with TRIGGERS_FILE set, trigger phrases ask automatically with the rule prompt (or the prompt_id query parameter prompt)
+      and send {"type": "trigger", "name": "..."} before the answer.
+    * service -> client text messages (json):
+        {"type": "transcript", "speaker": "user" | "system", "text": "..."}, {"type": "turn_end"},
+        {"type": "answer", "request_id": 1, "text": "..."}, {"type": "pong", "time": <same>}, {"type": "error", "message": "..."}
+
+    usage: python src/session_service.py --port 8765 --unix /tmp/live_guru.sock
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import queue
+import time
+from aiohttp import web, WSMsgType
+from dotenv import load_dotenv
+from gpt_controller import GPTController
+from prompts import base_prompts, prompt_latency_classes, fill_prompt
+from stream_buffer import SignalQueue
+from reference_index import ReferenceLibrary
+from trigger_engine import TriggerRules
+import tracing
+
+load_dotenv()
+
+DEEPGRAM_API_KEY = os.getenv('DEEPGRAM_API_KEY')
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+
+def deepgram_transcriber(trigger_rules=None):
+    from live_transcriber import DeepgramTranscriber
+    return DeepgramTranscriber(DEEPGRAM_API_KEY, trigger_rules)
+
+# one connected client. transcriber results and answer chunks are forwarded by a single sender task,
+# woken through an asyncio.Event by the queue / buffer listeners (both run on the service loop).
+class Session:
+    def __init__(self, session_id, ws: web.WebSocketResponse, transcriber, gpt_controller: GPTController, prompt_id='interview_candidate', reference_library: ReferenceLibrary = None):
+        self.session_id = session_id
+        self.reference_library = reference_library
+        self.prompt_id = prompt_id # default prompt for trigger rules without one
+        self.ws = ws
+        self.transcriber = transcriber
+        self.gpt_controller = gpt_controller
+        self.results_queue = SignalQueue(100)
+        self.transcript = []
+        self.outgoing = [] # control replies (pongs, errors) waiting for the sender
+        self.wakeup = asyncio.Event()
+        self.results_queue.listener = self.wakeup.set
+        self.gpt_controller.answer_buffer.listener = self.wakeup.set
+        self.sender_task = None
+        self.audio_bytes = 0
+
+    async def start(self, language, channels):
+        self.sender_task = asyncio.create_task(self._send_results())
+        return await self.transcriber.initialize(self.results_queue, language, channels, channels > 1)
+
+    async def close(self):
+        await self.transcriber.close()
+        await self.gpt_controller.cancel_answers()
+        if self.sender_task is not None:
+            self.sender_task.cancel()
+
+    def receive_audio(self, data):
+        self.audio_bytes += len(data)
+        self.transcriber.send_audio(data)
+
+    async def receive_command(self, message):
+        try:
+            command = json.loads(message)
+        except ValueError:
+            self.reply({'type': 'error', 'message': 'invalid json'})
+            return
+        if command.get('type') == 'ping':
+            self.reply({'type': 'pong', 'time': command.get('time')})
+        elif command.get('type') == 'ask':
+            await self.ask(command)
+        elif command.get('type') == 'language':
+            await self.switch_language(command.get('language', ''))
+        else:
+            self.reply({'type': 'error', 'message': f"unknown command {command.get('type')}"})
+
+    async def switch_language(self, language):
+        if not language:
+            self.reply({'type': 'error', 'message': 'language command without a language'})
+            return
+        if not hasattr(self.transcriber, 'switch_language'):
+            self.reply({'type': 'error', 'message': 'this transcriber can not switch language'})
+            return
+        if not await self.transcriber.switch_language(language):
+            self.reply({'type': 'error', 'message': f'could not switch to {language}'})
+
+    async def ask(self, command):
+        prompt_id = command.get('prompt_id')
+        if prompt_id is not None and prompt_id not in base_prompts:
+            self.reply({'type': 'error', 'message': f'unknown prompt {prompt_id}'})
+            return
+        prompt = base_prompts[prompt_id] if prompt_id is not None else command.get('prompt', '')
+        latency_class = command.get('latency_class', prompt_latency_classes.get(prompt_id, 'standard'))
+        await self.send_prompt(prompt, latency_class)
+
+    async def send_prompt(self, prompt, latency_class):
+        final_prompt = fill_prompt(prompt, ''.join(self.transcript), self.reference_library)
+        await self.gpt_controller.send_prompt(final_prompt, self.gpt_controller.new_request_id(), latency_class)
+
+    def reply(self, message):
+        self.outgoing.append(message)
+        self.wakeup.set()
+
+    async def _send_results(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                messages = self.outgoing
+                self.outgoing = []
+                try:
+                    while True:
+                        msg_type, text = self.results_queue.get_nowait()
+                        if msg_type == 'system_turn_end':
+                            messages.append({'type': 'turn_end'})
+                            continue
+                        if msg_type == 'trigger':
+                            messages.append({'type': 'trigger', 'name': text})
+                            base_prompt, latency_class = self.transcriber.trigger_engine.rules.prompt_for(text, self.prompt_id)
+                            if base_prompt is not None:
+                                await self.send_prompt(base_prompt, latency_class)
+                            continue
+                        trace = getattr(text, 'trace', None)
+                        if trace is not None:
+                            trace.span_from('queued', 'results queue')
+                            text = str(text)
+                        self.transcript.append(text)
+                        speaker = 'user' if msg_type == 'user_msg' else 'system'
+                        messages.append({'type': 'transcript', 'speaker': speaker, 'text': text})
+                except queue.Empty:
+                    pass
+                for request_id, text in self.gpt_controller.answer_buffer.drain():
+                    # drop output from superseded requests
+                    if request_id == self.gpt_controller.active_request_id:
+                        messages.append({'type': 'answer', 'request_id': request_id, 'text': text})
+                for message in messages:
+                    await self.ws.send_str(json.dumps(message))
+        except ConnectionResetError:
+            pass
+
+# hosts the sessions. transcriber_factory builds a transcriber per session (DeepgramTranscriber by default,
+# anything with initialize / send_audio / close works). trigger rules are compiled once and shared by every session.
+class SessionService:
+    def __init__(self, openai_api_key=OPENAI_API_KEY, transcriber_factory=deepgram_transcriber, base_url=None):
+        self.openai_api_key = openai_api_key
+        self.transcriber_factory = transcriber_factory
+        self.trigger_rules = TriggerRules.from_env()
+        self.reference_library = ReferenceLibrary.from_env() # REFERENCE_DOCS_DIR documents, shared by every session
+        # owns the shared connection pool and routing stats, and keeps the pool warm while sessions are open
+        self.gpt_pool = GPTController(openai_api_key, base_url)
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.runner = None
+
+    async def start(self, host='127.0.0.1', port=8765, unix_path=None):
+        app = web.Application()
+        app.router.add_get('/session', self.session)
+        app.router.add_get('/stats', self.stats)
+        app.router.add_get('/trace', self.trace)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        print(f'session service listening on ws://{host}:{port}/session')
+        if unix_path:
+            await web.UnixSite(self.runner, unix_path).start()
+            print(f'session service listening on {unix_path}')
+
+    async def stop(self):
+        for session in list(self.sessions.values()):
+            await session.ws.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        await self.gpt_pool.stop_session()
+        await self.gpt_pool.http_client.aclose()
+        if tracing.tracer is not None:
+            tracing.tracer.export()
+
+    async def session(self, request: web.Request):
+        language = request.query.get('language', 'en-US')
+        channels = int(request.query.get('channels', '2'))
+        ws = web.WebSocketResponse(max_msg_size=1024 * 1024)
+        await ws.prepare(request)
+        gpt_controller = GPTController(self.openai_api_key, http_client=self.gpt_pool.http_client, router=self.gpt_pool.router)
+        transcriber = self.transcriber_factory(self.trigger_rules) if self.trigger_rules is not None else self.transcriber_factory()
+        session = Session(next(self.session_ids), ws, transcriber, gpt_controller, request.query.get('prompt_id', 'interview_candidate'), self.reference_library)
+        if not await session.start(language, channels):
+            await ws.send_str(json.dumps({'type': 'error', 'message': 'could not start the transcriber'}))
+            await session.close()
+            await ws.close()
+            return ws
+        self.sessions[session.session_id] = session
+        if len(self.sessions) == 1:
+            await self.gpt_pool.start_session()
+        print(f'session {session.session_id} opened ({len(self.sessions)} open)')
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.BINARY:
+                    session.receive_audio(msg.data)
+                elif msg.type == WSMsgType.TEXT:
+                    await session.receive_command(msg.data)
+                elif msg.type == WSMsgType.ERROR:
+                    print(f'session {session.session_id} websocket error {ws.exception()}')
+        finally:
+            del self.sessions[session.session_id]
+            await session.close()
+            if not self.sessions:
+                await self.gpt_pool.stop_session()
+            print(f'session {session.session_id} closed ({len(self.sessions)} open)')
+        return ws
+
+    async def stats(self, request: web.Request):
+        return web.json_response({
+            'sessions': len(self.sessions),
+            'cpu_time': time.process_time(),
+            'audio_bytes': {session_id: session.audio_bytes for session_id, session in self.sessions.items()},
+            # transcribers with an AudioSender report their send queue latency and buffer depths
+            'audio_send': {session_id: session.transcriber.send_stats() for session_id, session in self.sessions.items()
+                           if hasattr(session.transcriber, 'send_stats')},
+            # stage durations of the traced utterances and asks, with TRACE_SAMPLE_RATE set
+            'trace': tracing.tracer.stats() if tracing.tracer is not None else None,
+        })
+
+    # spans collected so far in the chrome trace event format
+    async def trace(self, request: web.Request):
+        if tracing.tracer is None:
+            return web.json_response({'error': 'tracing is off, set TRACE_SAMPLE_RATE'}, status=404)
+        return web.json_response(tracing.tracer.chrome_trace())
+
+async def serve(args):
+    service = SessionService()
+    await service.start(args.host, args.port, args.unix)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='multi-session transcription service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='also listen on this unix socket path')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
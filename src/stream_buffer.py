@@ -0,0 +1,72 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+
+# wakes a producer waiting for space, from the loop thread
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+# thread safe buffer between asyncio producers (LLM streams) and the Tk consumer.
+# consecutive chunks of the same request are coalesced into a single text run,
+# and when max_chars are pending producers wait for the consumer instead of dropping text.
+class StreamBuffer:
+    def __init__(self, max_chars=8000):
+        self.max_chars = max_chars
+        self.lock = threading.Lock()
+        self.runs = deque() # [request_id, [text, ...]] items
+        self.pending_chars = 0
+        self.waiters = [] # (loop, future) of producers waiting for space
+        self.listener = None # called after each put, from the producer thread
+
+    # appends text, waiting while the buffer is full. returns the time spent waiting in seconds.
+    async def put(self, request_id, text):
+        stalled_since = None
+        while True:
+            with self.lock:
+                if self.pending_chars < self.max_chars:
+                    if self.runs and self.runs[-1][0] == request_id:
+                        self.runs[-1][1].append(text)
+                    else:
+                        self.runs.append([request_id, [text]])
+                    self.pending_chars += len(text)
+                    break
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self.waiters.append((loop, future))
+            if stalled_since is None:
+                stalled_since = time.perf_counter()
+            await future
+        if self.listener is not None:
+            self.listener()
+        if stalled_since is None:
+            return 0.0
+        return time.perf_counter() - stalled_since
+
+    # takes everything pending as a list of (request_id, text) runs. called from the consumer thread.
+    def drain(self):
+        with self.lock:
+            runs = self.runs
+            waiters = self.waiters
+            self.runs = deque()
+            self.waiters = []
+            self.pending_chars = 0
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return [(request_id, ''.join(texts)) for request_id, texts in runs]
+
+    def pending(self):
+        return self.pending_chars
+
+# queue.Queue that calls listener after each put, so the consumer thread can be woken up
+class SignalQueue(queue.Queue):
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self.listener = None
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        if self.listener is not None:
+            self.listener()
@@ -0,0 +1,91 @@
+import threading
+import tkinter as tk
+from concurrent.futures import Future
+
+# wakes the Tk mainloop from other threads through virtual events, so data is consumed as soon as it arrives.
+# notify() never blocks the caller: events are generated from a helper thread, because event_generate
+# from a non Tk thread waits for the mainloop (which can itself be waiting on the asyncio loop).
+# notifications are coalesced, only one event per name is in flight until its handler runs.
+class TkWakeup:
+    def __init__(self, root: tk.Tk):
+        self.root = root
+        self.handlers = {}
+        self.pending = set() # names waiting for an event to be generated
+        self.in_flight = set() # names with an event generated or about to be
+        self.condition = threading.Condition()
+        self.closed = False
+        self.calls = [] # (fn, future) to run on the Tk thread
+        self.thread = threading.Thread(target=self._generate_events, daemon=True)
+        self.register('TkCall', self._run_calls)
+
+    # binds <<name>> to handler, call from the Tk thread
+    def register(self, name, handler):
+        self.handlers[name] = handler
+        self.root.bind(f'<<{name}>>', lambda event, name=name: self._dispatch(name))
+
+    def start(self):
+        self.thread.start()
+        # calls queued before the mainloop started could not generate their event
+        self.root.after_idle(self._run_calls)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            calls = self.calls
+            self.calls = []
+            self.condition.notify()
+        for fn, future in calls:
+            future.set_exception(RuntimeError('Tk mainloop closed'))
+
+    # runs fn on the Tk thread, safe to call from any thread. returns a concurrent.futures.Future with the result.
+    def call(self, fn):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                future.set_exception(RuntimeError('Tk mainloop closed'))
+                return future
+            self.calls.append((fn, future))
+        self.notify('TkCall')
+        return future
+
+    def _run_calls(self):
+        with self.condition:
+            calls = self.calls
+            self.calls = []
+        for fn, future in calls:
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+
+    # safe to call from any thread
+    def notify(self, name):
+        with self.condition:
+            if name in self.in_flight:
+                return
+            self.in_flight.add(name)
+            self.pending.add(name)
+            self.condition.notify()
+
+    def _generate_events(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                names = self.pending
+                self.pending = set()
+            for name in names:
+                try:
+                    self.root.event_generate(f'<<{name}>>', when='tail')
+                except (RuntimeError, tk.TclError):
+                    # mainloop not running or window destroyed, the next notify will try again
+                    with self.condition:
+                        self.in_flight.discard(name)
+
+    def _dispatch(self, name):
+        # clear first so data arriving while the handler runs triggers a new event
+        with self.condition:
+            self.in_flight.discard(name)
+        self.handlers[name]()
@@ -0,0 +1,149 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# PortAudio callback time of the audio block being processed. set by AudioStream before handing the block to the
+# mixer and read where the mixed audio is queued for sending, all in the same task.
+audio_captured = contextvars.ContextVar('audio_captured', default=None)
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# stages of one utterance (a transcript segment) or one ask, each span is (name, start, end) in perf_counter time.
+# marks keep the timestamps a later stage starts from (e.g. when the segment was queued for the GUI).
+class Trace:
+    def __init__(self, tracer, kind, trace_id, args):
+        self.tracer = tracer
+        self.kind = kind
+        self.id = trace_id
+        self.args = args
+        self.marks = {}
+
+    def mark(self, name):
+        self.marks[name] = time.perf_counter()
+
+    def span(self, name, start, end=None):
+        if start is None:
+            return
+        self.tracer._add(self, name, start, time.perf_counter() if end is None else end)
+
+    # span from a mark to now (or end), nothing when the mark was never set
+    def span_from(self, mark, name, end=None):
+        self.span(name, self.marks.get(mark), end)
+
+# text of a transcript segment with the trace of its utterance, consumers can use it as a plain str
+class TracedText(str):
+    trace = None
+
+# collects spans of sampled utterances and of every ask, exported in the chrome trace event format
+# (chrome://tracing or ui.perfetto.dev), each utterance and each ask on its own track.
+# 1 in 1 / sample_rate utterances are traced, asks are rare so they are all traced.
+class Tracer:
+    def __init__(self, sample_rate=0.1, path='trace.json', max_spans=50000):
+        self.sample_rate = sample_rate
+        self.path = path
+        self.epoch = time.perf_counter()
+        self.wall_epoch = time.time()
+        self.spans = deque(maxlen=max_spans) # (kind, trace id, name, start, end, args of the trace for the first span)
+        self.durations = {} # stage name -> recent durations, for stats()
+        self.ids = itertools.count(1)
+        self.utterances = 0
+        self.last_segment = None # when the last transcript segment arrived, sampled or not
+        self.lock = threading.Lock() # spans come from the asyncio loop and the Tk thread
+
+    # TRACE_SAMPLE_RATE (0 to 1) enables it, TRACE_FILE is where export() writes
+    @classmethod
+    def from_env(cls):
+        sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+        if sample_rate <= 0:
+            return None
+        return cls(min(sample_rate, 1.0), os.getenv('TRACE_FILE', 'trace.json'))
+
+    # new trace of an utterance when this one is sampled, None otherwise
+    def sample_utterance(self, **args):
+        self.utterances += 1
+        if int(self.utterances * self.sample_rate) == int((self.utterances - 1) * self.sample_rate):
+            return None
+        return Trace(self, 'utterance', next(self.ids), args)
+
+    def start_ask(self, **args):
+        return Trace(self, 'ask', next(self.ids), args)
+
+    def _add(self, trace, name, start, end):
+        with self.lock:
+            args = trace.args
+            trace.args = None # only on the first span of the track
+            self.spans.append((trace.kind, trace.id, name, start, end, args))
+            self.durations.setdefault(f'{trace.kind}.{name}', deque(maxlen=1000)).append(end - start)
+
+    # recent duration percentiles of each stage, in ms
+    def stats(self):
+        with self.lock:
+            durations = {name: list(values) for name, values in self.durations.items()}
+        return {name: {
+            'count': len(values),
+            'p50_ms': _percentile(values, 50) * 1000,
+            'p95_ms': _percentile(values, 95) * 1000,
+            'max_ms': max(values) * 1000,
+        } for name, values in durations.items()}
+
+    def chrome_trace(self):
+        with self.lock:
+            spans = list(self.spans)
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0, 'args': {'name': 'my live guru'}}]
+        for kind, trace_id, name, start, end, args in spans:
+            event = {'name': name, 'cat': kind, 'id': trace_id, 'pid': 1, 'tid': 0}
+            events.append(dict(event, ph='b', ts=round((start - self.epoch) * 1e6, 1), **({'args': args} if args else {})))
+            events.append(dict(event, ph='e', ts=round((end - self.epoch) * 1e6, 1)))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'start_time': self.wall_epoch}}
+
+    def export(self, path=None):
+        path = path or self.path
+        try:
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(self.chrome_trace(), file)
+        except OSError as e:
+            print(f'could not write trace {path}: {e}')
+            return
+        print(f'trace of {len(self.spans)} spans written to {path}')
+        for name, stats in self.stats().items():
+            print(f"  {name}: p50 {stats['p50_ms']:.0f}ms, p95 {stats['p95_ms']:.0f}ms, max {stats['max_ms']:.0f}ms ({stats['count']})")
+
+# capture, queue and send times of the audio sent on one deepgram connection, by position in the stream.
+# deepgram results give the start and duration of the words in stream seconds, lookup() finds the frame
+# holding the end of a segment.
+class AudioTimeline:
+    def __init__(self, bytes_per_second, max_frames=4000):
+        self.bytes_per_second = bytes_per_second
+        self.max_frames = max_frames
+        self.offsets = [] # stream seconds at the end of each sent frame
+        self.frames = [] # (captured, queued, sent)
+        self.sent_bytes = 0
+        self.dropped_to = 0.0 # stream seconds before the oldest frame kept
+
+    # frames is a list of (queued, captured, size) sent together at time sent
+    def sent(self, frames, sent):
+        for queued, captured, size in frames:
+            self.sent_bytes += size
+            self.offsets.append(self.sent_bytes / self.bytes_per_second)
+            self.frames.append((captured, queued, sent))
+        if len(self.frames) > 2 * self.max_frames:
+            self.dropped_to = self.offsets[-self.max_frames - 1]
+            del self.offsets[:-self.max_frames]
+            del self.frames[:-self.max_frames]
+
+    def lookup(self, offset):
+        if not self.frames or offset < self.dropped_to:
+            return None
+        return self.frames[min(bisect_left(self.offsets, offset), len(self.frames) - 1)]
+
+tracer = Tracer.from_env()
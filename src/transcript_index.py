@@ -0,0 +1,244 @@
+"""
+    positional inverted index over the session transcripts saved in TRANSCRIPTS_DIR.
+
+    * every word of every segment is posted as (segment id, position), with the segment speaker, time and file offset.
+    * new lines of the session files are indexed incrementally (refresh, or add_line for a segment the app just wrote
+      so the file isn't read back), the index is saved next to the transcripts and only the lines written since the
+      last save are read when it is opened again.
+    * queries: words must all be in the segment, "quoted words" must appear as a phrase, speaker:user / speaker:system
+      filters by speaker. e.g. speaker:system "how much" pricing
+
+    usage: python src/transcript_index.py 'speaker:system "how much"' --dir transcripts --limit 20
+"""
+
+import argparse
+import json
+import os
+import pickle
+import re
+import time
+from array import array
+import numpy as np
+from trigger_engine import normalize
+
+INDEX_FILE = '.transcript_index.pickle'
+SPEAKERS = ['user', 'system']
+POSITION_BITS = 16 # postings are segment_id << POSITION_BITS | position
+MAX_POSITION = (1 << POSITION_BITS) - 1
+
+# the log text carries the speaker prefix, it is not part of what was said
+SPEAKER_PREFIX = re.compile(r'^\s*(user|system):\s*')
+QUERY_TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+
+# values present in both sorted arrays, looking the smaller one up in the larger one
+def _intersect_sorted(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    found = np.searchsorted(b, a)
+    found[found == len(b)] = 0
+    return a[b[found] == a]
+
+# distinct values of a sorted array
+def _unique_sorted(a):
+    if len(a) == 0:
+        return a
+    keep = np.empty(len(a), dtype=bool)
+    keep[0] = True
+    np.not_equal(a[1:], a[:-1], out=keep[1:])
+    return a[keep]
+
+class TranscriptIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.postings = {} # term -> array('q') of postings, sorted because segments only get appended
+        self.speakers = array('b') # per segment: index in SPEAKERS, -1 when unknown
+        self.times = array('d')
+        self.sessions = array('i') # per segment: index in session_files
+        self.offsets = array('q') # per segment: byte offset of its line in the session file
+        self.session_files = []
+        self.session_ids = {} # session file name -> index
+        self.indexed_bytes = {} # session file name -> bytes read so far
+
+    # loads the saved index for TRANSCRIPTS_DIR and catches up with the session files. None when unset.
+    @classmethod
+    def from_env(cls):
+        directory = os.getenv('TRANSCRIPTS_DIR')
+        if not directory:
+            return None
+        return cls.open(directory)
+
+    @classmethod
+    def open(cls, directory):
+        start = time.perf_counter()
+        index = None
+        path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as file:
+                    index = pickle.load(file)
+                index.directory = directory
+            except Exception as e:
+                print(f"could not load transcript index, rebuilding it ({e})")
+                index = None
+        if index is None:
+            index = cls(directory)
+        added = index.catch_up()
+        print(f"transcript index: {len(index)} segments ({added} new) in {(time.perf_counter() - start) * 1000:.0f}ms")
+        return index
+
+    def __len__(self):
+        return len(self.times)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['directory']
+        return state
+
+    # indexes the lines appended to every session file since they were last read, returns the segments added
+    def catch_up(self):
+        if not os.path.isdir(self.directory):
+            return 0
+        added = 0
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.jsonl'):
+                added += self.refresh(os.path.join(self.directory, name))
+        return added
+
+    # indexes the new lines of one session file (only whole lines, a line being written is read next time)
+    def refresh(self, path):
+        name = os.path.basename(path)
+        offset = self.indexed_bytes.get(name, 0)
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            data = file.read()
+        added = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break
+            try:
+                segment = json.loads(line)
+                self.add(segment['text'], segment['speaker'], segment['time'], name, offset)
+                added += 1
+            except (ValueError, KeyError) as e:
+                print(f"transcript index: skipping bad line in {name} ({e})")
+            offset += len(line)
+        self.indexed_bytes[name] = offset
+        return added
+
+    # indexes a segment the app just wrote at offset in a session file, ending at end, without reading it back.
+    # reads the file instead when lines before it are not indexed yet.
+    def add_line(self, path, offset, end, text, speaker, timestamp):
+        name = os.path.basename(path)
+        if self.indexed_bytes.get(name, 0) != offset:
+            self.refresh(path)
+            return
+        self.add(text, speaker, timestamp, name, offset)
+        self.indexed_bytes[name] = end
+
+    def add(self, text, speaker, timestamp, session_file, offset):
+        session = self.session_ids.get(session_file)
+        if session is None:
+            session = self.session_ids[session_file] = len(self.session_files)
+            self.session_files.append(session_file)
+        segment_id = len(self.times)
+        self.speakers.append(SPEAKERS.index(speaker) if speaker in SPEAKERS else -1)
+        self.times.append(timestamp)
+        self.sessions.append(session)
+        self.offsets.append(offset)
+        words = normalize(SPEAKER_PREFIX.sub('', text)).split()
+        for position, word in enumerate(words[:MAX_POSITION]):
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = array('q')
+            postings.append(segment_id << POSITION_BITS | position)
+
+    # sorted postings of a term as a numpy view, only kept while a query runs (arrays can't grow while viewed)
+    def _postings(self, term):
+        postings = self.postings.get(term)
+        if postings is None:
+            return np.empty(0, dtype=np.int64)
+        return np.frombuffer(postings, dtype=np.int64)
+
+    # sorted ids of the segments containing the words in this order
+    def _phrase_segments(self, words):
+        keys = self._postings(words[0])
+        for i, word in enumerate(words[1:], 1):
+            if len(keys) == 0:
+                break
+            keys = _intersect_sorted(keys, self._postings(word) - i)
+        return _unique_sorted(keys >> POSITION_BITS)
+
+    # newest matching segments first, as dicts with time, speaker, session and text
+    def search(self, query, speaker=None, start_time=None, end_time=None, limit=50):
+        phrases = []
+        for quoted, token in QUERY_TOKEN.findall(query):
+            token = quoted or token
+            if token.startswith('speaker:'):
+                speaker = token[len('speaker:'):]
+                continue
+            words = normalize(token).split()
+            if words:
+                phrases.append(words)
+        if not phrases:
+            return []
+        # rarest phrase first so the intersections stay small
+        phrases.sort(key=lambda words: min(len(self.postings.get(word, ())) for word in words))
+        segments = None
+        for words in phrases:
+            found = self._phrase_segments(words)
+            segments = found if segments is None else _intersect_sorted(segments, found)
+            if len(segments) == 0:
+                return []
+        if speaker is not None and speaker != 'any':
+            code = SPEAKERS.index(speaker) if speaker in SPEAKERS else -2
+            segments = segments[np.frombuffer(self.speakers, dtype=np.int8)[segments] == code]
+        if start_time is not None or end_time is not None:
+            times = np.frombuffer(self.times, dtype=np.float64)[segments]
+            keep = np.ones(len(segments), dtype=bool)
+            if start_time is not None:
+                keep &= times >= start_time
+            if end_time is not None:
+                keep &= times < end_time
+            segments = segments[keep]
+        return [self.segment(int(segment_id)) for segment_id in segments[::-1][:limit]]
+
+    def segment(self, segment_id):
+        session_file = self.session_files[self.sessions[segment_id]]
+        with open(os.path.join(self.directory, session_file), 'rb') as file:
+            file.seek(self.offsets[segment_id])
+            line = json.loads(file.readline())
+        return {
+            'segment': segment_id,
+            'time': self.times[segment_id],
+            'speaker': line['speaker'],
+            'session': session_file,
+            'text': SPEAKER_PREFIX.sub('', line['text']).strip(),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='search the saved session transcripts')
+    parser.add_argument('query')
+    parser.add_argument('--dir', default=os.getenv('TRANSCRIPTS_DIR', 'transcripts'))
+    parser.add_argument('--speaker', choices=['any'] + SPEAKERS, default='any')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    index = TranscriptIndex.open(args.dir)
+    index.save()
+    start = time.perf_counter()
+    results = index.search(args.query, args.speaker, limit=args.limit)
+    print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.1f}ms")
+    for result in results:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(result['time']))} {result['session']} {result['speaker']}: {result['text']}")
+
+if __name__ == "__main__":
+    main()
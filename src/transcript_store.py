@@ -0,0 +1,82 @@
+import json
+import os
+import time
+from array import array
+
+# append-only store of every transcript segment of a session.
+# segments keep the text exactly as displayed (speaker prefixes and separators included).
+# the text is kept joined in one string with the offset of each segment, new segments wait in a short list until
+# the next text() call folds them in. text() is then a single slice of the joined string instead of a join over
+# every segment of the session, and the session is not held as one str object per segment.
+# when path is set each segment is also appended to that file as a json line.
+class TranscriptStore:
+    def __init__(self, path=None):
+        self.joined = '' # segments [0, folded) joined
+        self.folded = 0
+        self.pending = [] # segments [folded, len) not joined yet
+        self.offsets = array('q', [0]) # start of each segment in the joined text, then the end of the last one
+        self.speakers = []
+        self.times = array('d')
+        self.file = None
+        self.path = path
+        self.file_bytes = 0 # size of the session file
+        self.line_offset = 0 # where the line of the last segment starts in the session file
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # binary so the byte offsets match the file on every platform
+            self.file = open(path, 'ab')
+            self.file_bytes = self.file.tell()
+
+    # session file under TRANSCRIPTS_DIR when that env var is set
+    @classmethod
+    def from_env(cls):
+        transcripts_dir = os.getenv('TRANSCRIPTS_DIR')
+        if not transcripts_dir:
+            return cls()
+        return cls(os.path.join(transcripts_dir, time.strftime('session-%Y%m%d-%H%M%S.jsonl')))
+
+    def __len__(self):
+        return len(self.speakers)
+
+    # characters of the whole transcript
+    def chars(self):
+        return self.offsets[-1]
+
+    # returns the index of the new segment
+    def append(self, text, speaker, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        self.pending.append(text)
+        self.offsets.append(self.offsets[-1] + len(text))
+        self.speakers.append(speaker)
+        self.times.append(timestamp)
+        if self.file is not None:
+            line = (json.dumps({'time': timestamp, 'speaker': speaker, 'text': text}) + '\n').encode('utf-8')
+            self.file.write(line)
+            self.file.flush()
+            self.line_offset = self.file_bytes
+            self.file_bytes += len(line)
+        return len(self.speakers) - 1
+
+    def segment(self, index):
+        if index >= self.folded:
+            return self.pending[index - self.folded], self.speakers[index]
+        return self.joined[self.offsets[index]:self.offsets[index + 1]], self.speakers[index]
+
+    def _fold(self):
+        if self.pending:
+            self.joined += ''.join(self.pending)
+            self.folded += len(self.pending)
+            self.pending = []
+
+    def text(self, start=0, end=None):
+        count = len(self.speakers)
+        end = count if end is None else min(end, count)
+        if start >= end:
+            return ''
+        self._fold()
+        return self.joined[self.offsets[start]:self.offsets[end]]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
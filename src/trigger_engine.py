@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+
+# lowercase words separated by single spaces, punctuation dropped, so "How much?" and "how much" match alike
+def normalize(text):
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in text.lower()).split())
+
+# configured trigger rules compiled into one Aho-Corasick automaton over every phrase.
+# scanning a segment costs one automaton step per character whatever the number of rules.
+# rule fields: name, phrases (list), speaker ('user', 'system' or 'any'), prompt_id or prompt
+# (the stage prompt when neither is set), latency_class, debounce and cooldown (seconds).
+class TriggerRules:
+    def __init__(self, rules: list):
+        self.rules = {}
+        for rule in rules:
+            rule = dict(rule)
+            rule.setdefault('speaker', 'any')
+            rule.setdefault('debounce', 1.0)
+            rule.setdefault('cooldown', 30.0)
+            self.rules[rule['name']] = rule
+        # states are indexes, goto[state] maps a character to the next state
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]] # (rule name, phrase) ending at each state, fail chain included
+        for rule in self.rules.values():
+            for phrase in rule['phrases']:
+                self._add(' ' + normalize(phrase), rule['name'])
+        self._link()
+
+    # base prompt and latency class a rule asks with, falling back to the default prompt id
+    def prompt_for(self, rule_name, default_prompt_id):
+        from prompts import base_prompts, prompt_latency_classes
+        rule = self.rules[rule_name]
+        prompt_id = rule.get('prompt_id', default_prompt_id)
+        base_prompt = rule['prompt'] if 'prompt' in rule else base_prompts.get(prompt_id)
+        return base_prompt, rule.get('latency_class', prompt_latency_classes.get(prompt_id, 'standard'))
+
+    # TRIGGERS_FILE points to a json list of rules, None when unset
+    @classmethod
+    def from_env(cls):
+        path = os.getenv('TRIGGERS_FILE')
+        if not path:
+            return None
+        try:
+            with open(path, encoding='utf-8') as file:
+                return cls(json.load(file))
+        except Exception as e:
+            print(f"could not load triggers from {path}: {e}")
+            return None
+
+    def _add(self, phrase, rule_name):
+        state = 0
+        for c in phrase:
+            if c not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][c] = len(self.goto) - 1
+            state = self.goto[state][c]
+        self.outputs[state].append((rule_name, phrase))
+
+    # breadth first, so the fail state of each state is resolved before its children
+    def _link(self):
+        pending = list(self.goto[0].values())
+        while pending:
+            next_pending = []
+            for state in pending:
+                for c, child in self.goto[state].items():
+                    if state != 0:
+                        fail = self.fail[state]
+                        while fail and c not in self.goto[fail]:
+                            fail = self.fail[fail]
+                        self.fail[child] = self.goto[fail].get(c, 0)
+                    self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+                    next_pending.append(child)
+            pending = next_pending
+
+    # advances state over text, returns the new state and the (rule name, end index) of every match
+    def scan(self, state, text):
+        matches = []
+        for i, c in enumerate(text):
+            while state and c not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(c, 0)
+            for rule_name, phrase in self.outputs[state]:
+                matches.append((rule_name, i))
+        return state, matches
+
+# matches the transcript stream of each speaker against the rules, so phrases split across segments are found.
+# a match schedules its rule after the rule debounce (letting the sentence finish), further matches meanwhile
+# are merged into that firing, and the rule stays quiet for its cooldown afterwards.
+# call from the asyncio loop, on_fire(rule_name) is called there too.
+class TriggerEngine:
+    def __init__(self, rules: TriggerRules, on_fire):
+        self.rules = rules
+        self.on_fire = on_fire
+        self.states = {}
+        self.pending = {} # rule name -> timer handle
+        self.quiet_until = {}
+
+    # forgets the stream state and pending firings, for a new transcription session
+    def reset(self):
+        for timer in self.pending.values():
+            timer.cancel()
+        self.pending = {}
+        self.states = {}
+
+    def feed(self, speaker, text):
+        text = ' ' + normalize(text)
+        state, matches = self.rules.scan(self.states.get(speaker, 0), text)
+        self.states[speaker] = state
+        for rule_name, end in matches:
+            # phrases must end on a word boundary, segments always end on one
+            if end + 1 < len(text) and text[end + 1] != ' ':
+                continue
+            rule = self.rules.rules[rule_name]
+            if rule['speaker'] not in ('any', speaker):
+                continue
+            if rule_name in self.pending or time.monotonic() < self.quiet_until.get(rule_name, 0):
+                continue
+            loop = asyncio.get_running_loop()
+            self.pending[rule_name] = loop.call_later(rule['debounce'], self._fire, rule_name)
+
+    def _fire(self, rule_name):
+        del self.pending[rule_name]
+        self.quiet_until[rule_name] = time.monotonic() + self.rules.rules[rule_name]['cooldown']
+        print(f'trigger {rule_name} fired')
+        self.on_fire(rule_name)